@@ -0,0 +1,122 @@
+"""
+The databroker handlers of the QAS data files, importable without the
+beamline profile, e.g. for offline analysis:
+
+    from qas_handlers import APBBinFileHandler, register_handlers
+    register_handlers(db.reg)
+
+Importing the package is cheap: the submodules, and with them pandas, h5py
+and the databroker handlers, are imported when one of their names is used
+for the first time, and the handlers registered with register_handlers are
+imported when the broker makes the first one.
+"""
+import importlib
+
+# name -> submodule which defines it
+_exports = {
+    'FileHandlePool': 'pool',
+    'file_handle_pool': 'pool',
+    'open_hdf5': 'pool',
+    'check_hdf5_filters': 'pool',
+    'PooledHDF5Dataset': 'pool',
+    'PooledHDF5Mixin': 'pool',
+
+    'read_txt_fields': 'pizzabox',
+    'read_new_txt_fields': 'pizzabox',
+    'split_txt_lines': 'pizzabox',
+    'split_txt_fields': 'pizzabox',
+    'index_txt_lines': 'pizzabox',
+    'parse_txt_field': 'pizzabox',
+    'enc2counts_array': 'pizzabox',
+    'adc2counts_array': 'pizzabox',
+    'txt_timestamp': 'pizzabox',
+    'pizzabox_bin_fields': 'pizzabox',
+    'transcode_pizzabox_txt': 'pizzabox',
+    'pizzabox_bin_copy': 'pizzabox',
+    'PizzaBoxTranscoder': 'pizzabox',
+    'pizzabox_transcoder': 'pizzabox',
+    'load_pizzabox_bin': 'pizzabox',
+    'PizzaBoxAnHandlerTxt': 'pizzabox',
+    'PizzaBoxEncHandlerTxt': 'pizzabox',
+    'PizzaBoxDIHandlerTxt': 'pizzabox',
+    'PizzaBoxAnHandlerBin': 'pizzabox',
+    'PizzaBoxEncHandlerBin': 'pizzabox',
+    'PizzaBoxDIHandlerBin': 'pizzabox',
+    'PizzaBoxAnHandler': 'pizzabox',
+    'PizzaBoxEncHandler': 'pizzabox',
+    'PizzaBoxDIHandler': 'pizzabox',
+
+    'apb_settings': 'apb',
+    'read_apb_settings': 'apb',
+    'memmap_records': 'apb',
+    'apb_timestamp': 'apb',
+    'APBRecordData': 'apb',
+    'APBStreamData': 'apb',
+    'build_apb_pyramid': 'apb',
+    'APBRecordFileHandler': 'apb',
+    'APBBinFileHandler': 'apb',
+    'APBTriggerData': 'apb',
+    'APBTriggerFileHandler': 'apb',
+
+    'QASXspress3HDF5Handler': 'xspress3',
+    'QASXspress3HDF5Handler_light': 'xspress3',
+
+    'get_run_datum_ids': 'prefetch',
+    'prefetch_run': 'prefetch',
+    'fill_run': 'prefetch',
+
+    'pilatus_roi_sums': 'pilatus',
+    'QASAreaDetectorHDF5SWMRHandler': 'pilatus',
+}
+
+# resource spec -> handler, the only place where the specs are assigned
+handler_specs = {
+    # the binary copy of the text files is read if there is one, see PizzaBoxTranscoder
+    'PIZZABOX_AN_FILE_TXT': 'PizzaBoxAnHandler',
+    'PIZZABOX_ENC_FILE_TXT': 'PizzaBoxEncHandler',
+    'PIZZABOX_DI_FILE_TXT': 'PizzaBoxDIHandler',
+    'PIZZABOX_AN_FILE_BIN': 'PizzaBoxAnHandlerBin',
+    'PIZZABOX_ENC_FILE_BIN': 'PizzaBoxEncHandlerBin',
+    'PIZZABOX_DI_FILE_BIN': 'PizzaBoxDIHandlerBin',
+    'APB': 'APBBinFileHandler',
+    'APB_TRIGGER': 'APBTriggerFileHandler',
+    'XSP3': 'QASXspress3HDF5Handler',
+    'AD_HDF5_SWMR': 'QASAreaDetectorHDF5SWMRHandler',
+}
+
+__all__ = list(_exports) + ['handler_specs', 'lazy_handler', 'register_handlers']
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_exports[name]}', __name__), name)
+    globals()[name] = value  # the next lookups don't go through __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
+
+
+def lazy_handler(name):
+    '''
+    Stand-in for the handler class name for the registry, which imports the
+    class when the broker makes the first handler. It has the name of the
+    class, which the registry uses in the keys of its handler cache.
+    '''
+    def make_handler(*args, **kwargs):
+        return __getattr__(name)(*args, **kwargs)
+    make_handler.__name__ = make_handler.__qualname__ = name
+    return make_handler
+
+
+def register_handlers(reg, overwrite=True, lazy=True):
+    '''
+    Register the QAS handlers with the registry of a v0 broker (db.reg) for
+    the specs in handler_specs. With lazy=False the classes themselves are
+    registered, which imports all the handler modules.
+    '''
+    for spec, name in handler_specs.items():
+        handler = lazy_handler(name) if lazy else __getattr__(name)
+        reg.register_handler(spec, handler, overwrite=overwrite)
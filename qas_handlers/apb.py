@@ -0,0 +1,451 @@
+"""
+Handlers of the APB (analog pizza box) stream and trigger files.
+"""
+import copy
+import functools
+import hashlib
+import logging
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from databroker.assets.handlers_base import HandlerBase
+
+from .pool import file_handle_pool
+
+logger = logging.getLogger(__name__)
+
+
+apb_settings = namedtuple('apb_settings', ['gains', 'offsets', 'fa_divide', 'fa_rate', 'trigger_timestamp'])
+
+
+@functools.lru_cache(maxsize=256)
+def _read_apb_settings(fpath_txt, mtime):
+    with open(fpath_txt, 'r') as fp:
+        content = [x.strip() for x in fp.readlines()]
+    values = [line.split(':', 1)[1].strip() for line in content[:6]]
+
+    # values[0] is not used
+    return apb_settings(gains=np.array([int(x) for x in values[1].split(',')]),
+                        offsets=np.array([int(x) for x in values[2].split(',')]),
+                        fa_divide=float(values[3]),
+                        fa_rate=float(values[4]),
+                        trigger_timestamp=float(values[5].replace(',', '.')))
+
+
+def read_apb_settings(fpath_txt):
+    """
+    Parse the settings file written next to the APB stream (see
+    AnalogPizzaBoxStream.filename_txt): gains, offsets, FA divide and rate
+    and the trigger timestamp. The result is cached per file, so all the
+    datums of a resource share one parse.
+    """
+    return _read_apb_settings(fpath_txt, os.path.getmtime(fpath_txt))
+
+
+def memmap_records(fpath, dtype):
+    """
+    Memory-map the complete records of a binary file without copying them.
+    A partially written last record is left out.
+    """
+    dtype = np.dtype(dtype)
+    num_records = os.path.getsize(fpath) // dtype.itemsize
+    if num_records == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(fpath, dtype=dtype, mode='r', shape=(num_records,))
+
+
+def apb_timestamp(ts_s, ts_ticks, ns_timestamps=False):
+    """
+    Convert the APB seconds and ticks (8.0051232 ns each) to float Unix
+    timestamps or, with ns_timestamps=True, to exact int64 nanoseconds
+    since the epoch, with the ticks rounded to the nearest nanosecond.
+    """
+    if ns_timestamps:
+        ticks_ns = (np.asarray(ts_ticks, dtype=np.int64) * 80051232 + 5000000) // 10000000
+        return np.asarray(ts_s, dtype=np.int64) * 10**9 + ticks_ns
+    return ts_s + ts_ticks * APBRecordData.tick  # Unix timestamp with nanoseconds
+
+
+class APBRecordData:
+    """
+    Named columns of a memory-mapped APB file, of int32 records which end
+    with the seconds and ticks of their timestamp (see APBStreamData and
+    APBTriggerData).
+
+    The columns are int32 views into the mapped file, the timestamp is
+    derived when it is requested, so nothing is read from disk until a
+    column is actually used. With ns_timestamps=True the timestamp is in
+    int64 nanoseconds (see apb_timestamp), and so are the time windows.
+    """
+    columns = ['timestamp']
+    tick = 8.0051232 * 1e-9  # the APB timestamps count seconds and ticks of 8.0051232 ns
+    search_step = 4096  # records between the timestamps of the first pass of search_timestamp
+
+    def __init__(self, records, ns_timestamps=False):
+        self.records = records
+        self.ns_timestamps = ns_timestamps
+
+    def __len__(self):
+        return self.records.size
+
+    def __getitem__(self, key):
+        if key == 'timestamp':
+            return apb_timestamp(self.records['ts_s'], self.records['ts_ticks'], ns_timestamps=self.ns_timestamps)
+        if key not in self.columns:
+            raise KeyError(key)
+        return self.records[key]
+
+    def keys(self):
+        return list(self.columns)
+
+    def timestamp_at(self, index):
+        record = self.records[index]
+        return apb_timestamp(record['ts_s'], record['ts_ticks'], ns_timestamps=self.ns_timestamps)
+
+    def search_timestamp(self, timestamp, side='left'):
+        """
+        np.searchsorted of the (monotonic) timestamps, first on those of every
+        search_step-th record, then on those of the records between the two
+        found, so only a few pages of the mapped file are read.
+        """
+        step = self.search_step
+        coarse = self.records[::step]
+        i = int(np.searchsorted(apb_timestamp(coarse['ts_s'], coarse['ts_ticks'], ns_timestamps=self.ns_timestamps),
+                                timestamp, side=side))
+        # the position is after the record (i - 1) * step and at most i * step
+        lo, hi = max((i - 1) * step + 1, 0), min(i * step, len(self))
+        fine = self.records[lo:hi]
+        return lo + int(np.searchsorted(apb_timestamp(fine['ts_s'], fine['ts_ticks'], ns_timestamps=self.ns_timestamps),
+                                        timestamp, side=side))
+
+    def time_slice(self, t_start=None, t_stop=None):
+        """
+        Return the rows with t_start <= timestamp <= t_stop as a new view of
+        the same mapped file.
+        """
+        start = 0 if t_start is None else self.search_timestamp(t_start, side='left')
+        stop = len(self) if t_stop is None else self.search_timestamp(t_stop, side='right')
+        sliced = copy.copy(self)
+        sliced.records = self.records[start:max(start, stop)]
+        return sliced
+
+    def to_dataframe(self):
+        data = {key: np.asarray(self[key], dtype=np.float64) for key in self.columns[1:]}
+        data['timestamp'] = self['timestamp'] if self.ns_timestamps else np.asarray(self['timestamp'], dtype=np.float64)
+        return pd.DataFrame(data, columns=self.columns)
+
+
+class APBStreamData(APBRecordData):
+    """
+    Named columns of a memory-mapped APB stream, see APBRecordData. With
+    the settings of the stream, the channels are returned in volts.
+    """
+    columns = ['timestamp', 'i0', 'it', 'ir', 'iff', 'aux1', 'aux2', 'aux3', 'aux4']
+
+    def __init__(self, records, settings=None, ns_timestamps=False):
+        super().__init__(records, ns_timestamps=ns_timestamps)
+        self.settings = settings
+
+    def __getitem__(self, key):
+        channel = self.columns.index(key) - 1 if key in self.columns else -1
+        if self.settings is not None and 0 <= channel < len(self.settings.gains):
+            return (self.records[key] - self.settings.offsets[channel]) / self.settings.gains[channel]
+        return super().__getitem__(key)
+
+    def volts(self):
+        """
+        Convert all the channels with a gain/offset in the settings to volts
+        at once, (counts - offset) / gain over the mapped int32 values.
+        """
+        num_channels = len(self.settings.gains)
+        raw = self.records.view(np.int32).reshape(len(self), -1)
+        return (raw[:, :num_channels] - self.settings.offsets) / self.settings.gains
+
+    def to_dataframe(self):
+        if self.settings is None:
+            return super().to_dataframe()
+        data = {'timestamp': self['timestamp'] if self.ns_timestamps
+                else np.asarray(self['timestamp'], dtype=np.float64)}
+        volts = self.volts()
+        for i, key in enumerate(self.columns[1:]):
+            data[key] = volts[:, i] if i < volts.shape[1] else np.asarray(self.records[key], dtype=np.float64)
+        return pd.DataFrame(data, columns=self.columns)
+
+
+def _pairwise(values, reduce):
+    # reduce the bins two by two, the last bin stays alone if their number is odd
+    num_pairs = len(values) // 2
+    reduced = reduce(values[:2 * num_pairs].reshape(num_pairs, 2, -1), axis=1)
+    if len(values) % 2:
+        reduced = np.concatenate([reduced, values[-1:]])
+    return reduced
+
+
+def _reduce_bins(block, bin_size):
+    # min, max and int64 sum of every bin_size rows of block, the last bin
+    # has the remaining rows
+    num_full = len(block) // bin_size
+    full = block[:num_full * bin_size].reshape(num_full, bin_size, -1)
+    mins, maxs, sums = [full.min(axis=1)], [full.max(axis=1)], [full.sum(axis=1, dtype=np.int64)]
+    if len(block) % bin_size:
+        rest = block[num_full * bin_size:]
+        mins.append(rest.min(axis=0, keepdims=True))
+        maxs.append(rest.max(axis=0, keepdims=True))
+        sums.append(rest.sum(axis=0, keepdims=True, dtype=np.int64))
+    return np.concatenate(mins), np.concatenate(maxs), np.concatenate(sums)
+
+
+def _bin_counts(num_samples, num_bins, bin_size):
+    counts = np.full(num_bins, bin_size, dtype=np.int64)
+    if num_bins:
+        counts[-1] = num_samples - (num_bins - 1) * bin_size
+    return counts
+
+
+def build_apb_pyramid(raw, base_level=6, min_bins=1024, block_size=2**20):
+    """
+    Min/max/mean decimation of the channels of an APB file, raw is the
+    (num_samples, num_channels) int32 view of the mapped records. Level k
+    has one bin per 2**k samples (the last bin may have fewer), the levels
+    go from base_level up to the first one with at most min_bins bins.
+    The raw file is read once, block_size samples at a time.
+
+    Returns a dict of arrays for np.savez: num_samples, levels and min_<k>,
+    max_<k> (int32 counts) and mean_<k> (float32 counts) for every level.
+    """
+    num_samples, num_channels = raw.shape
+    bin_size = 2**base_level
+    block_size = max(bin_size, block_size - block_size % bin_size)
+    reduced = [_reduce_bins(np.asarray(raw[start:start + block_size]), bin_size)
+               for start in range(0, num_samples, block_size)]
+    if reduced:
+        mins, maxs, sums = (np.concatenate(arrays) for arrays in zip(*reduced))
+    else:
+        mins = maxs = np.zeros((0, num_channels), dtype=np.int32)
+        sums = np.zeros((0, num_channels), dtype=np.int64)
+
+    pyramid = {'num_samples': np.int64(num_samples)}
+    levels = []
+    level = base_level
+    while True:
+        counts = _bin_counts(num_samples, len(sums), 2**level)
+        pyramid[f'min_{level}'] = mins.astype(np.int32)
+        pyramid[f'max_{level}'] = maxs.astype(np.int32)
+        pyramid[f'mean_{level}'] = (sums / counts[:, None]).astype(np.float32)
+        levels.append(level)
+        if len(sums) <= min_bins:
+            break
+        mins, maxs, sums = _pairwise(mins, np.min), _pairwise(maxs, np.max), _pairwise(sums, np.sum)
+        level += 1
+    pyramid['levels'] = np.array(levels)
+    return pyramid
+
+
+class APBRecordFileHandler(HandlerBase):
+    """
+    Memory-mapped APB *.bin files of record_dtype records, read as
+    data_class (see APBRecordData) by the stream and trigger handlers.
+    """
+    data_class = APBRecordData
+    record_dtype = np.dtype([('ts_s', '<i4'), ('ts_ticks', '<i4')])
+
+    def __init__(self, fpath, lazy=False, ns_timestamps=False):
+        """
+        With lazy=True the handler returns the data_class view of the mapped
+        file, otherwise the DataFrame with all columns in float64, as before.
+        With ns_timestamps=True the timestamps (and t_start/t_stop of the
+        time windows) are int64 nanoseconds.
+        """
+        self.fpath = fpath
+        self.lazy = lazy
+        self.ns_timestamps = ns_timestamps
+        self._df = None
+
+    @property
+    def records(self):
+        # the memory map comes from file_handle_pool, so it is mapped again if
+        # it was evicted, or if the file has grown (or was rewritten) since
+        stat = os.stat(self.fpath)
+        return file_handle_pool.get((self.fpath, self.record_dtype, stat.st_size, stat.st_mtime_ns),
+                                    lambda: memmap_records(self.fpath, self.record_dtype))
+
+    @property
+    def data(self):
+        return self.data_class(self.records, ns_timestamps=self.ns_timestamps)
+
+    @property
+    def raw_data(self):
+        # (num_records, num_values) int32 view of the mapped file
+        return self.records.view(np.int32).reshape(-1, len(self.record_dtype))
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = self.data.to_dataframe()
+        return self._df
+
+    def __call__(self, t_start=None, t_stop=None):
+        """
+        Return the whole file, or only the records between t_start and
+        t_stop (Unix timestamps or nanoseconds, inclusive) if a time window
+        is given.
+        """
+        if t_start is None and t_stop is None:
+            return self.data if self.lazy else self.df
+
+        data = self.data.time_slice(t_start, t_stop)
+        if self.lazy:
+            return data
+        return data.to_dataframe()
+
+
+class APBBinFileHandler(APBRecordFileHandler):
+    "Read electrometer *.bin files"
+    data_class = APBStreamData
+    record_dtype = np.dtype([(name, '<i4') for name in APBStreamData.columns[1:]] +
+                            [('ts_s', '<i4'), ('ts_ticks', '<i4')])
+
+    def __init__(self, fpath, lazy=False, volts=False, ns_timestamps=False):
+        """
+        The file is memory-mapped as records of 10 int32 values (8 channels,
+        seconds and ticks), see APBRecordFileHandler. With volts=True the
+        channels are converted with the gains and offsets from the .txt
+        settings file.
+        """
+        super().__init__(fpath, lazy=lazy, ns_timestamps=ns_timestamps)
+        self.volts = volts
+
+    @property
+    def data(self):
+        settings = self.settings if self.volts else None
+        return self.data_class(self.records, settings=settings, ns_timestamps=self.ns_timestamps)
+
+    @property
+    def settings(self):
+        # It's a text config file, which we don't store in the resources yet, parsing for now
+        return read_apb_settings(f'{os.path.splitext(self.fpath)[0]}.txt')
+
+    pyramid_base_level = 6  # the finest bins of the pyramid have 64 samples
+    # the pyramids are not written next to the raw data
+    pyramid_cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                                     'qas', 'apb_pyramids')
+
+    @property
+    def pyramid_path(self):
+        # one cache file per .bin file, also for the files with the same name in different directories
+        path_hash = hashlib.sha1(os.path.abspath(self.fpath).encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(self.fpath))[0]
+        return os.path.join(self.pyramid_cache_dir, f'{name}.{path_hash}.pyramid.npz')
+
+    def pyramid(self):
+        """
+        The min/max/mean decimation of the stream (see build_apb_pyramid),
+        cached in a .pyramid.npz file in pyramid_cache_dir. It is built on
+        the first use and again if the .bin file has changed since, the
+        arrays are only read from the cache file when they are used.
+        """
+        records = self.data.records
+        mtime = os.path.getmtime(self.fpath)
+        key = (self.pyramid_path, len(records), mtime)
+        return file_handle_pool.get(key, lambda: self._load_pyramid(records, mtime))
+
+    def _load_pyramid(self, records, mtime):
+        if os.path.exists(self.pyramid_path):
+            pyramid = np.load(self.pyramid_path)
+            if (pyramid['num_samples'] == len(records) and pyramid['source_mtime'] == mtime
+                    and pyramid['levels'][0] == self.pyramid_base_level):
+                return pyramid
+            pyramid.close()
+        num_channels = len(self.data_class.columns) - 1
+        raw = records.view(np.int32).reshape(len(records), -1)[:, :num_channels]
+        pyramid = build_apb_pyramid(raw, base_level=self.pyramid_base_level)
+        tmp_path = f'{self.pyramid_path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(self.pyramid_cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, source_mtime=mtime, **pyramid)
+            os.replace(tmp_path, self.pyramid_path)
+        except OSError:
+            # e.g. no space left in the cache, the pyramid is only kept in memory
+            logger.warning('Could not write the APB pyramid %s', self.pyramid_path, exc_info=True)
+            return pyramid
+        return np.load(self.pyramid_path)
+
+    def decimated(self, max_points=2000, t_start=None, t_stop=None):
+        """
+        The samples between t_start and t_stop (the whole stream by default)
+        reduced to at most max_points rows for plotting, from the finest
+        level of the pyramid which fits. Returns a DataFrame with the
+        timestamp of the first sample of every bin and <channel>_min,
+        <channel>_max and <channel>_mean columns, in volts with volts=True.
+        If the window has at most max_points samples, they are returned as
+        they are, with the same value in the three columns.
+        """
+        data = self.data
+        start = 0 if t_start is None else data.search_timestamp(t_start, side='left')
+        stop = len(data) if t_stop is None else data.search_timestamp(t_stop, side='right')
+        stop = max(start, stop)
+        channels = self.data_class.columns[1:]
+        raw = data.records.view(np.int32).reshape(len(data), -1)[:, :len(channels)]
+
+        # the finest level of bins of 2**level samples which fits, the levels
+        # below the pyramid are reduced from the (at most 2**base_level *
+        # max_points) samples of the window
+        level = max(0, int(np.ceil(np.log2(max(1, stop - start) / max_points))))
+        step = 2**level
+        first, last = start // step, -(-stop // step)
+        origin = first * step  # the first sample of the first bin
+        if level == 0:
+            mins = maxs = raw[start:stop]
+            means = mins.astype(np.float64)
+        else:
+            if level < self.pyramid_base_level:
+                mins, maxs, sums = _reduce_bins(np.asarray(raw[first * step:stop]), step)
+                counts = _bin_counts(stop - first * step, len(sums), step)[:, None]
+            else:
+                pyramid = self.pyramid()
+                level = min(level, pyramid['levels'][-1])
+                step = 2**level
+                first, last = start // step, -(-stop // step)
+                mins = pyramid[f'min_{level}'][first:last]
+                maxs = pyramid[f'max_{level}'][first:last]
+                num_bins = len(pyramid[f'min_{level}'])
+                counts = _bin_counts(int(pyramid['num_samples']), num_bins, step)[first:last, None]
+                sums = pyramid[f'mean_{level}'][first:last] * counts
+                origin = first * step
+            # the window is not aligned on the bins and the top level of the
+            # pyramid can have up to min_bins bins, they are reduced further
+            # to max_points
+            while len(mins) > max(1, max_points):
+                mins, maxs = _pairwise(mins, np.min), _pairwise(maxs, np.max)
+                sums, counts = _pairwise(sums, np.sum), _pairwise(counts, np.sum)
+                step *= 2
+            means = sums / counts
+
+        records = data.records[origin:stop:step]
+        result = {'timestamp': apb_timestamp(records['ts_s'], records['ts_ticks'], ns_timestamps=self.ns_timestamps)}
+        settings = self.settings if self.volts else None
+        for i, channel in enumerate(channels):
+            low, high, mean = mins[:, i].astype(np.float64), maxs[:, i].astype(np.float64), means[:, i]
+            if settings is not None and i < len(settings.gains):
+                gain, offset = settings.gains[i], settings.offsets[i]
+                low, high, mean = (low - offset) / gain, (high - offset) / gain, (mean - offset) / gain
+                if gain < 0:
+                    low, high = high, low
+            result.update({f'{channel}_min': low, f'{channel}_max': high, f'{channel}_mean': mean})
+        return pd.DataFrame(result)
+
+
+class APBTriggerData(APBRecordData):
+    """
+    Named columns of a memory-mapped APB trigger file, see APBRecordData.
+    """
+    columns = ['timestamp', 'transition']
+
+
+class APBTriggerFileHandler(APBRecordFileHandler):
+    "Read APB trigger *.bin files"
+    data_class = APBTriggerData
+    record_dtype = np.dtype([('transition', '<i4'), ('ts_s', '<i4'), ('ts_ticks', '<i4')])
@@ -0,0 +1,187 @@
+"""
+Handler of the Pilatus HDF5 files written in SWMR mode.
+"""
+import numpy as np
+# Note: the databroker is v0 and follows the old code path, so it uses databroker.assets.handlers.AreaDetectorHDF5SWMRHandler.
+# from area_detector_handlers.handlers import AreaDetectorHDF5SWMRHandler
+from databroker.assets.handlers import AreaDetectorHDF5SWMRHandler, ImageStack
+
+from .pool import PooledHDF5Mixin, check_hdf5_filters, shared_dataset
+
+
+def pilatus_roi_sums(dataset, rois, max_block_bytes=2**26):
+    '''
+    Sums of rectangular ROIs in every frame of a (frames, rows, cols) image
+    stack, computed from the stored images instead of the IOC ROI plugins.
+
+    rois is like PilatusBase.roi_metadata, {'roi1': {'x': ..., 'dx': ...,
+    'y': ..., 'dy': ...}, ...}, or with (x, y, dx, dy) tuples as returned by
+    get_roi_coords. The ROIs are clipped to the image. Only the bounding box
+    of all the ROIs is read, max_block_bytes of it at a time, so the whole
+    stack is never in memory. Returns {roi name: int64 sums per frame}.
+    '''
+    num_frames, num_rows, num_cols = dataset.shape
+    bounds = {}
+    for name, roi in rois.items():
+        x, y, dx, dy = (roi['x'], roi['y'], roi['dx'], roi['dy']) if isinstance(roi, dict) else roi
+        x, y, dx, dy = int(x), int(y), max(int(dx), 0), max(int(dy), 0)
+        bounds[name] = (min(max(y, 0), num_rows), min(max(y + dy, 0), num_rows),
+                        min(max(x, 0), num_cols), min(max(x + dx, 0), num_cols))
+
+    sums = {name: np.zeros(num_frames, dtype=np.int64) for name in rois}
+    non_empty = {name: b for name, b in bounds.items() if b[1] > b[0] and b[3] > b[2]}
+    if not non_empty or not num_frames:
+        return sums
+    y_min = min(b[0] for b in non_empty.values())
+    y_max = max(b[1] for b in non_empty.values())
+    x_min = min(b[2] for b in non_empty.values())
+    x_max = max(b[3] for b in non_empty.values())
+
+    frame_bytes = (y_max - y_min) * (x_max - x_min) * dataset.dtype.itemsize
+    frames_per_block = max(1, max_block_bytes // frame_bytes)
+    for start in range(0, num_frames, frames_per_block):
+        stop = min(start + frames_per_block, num_frames)
+        block = dataset[start:stop, y_min:y_max, x_min:x_max]
+        for name, (y0, y1, x0, x1) in non_empty.items():
+            sums[name][start:stop] = block[:, y0 - y_min:y1 - y_min, x0 - x_min:x1 - x_min].sum(axis=(1, 2),
+                                                                                            dtype=np.int64)
+    return sums
+
+
+class QASAreaDetectorHDF5SWMRHandler(PooledHDF5Mixin, AreaDetectorHDF5SWMRHandler):
+    '''
+    The reason we need this custom handles is that the reference to `self._dataset` is not refreshed correctly,
+    so we redefine `self._dataset` on every call.
+
+    file = "<path>/575d134b-adf9-453a-a1a8_000000.h5"
+    swmr = AreaDetectorHDF5SWMRHandler(file)
+
+
+    In [150]: swmr._file["/entry/data/data"]
+    Out[150]: <HDF5 dataset "data": shape (3, 1043, 981), type "<u2">
+
+    In [151]: swmr._dataset
+    Out[151]: <HDF5 dataset "data": shape (1, 1043, 981), type "<u2">
+
+    ERROR:
+    ------
+
+    In [186]: list(swmr(0))
+    Out[186]:
+    [Frame([[    0,     0,     0, ...,     0,     0,     0],
+            [    0,     0,     0, ...,     0,     0,     0],
+            [    0,     0,     0, ...,     0,     0,     0],
+            ...,
+            [    0,     0,     0, ..., 65534, 65534, 65534],
+            [    0,     0,     0, ..., 65534, 65534, 65534],
+            [    0,     0,     0, ..., 65534, 65534, 65534]], dtype=uint16)]
+
+    In [187]: list(swmr(1))
+    ---------------------------------------------------------------------------
+    IndexError                                Traceback (most recent call last)
+    Cell In[187], line 1
+    ----> 1 list(swmr(1))
+
+    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/slicerator/__init__.py:226, in <genexpr>(.0)
+        225 def __iter__(self):
+    --> 226     return (self._get(i) for i in self.indices)
+
+    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/slicerator/__init__.py:206, in Slicerator._get(self, key)
+        205 def _get(self, key):
+    --> 206     return self._ancestor[key]
+
+    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/slicerator/__init__.py:187, in Slicerator.from_class.<locals>.SliceratorSubclass.__getitem__(self, i)
+        185 indices, new_length = key_to_indices(i, len(self))
+        186 if new_length is None:
+    --> 187     return self._get(indices)
+        188 else:
+        189     return cls(self, indices, new_length, propagate_attrs)
+
+    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/pims/base_frames.py:100, in FramesSequence.__getitem__(self, key)
+        97 def __getitem__(self, key):
+        98     """__getitem__ is handled by Slicerator. In all pims readers, the data
+        99     returning function is get_frame."""
+    --> 100     return self.get_frame(key)
+
+    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/databroker/assets/handlers.py:37, in ImageStack.get_frame(self, i)
+        36 def get_frame(self, i):
+    ---> 37     return Frame(self._dataset[self._start + i], frame_no=i)
+
+    File h5py/_objects.pyx:54, in h5py._objects.with_phil.wrapper()
+
+    File h5py/_objects.pyx:55, in h5py._objects.with_phil.wrapper()
+
+    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/h5py/_hl/dataset.py:741, in Dataset.__getitem__(self, args, new_dtype)
+        739 if self._fast_read_ok and (new_dtype is None):
+        740     try:
+    --> 741         return self._fast_reader.read(args)
+        742     except TypeError:
+        743         pass  # Fall back to Python read pathway below
+
+    File h5py/_selector.pyx:355, in h5py._selector.Reader.read()
+
+    File h5py/_selector.pyx:151, in h5py._selector.Selector.apply_args()
+
+    IndexError: Index (1) out of range for (0-0)
+
+    The reason is that the parent refreshes only `self._dataset.id`, while h5py caches the shape (and the fast
+    reader) of the datasets of read-only files, which are updated by `self._dataset.refresh()`. So here the dataset
+    is looked up once (see shared_dataset, there is one dataset object per file) and refreshed only when a frame
+    past the last known extent is requested, and the frames which have not been read yet can be polled with
+    `new_frames()` during the acquisition.
+    The file comes from `file_handle_pool`, see PooledHDF5Mixin, and is kept open (not evicted) as long as the
+    ImageStacks returned by the handler are alive, so they are not cached by the handler.
+    '''
+    swmr = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._num_frames = 0  # extent of the dataset at the last refresh
+        self._num_frames_read = 0  # frames already returned by new_frames()
+
+    def refresh(self):
+        """
+        Refresh the metadata of the dataset, returns the number of frames visible now.
+        """
+        self._get_file()
+        if self._dataset is None:
+            # the dataset object of the file, also read by dask_array() and the other handlers
+            self._dataset = shared_dataset(self._file, self._key)
+            check_hdf5_filters(self._dataset)
+        self._dataset.refresh()
+        self._num_frames = self._dataset.shape[0]
+        return self._num_frames
+
+    @property
+    def num_frames(self):
+        return self._num_frames
+
+    def new_frames(self):
+        """
+        Return the frames written since the previous call (as an array, empty if there are none).
+        """
+        with self._pinned_file():
+            start = self._num_frames_read
+            stop = self.refresh()
+            self._num_frames_read = max(start, stop)
+            return self._dataset[start:self._num_frames_read]
+
+    def roi_sums(self, rois, max_block_bytes=2**26):
+        """
+        Sums of the ROIs in all the frames written so far, see pilatus_roi_sums.
+        """
+        with self._pinned_file():
+            self.refresh()
+            return pilatus_roi_sums(self._dataset, rois, max_block_bytes=max_block_bytes)
+
+    def _reset_datasets(self):
+        super()._reset_datasets()
+        self._num_frames = 0
+
+    def __call__(self, point_number):
+        # not AreaDetectorHDF5SWMRHandler.__call__, which refreshes on every call and caches the stacks
+        def make_stack():
+            if self._dataset is None or (point_number + 1) * self._fpp > self._num_frames:
+                self.refresh()
+            return ImageStack(self._dataset, point_number * self._fpp, (point_number + 1) * self._fpp)
+        return self._pin_file(make_stack)
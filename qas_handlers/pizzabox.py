@@ -0,0 +1,512 @@
+"""
+Handlers of the pizza box encoder, ADC and DI files, as text or as the binary
+copies written by transcode_pizzabox_txt.
+"""
+import logging
+import os
+import queue
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from databroker.assets.handlers_base import HandlerBase
+
+from .pool import file_handle_pool
+
+logger = logging.getLogger(__name__)
+
+fc = 7.62939453125e-05
+adc2counts = lambda x: ((int(x, 16) >> 8) - 0x40000) * fc \
+        if (int(x, 16) >> 8) > 0x1FFFF else (int(x, 16) >> 8)*fc
+enc2counts = lambda x: int(x) if int(x) <= 0 else -(int(x) ^ 0xffffff - 1)
+
+# ASCII code -> digit value (hex digits included), -1 for everything else
+_ascii_digits = np.full(256, -1, dtype=np.int8)
+_ascii_digits[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+_ascii_digits[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+_ascii_digits[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+
+
+def read_txt_fields(fpath):
+    '''
+    Reads a space separated pizza box text file as raw bytes.
+
+    Returns the byte buffer together with the start/end byte offsets of every
+    field, see split_txt_fields.
+    '''
+    buf = np.fromfile(fpath, dtype=np.uint8)
+    starts, ends = split_txt_fields(buf, fpath=fpath)
+    return buf, starts, ends
+
+
+def read_new_txt_fields(fpath, offset=0):
+    '''
+    read_txt_fields for a file which is still being written: only the
+    complete lines after the byte offset are read. Returns the buffer, the
+    field offsets (in the buffer) and the offset to pass to the next call,
+    after the last complete line.
+    '''
+    try:
+        with open(fpath, 'rb') as f:
+            f.seek(offset)
+            buf = np.frombuffer(f.read(), dtype=np.uint8)
+    except FileNotFoundError:
+        buf = np.zeros(0, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == ord('\n'))
+    buf = buf[:newlines[-1] + 1] if newlines.size else buf[:0]
+    starts, ends = split_txt_fields(buf, fpath=fpath)
+    return buf, starts, ends, offset + buf.size
+
+
+def split_txt_lines(buf, fpath='', skip_blank_lines=True):
+    '''
+    Finds the start/end byte offsets of the lines in buf, the ends without
+    the newline and the trailing tabs or carriage returns. The blank lines
+    are dropped like pd.read_csv does or, with skip_blank_lines=False, raise
+    a ValueError, for the readers which need the line numbers of the file.
+    '''
+    newlines = np.flatnonzero(buf == ord('\n'))
+    if buf.size and buf[-1] != ord('\n'):
+        newlines = np.append(newlines, buf.size)
+    line_starts = np.concatenate(([0], newlines[:-1] + 1))[:newlines.size]
+    line_ends = newlines.copy()
+    for _ in range(2):
+        last = buf[np.maximum(line_ends - 1, 0)]
+        line_ends -= ((last == ord('\t')) | (last == ord('\r'))) & (line_ends > line_starts)
+    blank = line_ends == line_starts
+    if blank.any():
+        if not skip_blank_lines:
+            raise ValueError(f'{fpath} has blank lines (line {np.flatnonzero(blank)[0] + 1})')
+        line_starts, line_ends = line_starts[~blank], line_ends[~blank]
+    return line_starts, line_ends
+
+
+def split_txt_fields(buf, fpath='', skip_blank_lines=True):
+    '''
+    Finds the start/end byte offsets of every field of the space separated
+    lines in buf, both of shape (num_lines, num_columns). Nothing is converted
+    here, use parse_txt_field to decode the columns which are actually needed.
+    For skip_blank_lines see split_txt_lines.
+    '''
+    line_starts, line_ends = split_txt_lines(buf, fpath=fpath, skip_blank_lines=skip_blank_lines)
+    spaces = np.flatnonzero(buf == ord(' '))
+    num_lines = line_starts.size
+    if num_lines == 0 and spaces.size == 0:
+        return np.empty((0, 0), dtype=np.int64), np.empty((0, 0), dtype=np.int64)
+    if num_lines == 0 or spaces.size % num_lines:
+        raise ValueError(f'{fpath} does not have the same number of columns on every line')
+    spaces = spaces.reshape(num_lines, -1)
+    if spaces.shape[1] and not (np.all(spaces[:, 0] > line_starts) and np.all(spaces[:, -1] < line_ends)):
+        raise ValueError(f'{fpath} does not have the same number of columns on every line')
+
+    # the columns are contiguous (Fortran order), they are decoded one by one
+    starts = np.empty((num_lines, spaces.shape[1] + 1), dtype=np.int64, order='F')
+    ends = np.empty_like(starts)
+    starts[:, 0], starts[:, 1:] = line_starts, spaces + 1
+    ends[:, :-1], ends[:, -1] = spaces, line_ends
+    return starts, ends
+
+
+def index_txt_lines(fpath, block_size=2**24):
+    '''
+    Returns an int64 array with the byte offset of every line start followed
+    by the file size, so line i spans offsets[i]:offsets[i + 1]. The file is
+    scanned block by block and never held in memory as a whole.
+    '''
+    offsets = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    with open(fpath, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            offsets.append(newlines.astype(np.int64) + position + 1)
+            position += len(block)
+    offsets = np.concatenate(offsets)
+    if offsets[-1] != position:
+        # the last line does not end with a newline
+        offsets = np.append(offsets, position)
+    return offsets
+
+
+def parse_txt_field(buf, starts, ends, base=10):
+    '''
+    Vectorized int(x, base) for one column of fields found by read_txt_fields.
+    Characters which are not digits of the base (the '0x' prefix, trailing
+    tabs or carriage returns) are skipped, a leading '-' negates the value.
+    '''
+    starts, ends = np.asarray(starts), np.asarray(ends)
+    result = np.zeros(starts.size, dtype=np.int64)
+    if starts.size == 0:
+        return result
+    width = int((ends - starts).max())
+    if buf.size < np.iinfo(np.int32).max - width:
+        starts, ends = starts.astype(np.int32), ends.astype(np.int32)
+    last = buf.size - 1
+    for k in range(width):
+        positions = starts + k
+        digits = _ascii_digits[buf[np.minimum(positions, last)]]
+        valid = (digits >= 0) & (digits < base) & (positions < ends)
+        result = np.where(valid, result * base + digits, result)
+    return np.where(buf[starts] == ord('-'), -result, result)
+
+
+def enc2counts_array(encoder, unwrap=False, previous=None):
+    '''
+    Vectorized version of enc2counts for the whole encoder column, same
+    values as the lambda by default.
+    With unwrap=True the rollover of the 24-bit counter is removed, so the
+    positions stay continuous over the whole trajectory. For the files read
+    piece by piece (read_new_txt_fields), previous is the last unwrapped
+    count of the previous piece.
+    '''
+    encoder = np.asarray(encoder, dtype=np.int64)
+    # same as the enc2counts lambda, note that '^' binds looser than '-'
+    counts = np.where(encoder <= 0, encoder, -(encoder ^ (0xffffff - 1)))
+    if unwrap and counts.size:
+        steps = np.diff(counts, prepend=counts[0] if previous is None else previous)
+        counts -= np.cumsum(np.rint(steps / 2**24).astype(np.int64)) * 2**24
+    return counts
+
+
+def adc2counts_array(counts):
+    '''
+    Vectorized version of adc2counts, takes the already parsed integer
+    values of the hex column.
+    '''
+    counts = counts >> 8
+    counts = np.where(counts > 0x1FFFF, counts - 0x40000, counts)
+    return counts * fc
+
+
+def txt_timestamp(seconds, nanoseconds, ns_timestamps=False):
+    '''
+    Combine the seconds and nanoseconds columns of the pizza box files,
+    into float Unix timestamps or, with ns_timestamps=True, exact int64
+    nanoseconds since the epoch (for exact merges between the streams).
+    '''
+    if ns_timestamps:
+        return np.asarray(seconds, dtype=np.int64) * 10**9 + np.asarray(nanoseconds, dtype=np.int64)
+    return seconds + 1e-9 * nanoseconds
+
+
+class PizzaBoxAnHandlerTxt(HandlerBase):
+    def __init__(self, fpath, chunk_size=0, ns_timestamps=False):
+        '''
+        adds the chunks of data to a list
+        This combines the chunks together and ignores the chunk size to speed
+            things up.
+        Only the field offsets are found here, the timestamps and the ADC
+            column requested in __call__ are decoded on first use.
+        With ns_timestamps=True the timestamps are int64 nanoseconds.
+        '''
+        self._buf, self._starts, self._ends = read_txt_fields(fpath)
+        self.ns_timestamps = ns_timestamps
+        # the first three columns are seconds, nanoseconds and index,
+        # the rest are the hex ADC columns
+        self.ncols = self._starts.shape[1] - 3
+        self._timestamp = None
+        self._volts = {}
+
+    def _read_column(self, index, base=10):
+        return parse_txt_field(self._buf, self._starts[:, index], self._ends[:, index], base=base)
+
+    @property
+    def timestamp(self):
+        if self._timestamp is None:
+            seconds = self._read_column(0)
+            nanoseconds = self._read_column(1)
+            self._timestamp = txt_timestamp(seconds, nanoseconds, ns_timestamps=self.ns_timestamps)
+        return self._timestamp
+
+    def volts(self, column=0):
+        '''
+        returns the ADC column converted to volts, decoded on first use
+        '''
+        if column not in self._volts:
+            if not 0 <= column < self.ncols:
+                raise KeyError(f'column={column} not in the file (ncols={self.ncols})')
+            counts = self._read_column(column + 3, base=16)
+            self._volts[column] = adc2counts_array(counts)
+        return self._volts[column]
+
+    def __call__(self, chunk_num, column=0):
+        '''
+        returns specified chunk number/index from list of all chunks created
+        '''
+        columns = ['timestamp', 'adc']
+        if chunk_num == 0:
+            return pd.DataFrame({'timestamp': self.timestamp, 'adc': self.volts(column)}, columns=columns)
+        else:
+            return pd.DataFrame(columns=columns)
+
+
+class PizzaBoxEncHandlerTxt(HandlerBase):
+    def __init__(self, fpath, chunk_size=0, unwrap=False, ns_timestamps=False):
+        '''
+        adds the chunks of data to a list
+        This combines the chunks together and ignores the chunk size to speed
+            things up.
+        The columns are parsed straight into integer arrays (int64 seconds and
+            nanoseconds, int32 counter) and the encoder goes through
+            enc2counts_array, unwrapping the 24-bit rollover only if unwrap=True
+            (the values of the files are not changed by default).
+        With ns_timestamps=True the timestamps are int64 nanoseconds.
+        '''
+        keys = ['times', 'timens', 'encoder', 'counter', 'di']
+        dtypes = {'times': np.int64, 'timens': np.int64, 'encoder': np.int64, 'counter': np.int32}
+        data = pd.read_csv(fpath, delimiter=" ", header=None, names=keys, usecols=list(dtypes), dtype=dtypes)
+        self.data = self._make_data(data['times'].to_numpy(), data['timens'].to_numpy(), data['encoder'].to_numpy(),
+                                    data['counter'].to_numpy(), unwrap=unwrap, ns_timestamps=ns_timestamps)
+
+    @staticmethod
+    def _make_data(times, timens, encoder, counter, unwrap=False, ns_timestamps=False):
+        timestamp = txt_timestamp(times, timens, ns_timestamps=ns_timestamps)
+        return pd.DataFrame({'timestamp': timestamp,
+                             'counter': np.asarray(counter, dtype=np.int32),
+                             'encoder': enc2counts_array(encoder, unwrap=unwrap)})
+
+    def __call__(self, chunk_num):
+        '''
+        returns specified chunk number/index from list of all chunks created
+        '''
+        columns = ['timestamp', 'counter', 'encoder']
+        if chunk_num == 0:
+            return self.data
+        else:
+            return pd.DataFrame(columns=columns)
+
+
+# TODO : move upstream
+#class PizzaBoxEncHandlerTxt(HandlerBase):
+#    encoder_row = namedtuple('encoder_row',
+#                             ['ts_s', 'ts_ns', 'encoder', 'index', 'state'])
+#    "Read PizzaBox text files using info from filestore."
+#    def __init__(self, fpath, chunk_size):
+#        self.chunk_size = chunk_size
+#        with open(fpath, 'r') as f:
+#            self.lines = list(f)
+#
+#    def __call__(self, chunk_num):
+#        cs = self.chunk_size
+#        return [self.encoder_row(*(int(v) for v in ln.split()))
+#                for ln in self.lines[chunk_num*cs:(chunk_num+1)*cs]]
+
+
+class PizzaBoxDIHandlerTxt(HandlerBase):
+    di_row = namedtuple('di_row', ['ts_s', 'ts_ns', 'encoder', 'index', 'di'])
+    di_dtype = np.dtype([(name, np.int64) for name in di_row._fields])
+    "Read PizzaBox text files using info from filestore."
+    def __init__(self, fpath, chunk_size):
+        '''
+        Only the byte offsets of the lines are kept, the chunks are read from
+            the file and decoded when requested.
+        '''
+        self.chunk_size = chunk_size
+        self.fpath = fpath
+        self.line_offsets = index_txt_lines(fpath)
+
+    @property
+    def num_lines(self):
+        return self.line_offsets.size - 1
+
+    def __call__(self, chunk_num):
+        '''
+        returns the lines of the chunk as a record array with the di_row
+        fields, so the rows can still be accessed as row.ts_s, row.di, etc.
+        '''
+        cs = self.chunk_size
+        first = min(chunk_num*cs, self.num_lines)
+        last = min((chunk_num+1)*cs, self.num_lines)
+        with open(self.fpath, 'rb') as f:
+            f.seek(self.line_offsets[first])
+            buf = np.frombuffer(f.read(self.line_offsets[last] - self.line_offsets[first]), dtype=np.uint8)
+
+        chunk = np.recarray(last - first, dtype=self.di_dtype)
+        if chunk.size:
+            starts, ends = split_txt_fields(buf, fpath=self.fpath, skip_blank_lines=False)
+            for i, name in enumerate(self.di_row._fields):
+                chunk[name] = parse_txt_field(buf, starts[:, i], ends[:, i])
+        return chunk
+
+
+# Binary copies of the pizza box text files (see transcode_pizzabox_txt), one
+# record per line with the raw values, the hex ADC columns are added as adc0,
+# adc1, ...
+pizzabox_bin_fields = {
+    'enc': [('times', '<u4'), ('timens', '<u4'), ('encoder', '<i4'), ('counter', '<i4'), ('di', '<i4')],
+    'an': [('ts_s', '<u4'), ('ts_ns', '<u4'), ('index', '<u4')],
+    'di': [('ts_s', '<u4'), ('ts_ns', '<u4'), ('encoder', '<i4'), ('index', '<u4'), ('di', '<i4')],
+}
+
+
+def transcode_pizzabox_txt(fpath, kind):
+    '''
+    Write the finished pizza box text file at fpath ('enc', 'an' or 'di'
+    format) to a .npy file next to it, which the *_FILE_BIN handlers
+    memory-map, and return its path. The text file is not changed.
+    '''
+    buf, starts, ends = read_txt_fields(fpath)
+    fields = list(pizzabox_bin_fields[kind])
+    if kind == 'an':
+        fields += [(f'adc{i}', '<u4') for i in range(max(starts.shape[1] - len(fields), 0))]
+    if starts.shape[0] and starts.shape[1] != len(fields):
+        raise ValueError(f'{fpath} has {starts.shape[1]} columns, expected {len(fields)} for {kind!r}')
+
+    records = np.empty(starts.shape[0], dtype=fields)
+    for i, name in enumerate(records.dtype.names if records.size else []):
+        values = parse_txt_field(buf, starts[:, i], ends[:, i], base=16 if name.startswith('adc') else 10)
+        records[name] = values
+        if not np.array_equal(records[name], values):
+            raise ValueError(f'the values of {name!r} in {fpath} do not fit in {records.dtype[name]}')
+
+    bin_path = f'{fpath}.npy'
+    tmp_path = f'{bin_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, records)
+    os.replace(tmp_path, bin_path)
+    return bin_path
+
+
+def pizzabox_bin_copy(fpath):
+    '''
+    The path of the binary copy of the text file fpath, or None if it was
+    not written (yet) or the text file changed after it.
+    '''
+    bin_path = f'{fpath}.npy'
+    try:
+        if os.path.getmtime(bin_path) >= os.path.getmtime(fpath):
+            return bin_path
+    except OSError:
+        pass
+    return None
+
+
+class PizzaBoxTranscoder:
+    '''
+    Writes the binary copies of the finished pizza box text files
+    (transcode_pizzabox_txt) on a background thread, so the RunEngine does
+    not wait for them. The resources keep pointing at the text files, the
+    handlers of the PIZZABOX_*_FILE_TXT specs read the copy once it is
+    there. The files which could not be transcoded are logged and in
+    failed, their text file is read as before.
+    '''
+    def __init__(self):
+        self.failed = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, fpath, kind):
+        self._queue.put((fpath, kind))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='pizzabox-transcoder', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            fpath, kind = self._queue.get()
+            try:
+                logger.info('transcoded %s to %s', fpath, transcode_pizzabox_txt(fpath, kind))
+            except Exception as e:
+                self.failed[fpath] = repr(e)
+                logger.exception('could not transcode %s, its text file is used', fpath)
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        "Wait until the files submitted so far are done."
+        self._queue.join()
+
+
+pizzabox_transcoder = PizzaBoxTranscoder()
+
+
+def load_pizzabox_bin(fpath):
+    return file_handle_pool.get((fpath, 'npy'), lambda: np.load(fpath, mmap_mode='r'))
+
+
+class PizzaBoxAnHandlerBin(PizzaBoxAnHandlerTxt):
+    "Read the binary copies of the PizzaBox ADC files, same output as PizzaBoxAnHandlerTxt."
+    def __init__(self, fpath, chunk_size=0, ns_timestamps=False):
+        self.fpath = fpath
+        self.ns_timestamps = ns_timestamps
+        self.ncols = len(load_pizzabox_bin(fpath).dtype.names) - 3
+        self._timestamp = None
+        self._volts = {}
+
+    def _read_column(self, index, base=10):
+        records = load_pizzabox_bin(self.fpath)
+        return records[records.dtype.names[index]].astype(np.int64)
+
+
+class PizzaBoxEncHandlerBin(PizzaBoxEncHandlerTxt):
+    "Read the binary copies of the PizzaBox encoder files, same output as PizzaBoxEncHandlerTxt."
+    def __init__(self, fpath, chunk_size=0, unwrap=False, ns_timestamps=False):
+        records = load_pizzabox_bin(fpath)
+        self.data = self._make_data(records['times'], records['timens'], records['encoder'], records['counter'],
+                                    unwrap=unwrap, ns_timestamps=ns_timestamps)
+
+
+class PizzaBoxDIHandlerBin(PizzaBoxDIHandlerTxt):
+    "Read the binary copies of the PizzaBox DI files, same output as PizzaBoxDIHandlerTxt."
+    def __init__(self, fpath, chunk_size):
+        self.chunk_size = chunk_size
+        self.fpath = fpath
+
+    @property
+    def num_lines(self):
+        return load_pizzabox_bin(self.fpath).size
+
+    def __call__(self, chunk_num):
+        cs = self.chunk_size
+        chunk = load_pizzabox_bin(self.fpath)[chunk_num*cs:(chunk_num+1)*cs]
+        return chunk.astype(self.di_dtype).view(np.recarray)
+
+
+def _prefer_bin_copy(txt_class, bin_class):
+    # the handler of the PIZZABOX_*_FILE_TXT specs: bin_class on the binary
+    # copy of the file if pizzabox_transcoder wrote it, txt_class otherwise
+    def make_handler(fpath, *args, **kwargs):
+        bin_path = pizzabox_bin_copy(fpath)
+        if bin_path is None:
+            return txt_class(fpath, *args, **kwargs)
+        return bin_class(bin_path, *args, **kwargs)
+    make_handler.__name__ = make_handler.__qualname__ = txt_class.__name__[:-len('Txt')]
+    make_handler.__doc__ = f'{txt_class.__name__}, or {bin_class.__name__} if the file has a binary copy.'
+    return make_handler
+
+
+PizzaBoxAnHandler = _prefer_bin_copy(PizzaBoxAnHandlerTxt, PizzaBoxAnHandlerBin)
+PizzaBoxEncHandler = _prefer_bin_copy(PizzaBoxEncHandlerTxt, PizzaBoxEncHandlerBin)
+PizzaBoxDIHandler = _prefer_bin_copy(PizzaBoxDIHandlerTxt, PizzaBoxDIHandlerBin)
+
+
+#class PizzaBoxAnHandlerTxt(HandlerBase):
+#    ''' Like pizza box handler except each file has two columns
+#    '''
+#    "Read PizzaBox text files using info from filestore."
+#
+#    def __init__(self, fpath, chunk_size):
+#        self.chunk_size = chunk_size
+#        #print("chunk size : {}".format(chunk_size))
+#        with open(fpath, 'r') as f:
+#            self.lines = list(f)
+#        print(fpath)
+#        self.ncols = len(self.lines[0].split())
+#        print("number of columns is {}".format(self.ncols))
+#        self.cols = ['ts_s', 'ts_ns', 'index', 'adc']
+#        self.bases = [10, 10, 10, 16]
+#        self.encoder_row = namedtuple('encoder_row', self.cols)
+#
+#    def __call__(self, chunk_num, column=0):
+#        cs = self.chunk_size
+#        col_index = column + 3
+#        # TODO : clean up this logic, maybe use pandas?
+#        # need to first look at how isstools parses this
+#        return [self.encoder_row(*(int(v, base=b) for v, b in zip((ln.split()[i] for i in [0,1,2,col_index]), self.bases)))
+#                for ln in self.lines[chunk_num*cs:(chunk_num+1)*cs]]
+
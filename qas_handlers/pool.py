@@ -0,0 +1,290 @@
+"""
+Pool of the open data files shared by the QAS handlers, and the mixin which
+makes the databroker HDF5 handlers use it. h5py, hdf5plugin and dask are only
+imported when the first file is opened.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class FileHandlePool:
+    '''
+    Bounded pool of the open data files (HDF5 files, memory maps) shared by
+    the QAS handlers, so browsing many runs keeps a fixed number of file
+    descriptors. The least recently used handle is closed when the pool is
+    full, and opened again the next time it is requested.
+
+    The handles which are still read from (e.g. by the ImageStacks returned
+    by the handlers) are pinned with acquire() and never evicted until they
+    are released, the pool can be over max_open meanwhile.
+    '''
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self._handles = OrderedDict()
+        self._pins = {}  # key -> number of acquire() not released yet
+        self._close_on_release = set()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._handles)
+
+    def get(self, key, opener):
+        '''
+        Return the handle stored under key, calling opener() to open it if
+        it is not in the pool (anymore).
+        '''
+        with self._lock:
+            if key in self._handles:
+                self.hits += 1
+                self._handles.move_to_end(key)
+                return self._handles[key]
+            self.misses += 1
+            handle = opener()
+            self._handles[key] = handle
+            self._evict(keep=key)
+            return handle
+
+    def acquire(self, key, opener):
+        '''
+        get() and pin the handle: it stays open until release(key, handle)
+        is called as many times as acquire.
+        '''
+        with self._lock:
+            handle = self.get(key, opener)
+            self._pins[key] = self._pins.get(key, 0) + 1
+            return handle
+
+    def release(self, key, handle=None):
+        '''
+        Unpin a handle of acquire(), it can be evicted again. Nothing is done
+        if the handle was closed in the meantime by clear() (or is not the
+        one in the pool anymore).
+        '''
+        with self._lock:
+            if key not in self._pins or (handle is not None and self._handles.get(key) is not handle):
+                return
+            self._pins[key] -= 1
+            if self._pins[key] == 0:
+                del self._pins[key]
+                if key in self._close_on_release:
+                    self.close(key)
+                else:
+                    self._evict()
+
+    @contextmanager
+    def pinned(self, key, opener):
+        '''
+        with pool.pinned(key, opener) as handle: the handle is not evicted
+        while it is read, also by the other threads using the pool.
+        '''
+        handle = self.acquire(key, opener)
+        try:
+            yield handle
+        finally:
+            self.release(key, handle)
+
+    def _evict(self, keep=None):
+        excess = len(self._handles) - self.max_open
+        if excess <= 0:
+            return
+        for key in [key for key in self._handles if key not in self._pins and key != keep][:excess]:
+            self._close(self._handles.pop(key))
+            self.evictions += 1
+
+    def close(self, key):
+        '''
+        Close the handle stored under key, if it is pinned only when it is
+        released.
+        '''
+        with self._lock:
+            if key in self._pins:
+                self._close_on_release.add(key)
+                return
+            self._close_on_release.discard(key)
+            handle = self._handles.pop(key, None)
+            if handle is not None:
+                self._close(handle)
+
+    def clear(self):
+        '''
+        Close all the handles, also the pinned ones.
+        '''
+        with self._lock:
+            self._pins.clear()
+            self._close_on_release.clear()
+            while self._handles:
+                _, handle = self._handles.popitem()
+                self._close(handle)
+
+    @staticmethod
+    def _close(handle):
+        # memory maps have no close, their descriptor is released with the last view
+        close = getattr(handle, 'close', None)
+        if close is not None:
+            close()
+
+    def stats(self):
+        return {'open': len(self._handles), 'max_open': self.max_open, 'pinned': len(self._pins),
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+file_handle_pool = FileHandlePool()
+
+
+def open_hdf5(filename, swmr=False):
+    '''
+    Open an HDF5 file for reading, with the filters of hdf5plugin (Blosc,
+    bitshuffle) if it is installed.
+    '''
+    import h5py
+    try:
+        import hdf5plugin  # registers the filters of the compressed files with h5py
+    except ImportError:
+        pass
+    return h5py.File(filename, 'r', swmr=swmr)
+
+
+def shared_dataset(h5file, key):
+    '''
+    The h5py Dataset of key in the open h5file, one object per file shared
+    by the handlers and the lazy arrays. In SWMR mode, refreshing a second
+    Dataset object of the same dataset breaks the reads through the first
+    one ("can't insert duplicate key"), so all the reads and refreshes go
+    through this one.
+    '''
+    datasets = vars(h5file).setdefault('_qas_datasets', {})
+    key = '/' + key.lstrip('/')
+    if key not in datasets:
+        datasets[key] = h5file[key]
+    return datasets[key]
+
+
+def check_hdf5_filters(dataset):
+    '''
+    Raise an error which says what is missing if the dataset is compressed
+    with a filter h5py can't decode (e.g. Blosc without hdf5plugin), instead
+    of the error from the first read.
+    '''
+    import h5py
+
+    plist = dataset.id.get_create_plist()
+    for i in range(plist.get_nfilters()):
+        filter_id, _, _, name = plist.get_filter(i)
+        if not h5py.h5z.filter_avail(filter_id):
+            name = f' ({name.decode()})' if name else ''
+            raise OSError(f'{dataset.file.filename}:{dataset.name} is compressed with the HDF5 filter '
+                          f'{filter_id}{name}, which is not available, install hdf5plugin to read it')
+
+
+class PooledHDF5Dataset:
+    '''
+    Array-like view of an HDF5 dataset, which gets the file from
+    file_handle_pool on every read, so the lazy arrays built on it (see
+    PooledHDF5Mixin.dask_array) keep working if the file was evicted.
+    '''
+    def __init__(self, filename, key, swmr=False):
+        self.filename = filename
+        self.key = key
+        self.swmr = swmr
+        dataset = self._get_dataset()
+        if swmr:
+            dataset.refresh()
+        self.shape = dataset.shape
+        self.ndim = dataset.ndim
+        self.dtype = dataset.dtype
+        # contiguous datasets are read frame by frame
+        self.chunks = dataset.chunks or (1,) + self.shape[1:]
+
+    def _open(self):
+        return open_hdf5(self.filename, swmr=self.swmr)
+
+    def _get_dataset(self):
+        return shared_dataset(file_handle_pool.get((self.filename, self.swmr), self._open), self.key)
+
+    def __getitem__(self, selection):
+        # dask reads the chunks from several threads, the file is not evicted during a read
+        with file_handle_pool.pinned((self.filename, self.swmr), self._open) as h5file:
+            return shared_dataset(h5file, self.key)[selection]
+
+
+class PooledHDF5Mixin:
+    '''
+    Mixin for the databroker HDF5 handlers (with _filename, _file and _dataset)
+    to get the file from file_handle_pool. _get_file() has to be called before
+    the file is used, it reopens the file if it was evicted and then drops the
+    references into the old file. close() drops the references of the handler
+    only, the file is shared and stays in the pool.
+    '''
+    swmr = False
+
+    def open(self):
+        self._get_file()
+
+    def _open_file(self):
+        return open_hdf5(self._filename, swmr=self.swmr)
+
+    def _get_file(self):
+        h5file = file_handle_pool.get((self._filename, self.swmr), self._open_file)
+        if h5file is not self._file:
+            self._file = h5file
+            self._reset_datasets()
+        return h5file
+
+    def _pinned_file(self):
+        '''
+        with self._pinned_file(): the file is not evicted during the reads
+        of the handler (e.g. by the prefetch threads), _get_file() inside.
+        '''
+        return file_handle_pool.pinned((self._filename, self.swmr), self._open_file)
+
+    def _pin_file(self, make):
+        '''
+        make() an object which reads from the file of the handler (e.g. an
+        ImageStack), the file is kept open while the object is alive.
+        '''
+        key = (self._filename, self.swmr)
+        h5file = file_handle_pool.acquire(key, self._open_file)
+        try:
+            self._get_file()
+            obj = make()
+        except BaseException:
+            file_handle_pool.release(key, h5file)
+            raise
+        weakref.finalize(obj, file_handle_pool.release, key, h5file)
+        return obj
+
+    def _reset_datasets(self):
+        self._dataset = None
+        if hasattr(self, '_data_objects'):
+            self._data_objects.clear()
+
+    def close(self):
+        # only the references of this handler are dropped, the file stays in
+        # the pool for the other handlers and the objects still reading it
+        self._file = None
+        self._reset_datasets()
+
+    def dask_array(self, min_chunk_bytes=2**24):
+        '''
+        Lazy dask array of the whole dataset. Its chunks are the chunks of
+        the dataset on disk, grouped along the frames up to min_chunk_bytes,
+        so every chunk is read at once, e.g. for ROI or channel sums:
+
+            handler.dask_array()[:, 100:200, 300:400].sum(axis=(1, 2)).compute()
+        '''
+        try:
+            import dask.array as da
+        except ImportError:
+            raise ImportError('dask is needed for the lazy arrays of the HDF5 handlers') from None
+        dataset = PooledHDF5Dataset(self._filename, self._key, swmr=self.swmr)
+        disk_chunk_bytes = int(np.prod(dataset.chunks)) * dataset.dtype.itemsize
+        frames_per_chunk = max(1, min_chunk_bytes // disk_chunk_bytes) * dataset.chunks[0]
+        chunks = (frames_per_chunk,) + tuple(dataset.chunks[1:])
+        return da.from_array(dataset, chunks=chunks, name=f'{self._filename}:{self._key}:{dataset.shape}')
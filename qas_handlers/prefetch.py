@@ -0,0 +1,71 @@
+"""
+Parallel loading of the external data of a run: the resources (APB, encoder,
+trigger, Xspress3/Pilatus files...) are retrieved on a thread pool, one
+resource per task.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_run_datum_ids(db, hdr):
+    '''
+    Returns the datum ids of all the external fields of the events of the
+    run, grouped by resource uid.
+    '''
+    external_keys = {}
+    datum_ids = defaultdict(list)
+    for name, doc in hdr.documents(fill=False):
+        if name == 'descriptor':
+            external_keys[doc['uid']] = [key for key, data_key in doc['data_keys'].items()
+                                         if data_key.get('external')]
+        elif name == 'event':
+            for key in external_keys.get(doc['descriptor'], []):
+                datum_id = doc['data'][key]
+                # our devices make the datum ids as '<resource uid>/<counter>',
+                # the others (e.g. DIFS) are looked up
+                if '/' in datum_id:
+                    resource_uid = datum_id.split('/')[0]
+                else:
+                    resource_uid = db.reg.resource_given_datum_id(datum_id)['uid']
+                datum_ids[resource_uid].append(datum_id)
+    return dict(datum_ids)
+
+
+def _retrieve_resource(db, datum_ids):
+    # one resource per task, so every handler is only used by one thread. The
+    # files (also those shared by several resources) come from the locked
+    # file_handle_pool and are pinned while they are read, so the other
+    # threads never evict a file which is being read; h5py serializes the
+    # HDF5 calls itself.
+    return {datum_id: db.reg.retrieve(datum_id) for datum_id in datum_ids}
+
+
+def prefetch_run(db, hdr, max_workers=8):
+    '''
+    Load the data of all the resources of a run at the same time, one
+    resource per thread. Returns a dict {datum_id: data}.
+    '''
+    datum_ids = get_run_datum_ids(db, hdr)
+    if not datum_ids:
+        return {}
+    data = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(datum_ids))) as executor:
+        for resource_data in executor.map(_retrieve_resource, [db] * len(datum_ids), datum_ids.values()):
+            data.update(resource_data)
+    return data
+
+
+def fill_run(db, hdr, max_workers=8):
+    '''
+    Like hdr.documents(fill=True), but all the resources of the run are
+    prefetched in parallel first (see prefetch_run).
+    '''
+    data = prefetch_run(db, hdr, max_workers=max_workers)
+    for name, doc in hdr.documents(fill=False):
+        if name == 'event':
+            filled = {key: data[value] for key, value in doc['data'].items()
+                      if isinstance(value, str) and value in data}
+            if filled:
+                doc = dict(doc, data={**doc['data'], **filled},
+                           filled={**doc.get('filled', {}), **{key: True for key in filled}})
+        yield name, doc
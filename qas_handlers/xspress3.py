@@ -0,0 +1,186 @@
+"""
+Handlers of the Xspress3 HDF5 files.
+"""
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from databroker.assets.handlers import Xspress3HDF5Handler
+
+from .pool import PooledHDF5Mixin, check_hdf5_filters, shared_dataset
+
+
+class QASXspress3HDF5Handler(PooledHDF5Mixin, Xspress3HDF5Handler):
+    '''
+    Returns the spectra and the ROIs of the frames. To keep the memory down
+    when whole runs are filled, dtype='float32' returns the spectra in that
+    type, converted by HDF5 while reading, and rois_only=True returns only
+    the ROIs without touching the spectra. The ROIs keep the dtype of the
+    file, they are fractional. The defaults for the handlers made by the
+    broker are the class attributes.
+
+    The spectra stay in the file (the parent reads the whole dataset into
+    memory), the frames are read from the h5py dataset as they are needed.
+    With swmr=True the file is opened in SWMR mode and refreshed when a
+    frame past the last known extent is requested, see refresh().
+    '''
+    block_bytes = 2**24  # size of the blocks of frames read at once for the single-frame calls
+    frames_per_block = None  # or a fixed number of frames per block
+    dtype = None  # None keeps the dtypes of the file
+    rois_only = False
+
+    def __init__(self, *args, dtype=None, rois_only=None, swmr=None, **kwargs):
+        if dtype is not None:
+            self.dtype = dtype
+        if rois_only is not None:
+            self.rois_only = rois_only
+        if swmr is not None:
+            self.swmr = swmr
+        super().__init__(*args, **kwargs)
+        self._roi_data = None
+        self._num_channels = None
+        self._block_start = None
+        self._block = None
+
+    def _get_dataset(
+            self):  # readpout of the following stuff should be done only once, this is why I redefined _get_dataset method - Denis Leshchev Feb 9, 2021
+        # the file is not evicted by the other threads while the ROIs are read
+        with self._pinned_file():
+            self._read_datasets()
+
+    def _read_datasets(self):
+        # the file may have been reopened by the pool, which drops the datasets
+        self._get_file()
+        if not self.rois_only and self._dataset is None:
+            # not the parent, it would read the whole dataset with np.asarray
+            dataset = shared_dataset(self._file, self._key)
+            check_hdf5_filters(dataset)
+            if self.swmr:
+                dataset.refresh()
+
+            # finding number of channels
+            if self._num_channels is None:
+                print('determening number of channels')
+                shape = dataset.shape
+                if len(shape) != 3:
+                    raise RuntimeError(f'The ndim of the dataset is not 3, but {len(shape)}')
+                self._num_channels = shape[1]
+            self._dataset = dataset
+            self._block_start = None
+
+        if self._roi_data is not None:
+            return
+        print('reading ROI data')
+        self.chanrois = [f'CHAN{c}ROI{r}' for c, r in product([1, 2, 3, 4, 5, 6], [1, 2, 3, 4])]
+        roi_datasets = [shared_dataset(self._file, f'/entry/instrument/detector/NDAttributes/{chanroi}')
+                        for chanroi in self.chanrois]
+        if self.swmr:
+            for roi_dataset in roi_datasets:
+                roi_dataset.refresh()
+        # one contiguous row per ROI, read straight from the file
+        num_frames = min(roi_dataset.shape[0] for roi_dataset in roi_datasets)
+        rois = np.empty((len(self.chanrois), num_frames), dtype=roi_datasets[0].dtype)
+        for i, roi_dataset in enumerate(roi_datasets):
+            roi_dataset.read_direct(rois, source_sel=np.s_[:num_frames], dest_sel=np.s_[i])
+        self._rois = rois.T
+        self._roi_data = pd.DataFrame(self._rois, columns=self.chanrois, copy=False)
+
+    def _reset_datasets(self):
+        super()._reset_datasets()
+        self._roi_data = None
+        self._block_start = None
+        self._block = None
+
+    def refresh(self):
+        '''
+        With swmr=True, pick up the frames written since the last refresh
+        (the ROIs are read again), returns the number of frames.
+        '''
+        with self._pinned_file():
+            self._get_dataset()
+            if self.swmr:
+                if self._dataset is not None:
+                    self._dataset.refresh()
+                self._roi_data = None
+                self._block_start = None
+                self._get_dataset()
+            return self.num_frames
+
+    @property
+    def num_frames(self):
+        with self._pinned_file():
+            self._get_dataset()
+            if self.rois_only:
+                return self._rois.shape[0]
+            return min(self._rois.shape[0], self._dataset.shape[0])
+
+    def _read_spectra(self, start, stop):
+        spectra = np.empty((stop - start,) + self._dataset.shape[1:], dtype=self.dtype or self._dataset.dtype)
+        if stop > start:
+            self._dataset.read_direct(spectra, source_sel=np.s_[start:stop])
+        return spectra
+
+    def read_frames(self, start=0, stop=None, columns='all'):
+        '''
+        Read the frames start:stop (all frames by default) at once.
+
+        Returns a dict with the same keys as __call__, but with arrays over the
+        frames: ch_<n> of shape (num_frames, num_bins) and CHAN<c>ROI<r> of shape
+        (num_frames,). columns='rois' or 'spectra' returns only those.
+        '''
+        if columns not in ('all', 'rois', 'spectra'):
+            raise ValueError(f"columns={columns!r} must be 'all', 'rois' or 'spectra'")
+        if self.rois_only:
+            if columns == 'spectra':
+                raise ValueError("the spectra are not read with rois_only=True")
+            columns = 'rois'
+        # the file is not evicted (by the other threads) during the read
+        with self._pinned_file():
+            num_frames = self.refresh() if self.swmr else self.num_frames
+            start, stop, _ = slice(start, stop).indices(num_frames)
+            stop = max(start, stop)
+
+            return_dict = {}
+            if columns != 'rois':
+                spectra = self._read_spectra(start, stop)
+                return_dict.update({f'ch_{i + 1}': spectra[:, i, :] for i in range(self._num_channels)})
+            if columns != 'spectra':
+                rois = self._rois[start:stop]
+                return_dict.update({chanroi: rois[:, j] for j, chanroi in enumerate(self.chanrois)})
+            return return_dict
+
+    def _get_block(self, frame):
+        # the single-frame calls come in order during the fill, so the frames
+        # are read one block at a time and served as views of the block
+        frame_bytes = int(np.prod(self._dataset.shape[1:])) * np.dtype(self.dtype or self._dataset.dtype).itemsize
+        frames_per_block = self.frames_per_block or max(1, self.block_bytes // frame_bytes)
+        block_start = frame - frame % frames_per_block
+        if self._block_start != block_start:
+            self._block = None  # the views of the previous block returned before keep it alive
+            self._block = self._read_spectra(block_start, min(block_start + frames_per_block,
+                                                              self._dataset.shape[0]))
+            self._block_start = block_start
+        return self._block[frame - block_start]
+
+    def __call__(self, *args, frame=None, **kwargs):
+        if frame is None:
+            return self.read_frames()
+        with self._pinned_file():
+            num_frames = self.num_frames
+            if self.swmr and not -num_frames <= frame < num_frames:
+                num_frames = self.refresh()
+            if frame < 0:
+                frame += num_frames
+            if not 0 <= frame < num_frames:
+                raise IndexError(f'frame={frame} is out of range for {num_frames} frames')
+            return_dict_rois = {chanroi: self._rois[frame, j] for j, chanroi in enumerate(self.chanrois)}
+            if self.rois_only:
+                return return_dict_rois
+            spectra = self._get_block(frame)
+            return_dict = {f'ch_{i + 1}': spectra[i, :] for i in range(self._num_channels)}
+            return {**return_dict, **return_dict_rois}
+
+
+class QASXspress3HDF5Handler_light(QASXspress3HDF5Handler):
+    "Returns only the ROIs, the spectra are not read."
+    rois_only = True
@@ -0,0 +1,14 @@
+"""
+Processing of the QAS fly scans, importable without the beamline profile
+(e.g. in the worker processes of the auto-processing). It reads the files
+with the qas_handlers package.
+"""
+from .binning import (bin_boundaries, bin_index, bin_stream, encoder_to_energy, energy_to_encoder, energy_to_k,
+                      k_to_energy, xas_energy_grid)
+from .flyscan import (bin_apb_stream, bin_apb_stream_with_plan, bin_fly_scan, binned_dataframe, open_stream_handler,
+                      read_fly_scan, read_fly_streams, stream_resource, trigger_energy)
+from .plans import BinningPlan, BinningPlanCache, binning_plan_cache, binning_plan_key
+from .sweeps import bin_oscillatory_scan, is_oscillatory, split_sweeps, turning_points
+from .live import APBFileTail, EncoderFileTail, LiveBinner, LiveFlyScan
+from .service import AutoProcessing, process_fly_scan, write_binned_file
+from .workers import make_process_pool
@@ -0,0 +1,151 @@
+"""
+Conversion of the mono encoder to energy and binning of the fly scan
+streams on an energy grid, with numpy only.
+"""
+import numpy as np
+
+
+HC = 12398.42  # eV * Angstrom
+SI111_D_SPACING = 3.1356  # Angstrom, the crystals of the mono
+K_FACTOR = 3.81  # eV * Angstrom**2, E - E0 = K_FACTOR * k**2
+
+
+def encoder_to_energy(encoder, pulses_per_deg, angle_offset=0):
+    '''
+    Energy (eV) of the mono from the encoder counts, the Bragg angle is
+    encoder / pulses_per_deg - angle_offset in degrees (mono1.pulses_per_deg
+    and mono1.angle_offset, also in the start document of the fly scans).
+    '''
+    angle = np.asarray(encoder, dtype=np.float64) / pulses_per_deg - float(angle_offset)
+    return -HC / (2 * SI111_D_SPACING * np.sin(np.deg2rad(angle)))
+
+
+def energy_to_encoder(energy, pulses_per_deg, angle_offset=0):
+    '''
+    Inverse of encoder_to_energy, the encoder counts are negative.
+    '''
+    angle = -np.rad2deg(np.arcsin(HC / (2 * SI111_D_SPACING * np.asarray(energy, dtype=np.float64))))
+    return (angle + float(angle_offset)) * pulses_per_deg
+
+
+def energy_to_k(energy, e0):
+    return np.sqrt(np.clip(np.asarray(energy, dtype=np.float64) - e0, 0, None) / K_FACTOR)
+
+
+def k_to_energy(k, e0):
+    return e0 + K_FACTOR * np.asarray(k, dtype=np.float64)**2
+
+
+def xas_energy_grid(e0, e_start, e_stop, edge_start=-30, edge_stop=50,
+                    preedge_spacing=5, xanes_spacing=0.2, exafs_k_spacing=0.04):
+    '''
+    Energy grid for the binning of an absorption spectrum around the edge e0,
+    spaced by preedge_spacing (eV) up to e0 + edge_start, by xanes_spacing
+    (eV) up to e0 + edge_stop and by exafs_k_spacing (1/Angstrom) in k above.
+
+    Returns (energy, edges): the bin centers and the len(energy) + 1 bin
+    edges, half way between the centers.
+    '''
+    e_edge_start, e_edge_stop = min(e0 + edge_start, e_stop), min(e0 + edge_stop, e_stop)
+    preedge = np.arange(e_start, e_edge_start, preedge_spacing)
+    xanes = np.arange(max(e_start, e_edge_start), e_edge_stop, xanes_spacing)
+    k_start, k_stop = energy_to_k(max(e_start, e_edge_stop), e0), energy_to_k(e_stop, e0)
+    exafs = k_to_energy(np.arange(k_start, k_stop + exafs_k_spacing / 2, exafs_k_spacing), e0)
+    energy = np.concatenate([preedge, xanes, exafs])
+    energy = energy[(energy >= e_start) & (energy <= e_stop)]
+    if len(energy) < 2:
+        raise ValueError(f'the grid from {e_start} to {e_stop} eV has fewer than 2 points')
+
+    middles = (energy[1:] + energy[:-1]) / 2
+    edges = np.concatenate([[energy[0] - (middles[0] - energy[0])], middles,
+                            [energy[-1] + (energy[-1] - middles[-1])]])
+    return energy, edges
+
+
+def _is_monotonic(values):
+    steps = np.diff(values)
+    return bool(np.all(steps >= 0) or np.all(steps <= 0))
+
+
+def bin_boundaries(timestamps, encoder_timestamps, energy, edges):
+    '''
+    For a monotonic sweep (energy always increasing or always decreasing
+    along encoder_timestamps), every bin is a contiguous run of the sorted
+    timestamps. Returns (lo, hi) with the samples lo[i]:hi[i] in bin i.
+
+    The times at which the energy crosses the edges are interpolated from
+    the encoder stream, then found in the timestamps with one sorted search
+    per edge, so the samples themselves are never converted to energy.
+    '''
+    if energy[-1] < energy[0]:
+        energy, encoder_timestamps = energy[::-1], encoder_timestamps[::-1]
+    # edges outside the sweep fall on its first/last encoder timestamp, so
+    # their bins are empty and the samples outside the sweep are in no bin
+    edge_times = np.interp(edges, energy, encoder_timestamps)
+    if np.issubdtype(timestamps.dtype, np.integer):
+        # search integer timestamps (e.g. nanoseconds) without converting them to float
+        edge_times = np.ceil(edge_times).astype(timestamps.dtype)
+    boundaries = np.searchsorted(timestamps, edge_times)
+    return np.minimum(boundaries[:-1], boundaries[1:]), np.maximum(boundaries[:-1], boundaries[1:])
+
+
+def bin_index(timestamps, encoder_timestamps, energy, edges):
+    '''
+    Bin of every sample (-1 outside the grid and the encoder stream), from
+    its energy interpolated from the encoder stream. Used for the sweeps
+    which are not monotonic.
+    '''
+    sample_energy = np.interp(timestamps, encoder_timestamps, energy)
+    index = np.searchsorted(edges, sample_energy, side='right') - 1
+    outside = ((index >= len(edges) - 1) | (timestamps < encoder_timestamps[0])
+               | (timestamps > encoder_timestamps[-1]))
+    index[outside] = -1
+    return index
+
+
+def bin_stream(timestamps, signals, encoder_timestamps, energy, edges):
+    '''
+    Average the signals sampled at timestamps in the energy bins between
+    edges (increasing), with the energy of the mono at encoder_timestamps.
+    Both timestamp arrays have to be sorted and in the same units (e.g. the
+    int64 nanoseconds of the handlers with ns_timestamps=True), signals is
+    {name: array like timestamps}.
+
+    Monotonic sweeps are binned with bin_boundaries and one cumulative sum
+    of every signal over the samples of the grid, the sum of bin i is
+    cumsum[hi[i]] - cumsum[lo[i]]. The other sweeps are binned with
+    bin_index and np.bincount.
+
+    Returns (counts, means): the number of samples in every bin and
+    {name: mean in every bin}, NaN in the empty bins.
+    '''
+    timestamps = np.asarray(timestamps)
+    encoder_timestamps = np.asarray(encoder_timestamps)
+    energy = np.asarray(energy, dtype=np.float64)
+    num_bins = len(edges) - 1
+    sums = {}
+    if len(timestamps) == 0 or len(energy) == 0:
+        counts = np.zeros(num_bins, dtype=np.int64)
+        sums = {name: np.zeros(num_bins) for name in signals}
+    elif _is_monotonic(energy):
+        lo, hi = bin_boundaries(timestamps, encoder_timestamps, energy, edges)
+        counts = hi - lo
+        first, last = lo.min(), hi.max()
+        # the bins are runs of samples, the sum of a bin is the difference of
+        # the cumulative sums at its ends (0 for the empty bins)
+        for name, signal in signals.items():
+            signal = np.asarray(signal)
+            dtype = np.int64 if np.issubdtype(signal.dtype, np.integer) else np.float64
+            cumsum = np.concatenate([np.zeros(1, dtype=dtype), np.cumsum(signal[first:last], dtype=dtype)])
+            sums[name] = (cumsum[hi - first] - cumsum[lo - first]).astype(np.float64)
+    else:
+        index = bin_index(timestamps, encoder_timestamps, energy, edges)
+        inside = index >= 0
+        index = index[inside]
+        counts = np.bincount(index, minlength=num_bins)
+        for name, signal in signals.items():
+            sums[name] = np.bincount(index, weights=np.asarray(signal)[inside], minlength=num_bins)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = {name: np.where(counts > 0, values / counts, np.nan) for name, values in sums.items()}
+    return counts, means
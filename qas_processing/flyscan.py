@@ -0,0 +1,141 @@
+"""
+Binning of the fly scans (execute_trajectory_apb) from the files of their
+APB and encoder streams.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import qas_handlers
+from .binning import bin_stream, encoder_to_energy, xas_energy_grid
+from .plans import BinningPlan, binning_plan_cache, binning_plan_key
+
+
+apb_stream_names = ['apb_stream', 'apb_stream_c']
+encoder_stream_name = 'pb1_enc1'
+apb_channels = ['i0', 'it', 'ir', 'iff']
+
+
+def stream_resource(db, hdr, stream_name):
+    '''
+    The handler class, file path and resource kwargs of the (only) file of
+    a fly scan stream, from its resource document.
+    '''
+    datum_id = hdr.table(stream_name=stream_name, fill=False)[stream_name].iloc[0]
+    resource = db.reg.resource_given_datum_id(datum_id)
+    handler_class = getattr(qas_handlers, qas_handlers.handler_specs[resource['spec']])
+    return handler_class, os.path.join(resource['root'], resource['resource_path']), resource['resource_kwargs']
+
+
+def open_stream_handler(db, hdr, stream_name, **kwargs):
+    '''
+    Make the handler of the (only) file of a fly scan stream directly from
+    its resource document, with extra handler kwargs (e.g. ns_timestamps).
+    '''
+    handler_class, fpath, resource_kwargs = stream_resource(db, hdr, stream_name)
+    return handler_class(fpath, **{**resource_kwargs, **kwargs})
+
+
+def read_fly_streams(db, hdr):
+    '''
+    The raw streams of a fly scan: the APB stream (APBStreamData, not
+    converted) with its settings and the encoder DataFrame, both with int64
+    nanosecond timestamps, the encoder counts unwrapped over the 24-bit
+    rollover.
+    '''
+    apb_stream_name = next(name for name in apb_stream_names if name in hdr.stream_names)
+    apb_handler = open_stream_handler(db, hdr, apb_stream_name, lazy=True, ns_timestamps=True)
+    encoder = open_stream_handler(db, hdr, encoder_stream_name, unwrap=True, ns_timestamps=True)(0)
+    return apb_handler(), apb_handler.settings, encoder
+
+
+def read_fly_scan(db, hdr):
+    '''
+    read_fly_streams and the mono energy at every encoder sample.
+    '''
+    apb, settings, encoder = read_fly_streams(db, hdr)
+    energy = encoder_to_energy(encoder['encoder'].to_numpy(), hdr.start['pulses_per_degree'],
+                               hdr.start['angle_offset'])
+    return apb, settings, encoder, energy
+
+
+def trigger_energy(db, hdr, encoder_timestamps, energy, stream_name='apb_trigger'):
+    '''
+    Timestamps (int64 ns) and mono energy of the rising edges of the APB
+    trigger of a fly scan, i.e. of the detector frames (Xspress3, Pilatus).
+    '''
+    trigger = open_stream_handler(db, hdr, stream_name, lazy=True, ns_timestamps=True)()
+    timestamps = trigger['timestamp'][np.asarray(trigger['transition']) == 1]
+    t0 = encoder_timestamps[0]
+    return timestamps, np.interp(timestamps - t0, encoder_timestamps - t0, energy)
+
+
+def bin_apb_stream(apb, settings, encoder_timestamps, energy, energy_grid, edges, channels=None):
+    '''
+    Bin the channels of an APB stream (APBStreamData) on the energy grid,
+    the raw counts are binned and the means converted to volts with the
+    settings (if given). Returns a DataFrame with energy, the channels and
+    the number of samples in every bin (counts).
+    '''
+    channels = channels or apb_channels
+    t0 = encoder_timestamps[0]
+    counts, means = bin_stream(apb['timestamp'] - t0, {channel: apb.records[channel] for channel in channels},
+                               encoder_timestamps - t0, energy, edges)
+    return binned_dataframe(energy_grid, counts, means, settings)
+
+
+def bin_apb_stream_with_plan(apb, settings, encoder_timestamps, encoder, plan, channels=None):
+    '''
+    bin_apb_stream on the grid of a BinningPlan, with the raw encoder counts
+    instead of the energy.
+    '''
+    channels = channels or apb_channels
+    t0 = encoder_timestamps[0]
+    counts, means = plan.bin(apb['timestamp'] - t0, {channel: apb.records[channel] for channel in channels},
+                             encoder_timestamps - t0, encoder)
+    return binned_dataframe(plan.energy, counts, means, settings)
+
+
+def binned_dataframe(energy_grid, counts, means, settings=None):
+    '''
+    DataFrame of binned APB channels (means of the raw counts), converted
+    to volts with the settings if given.
+    '''
+    if settings is not None:
+        means = dict(means)
+        for channel in means:
+            i = qas_handlers.APBStreamData.columns.index(channel) - 1
+            if i < len(settings.gains):
+                means[channel] = (means[channel] - settings.offsets[i]) / settings.gains[i]
+    return pd.DataFrame({'energy': energy_grid, **means, 'counts': counts})
+
+
+def bin_fly_scan(db, hdr, energy_grid=None, channels=None, plan_cache=binning_plan_cache, **grid_kwargs):
+    '''
+    Bin the APB channels of a fly scan on an energy grid, by default the
+    xas_energy_grid (grid_kwargs) around the e0 of the scan over the energy
+    range of the encoder. energy_grid can also be given as (energy, edges).
+
+    The default grid is a BinningPlan taken from plan_cache (computed for
+    the first cycle of a trajectory, see binning_plan_key), so the cycles
+    of the same trajectory are binned on the same grid. plan_cache=None
+    computes the grid for every scan.
+    '''
+    if energy_grid is None and plan_cache is not None:
+        apb, settings, encoder = read_fly_streams(db, hdr)
+        encoder_counts = encoder['encoder'].to_numpy()
+        start = hdr.start
+        plan = plan_cache.get(binning_plan_key(start, **grid_kwargs),
+                              lambda: BinningPlan.from_encoder(encoder_counts, float(start['e0']),
+                                                               start['pulses_per_degree'], start['angle_offset'],
+                                                               **grid_kwargs))
+        return bin_apb_stream_with_plan(apb, settings, encoder['timestamp'].to_numpy(), encoder_counts, plan,
+                                        channels=channels)
+
+    apb, settings, encoder, energy = read_fly_scan(db, hdr)
+    if energy_grid is None:
+        energy_grid = xas_energy_grid(float(hdr.start['e0']), energy.min(), energy.max(), **grid_kwargs)
+    grid, edges = energy_grid
+    return bin_apb_stream(apb, settings, encoder['timestamp'].to_numpy(), energy, grid, edges,
+                          channels=channels)
@@ -0,0 +1,185 @@
+"""
+Live binning of a fly scan while it runs: the APB .bin file and the encoder
+file are tailed as they grow and the new samples are added to the bins of
+a BinningPlan, so provisional spectra are available during the trajectory.
+"""
+import os
+import threading
+
+import numpy as np
+
+import qas_handlers
+from .flyscan import apb_channels, binned_dataframe
+
+
+class APBFileTail:
+    '''
+    The records of a growing APB .bin file, read() returns the complete
+    records written since the previous call.
+    '''
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.record_dtype = qas_handlers.APBBinFileHandler.record_dtype
+        self.offset = 0
+
+    def read(self):
+        try:
+            size = os.path.getsize(self.fpath)
+        except FileNotFoundError:
+            size = 0
+        num_records = (size - self.offset) // self.record_dtype.itemsize
+        if num_records <= 0:
+            return np.zeros(0, dtype=self.record_dtype)
+        with open(self.fpath, 'rb') as f:
+            f.seek(self.offset)
+            records = np.fromfile(f, dtype=self.record_dtype, count=num_records)
+        self.offset += records.nbytes
+        return records
+
+
+class EncoderFileTail:
+    '''
+    The lines of a growing pizza box encoder file, read() returns the int64
+    ns timestamps and the encoder counts of the complete lines written since
+    the previous call, unwrapped over the calls like enc2counts_array.
+    '''
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.offset = 0
+        self._last = None
+
+    def read(self):
+        buf, starts, ends, self.offset = qas_handlers.read_new_txt_fields(self.fpath, self.offset)
+        if starts.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        timestamps = qas_handlers.txt_timestamp(qas_handlers.parse_txt_field(buf, starts[:, 0], ends[:, 0]),
+                                                qas_handlers.parse_txt_field(buf, starts[:, 1], ends[:, 1]),
+                                                ns_timestamps=True)
+        counts = qas_handlers.enc2counts_array(qas_handlers.parse_txt_field(buf, starts[:, 2], ends[:, 2]),
+                                               unwrap=True, previous=self._last)
+        self._last = counts[-1]
+        return timestamps, counts
+
+
+class LiveBinner:
+    '''
+    Sums and counts of the APB channels in the bins of a BinningPlan, to
+    which the new APB records and encoder samples are added as they come.
+    The APB samples after the last encoder sample are kept until the
+    encoder catches up, their position is interpolated between the encoder
+    samples, so any sweep (also oscillatory) is binned.
+    '''
+    def __init__(self, plan, channels=None):
+        self.plan = plan
+        self.channels = channels or apb_channels
+        num_bins = len(plan.edge_counts) - 1
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+        self.sums = {channel: np.zeros(num_bins) for channel in self.channels}
+        self.num_samples = 0
+        self._pending = np.zeros(0, dtype=qas_handlers.APBBinFileHandler.record_dtype)
+        self._encoder_timestamps = np.zeros(0, dtype=np.int64)
+        self._encoder = np.zeros(0, dtype=np.int64)
+        self._t0 = None
+
+    def add(self, records, encoder_timestamps, encoder):
+        if len(encoder_timestamps):
+            if self._t0 is None:
+                self._t0 = encoder_timestamps[0]
+            self._encoder_timestamps = np.concatenate([self._encoder_timestamps, encoder_timestamps])
+            self._encoder = np.concatenate([self._encoder, encoder])
+        self._pending = np.concatenate([self._pending, records]) if len(self._pending) else records
+        if self._t0 is None or len(self._pending) == 0:
+            return
+
+        timestamps = qas_handlers.apb_timestamp(self._pending['ts_s'], self._pending['ts_ticks'],
+                                                ns_timestamps=True)
+        ready = np.searchsorted(timestamps, self._encoder_timestamps[-1], side='right')
+        timestamps = timestamps[:ready] - self._t0
+        position = np.interp(timestamps, self._encoder_timestamps - self._t0, self._encoder)
+        index = np.searchsorted(self.plan.edge_counts, position, side='right') - 1
+        # the samples before the first encoder sample have no position
+        inside = (index >= 0) & (index < len(self.counts)) & (timestamps >= 0)
+        index = index[inside]
+        self.counts += np.bincount(index, minlength=len(self.counts))
+        for channel in self.channels:
+            self.sums[channel] += np.bincount(index, weights=self._pending[channel][:ready][inside],
+                                              minlength=len(self.counts))
+        self.num_samples += ready
+        self._pending = self._pending[ready:]
+        if ready:
+            # the encoder samples before the last binned sample are not needed anymore
+            keep = max(np.searchsorted(self._encoder_timestamps - self._t0, timestamps[-1], side='right') - 1, 0)
+            self._encoder_timestamps, self._encoder = self._encoder_timestamps[keep:], self._encoder[keep:]
+
+    def spectrum(self, settings=None):
+        '''
+        The provisional spectrum, a DataFrame like bin_apb_stream.
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = {channel: np.where(self.counts > 0, sums / self.counts, np.nan)
+                     for channel, sums in self.sums.items()}
+        counts = self.counts
+        if self.plan.flipped:
+            counts, means = counts[::-1], {channel: values[::-1] for channel, values in means.items()}
+        return binned_dataframe(self.plan.energy, counts, means, settings)
+
+
+class LiveFlyScan:
+    '''
+    Tail the APB and encoder files of a running fly scan on a thread and
+    call callback(spectrum) with the provisional spectrum (see
+    LiveBinner.spectrum) every interval seconds, and once more with the
+    complete files after stop(). The callback is called on the thread, so
+    it should only hand the spectrum over (e.g. to a plot on the main
+    thread) and return.
+
+    The channels are in volts as soon as the APB settings file (.txt next
+    to the .bin file) can be read, in raw counts before.
+    '''
+    def __init__(self, apb_fpath, encoder_fpath, plan, callback, channels=None, interval=0.5):
+        self.apb = APBFileTail(apb_fpath)
+        self.encoder = EncoderFileTail(encoder_fpath)
+        self.binner = LiveBinner(plan, channels=channels)
+        self.callback = callback
+        self.interval = interval
+        self.settings_fpath = f'{os.path.splitext(apb_fpath)[0]}.txt'
+        self.settings = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def update(self):
+        '''
+        Bin the samples written since the previous update, returns the
+        provisional spectrum.
+        '''
+        encoder_timestamps, encoder = self.encoder.read()
+        self.binner.add(self.apb.read(), encoder_timestamps, encoder)
+        if self.settings is None:
+            try:
+                self.settings = qas_handlers.read_apb_settings(self.settings_fpath)
+            except (OSError, IndexError, ValueError):
+                pass  # not written (completely) yet
+        return self.binner.spectrum(self.settings)
+
+    def _update_and_call(self):
+        try:
+            self.callback(self.update())
+        except Exception as e:
+            print(f'Live binning of {self.apb.fpath} failed: {e!r}')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._update_and_call()
+        self._update_and_call()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='live-fly-scan', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
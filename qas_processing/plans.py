@@ -0,0 +1,105 @@
+"""
+Binning plans: the part of the binning of a fly scan which depends only on
+the trajectory, computed once and reused for all its cycles.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .binning import bin_stream, encoder_to_energy, energy_to_encoder, xas_energy_grid
+
+
+class BinningPlan:
+    '''
+    The energy grid of a trajectory with its edges converted to encoder
+    counts, so the fly scans are binned on the raw encoder positions,
+    without converting them to energy.
+    '''
+    def __init__(self, energy, edges, pulses_per_deg, angle_offset):
+        self.energy = energy
+        self.edges = edges
+        self.pulses_per_deg = pulses_per_deg
+        self.angle_offset = float(angle_offset)
+        edge_counts = energy_to_encoder(edges, pulses_per_deg, angle_offset)
+        # bin_stream needs increasing edges, the results are flipped back
+        self.flipped = bool(edge_counts[-1] < edge_counts[0])
+        self.edge_counts = edge_counts[::-1] if self.flipped else edge_counts
+
+    @classmethod
+    def from_encoder(cls, encoder, e0, pulses_per_deg, angle_offset, **grid_kwargs):
+        '''
+        Plan with the xas_energy_grid (grid_kwargs) over the energy range
+        covered by the encoder positions of a first cycle.
+        '''
+        energy = encoder_to_energy([np.min(encoder), np.max(encoder)], pulses_per_deg, angle_offset)
+        return cls(*xas_energy_grid(e0, energy.min(), energy.max(), **grid_kwargs), pulses_per_deg, angle_offset)
+
+    def bin(self, timestamps, signals, encoder_timestamps, encoder):
+        '''
+        bin_stream on the encoder positions, returns (counts, means) in the
+        order of the energy grid.
+        '''
+        counts, means = bin_stream(timestamps, signals, encoder_timestamps, encoder, self.edge_counts)
+        if self.flipped:
+            counts, means = counts[::-1], {name: values[::-1] for name, values in means.items()}
+        return counts, means
+
+
+def binning_plan_key(start, **grid_kwargs):
+    '''
+    The key of the plan of a fly scan from its start document: trajectory
+    file, LUT number, angle offset and E0 (and the grid parameters).
+    '''
+    pulses_per_deg = start.get('pulses_per_degree', start.get('pulses_per_deg'))
+    return (start.get('trajectory_name'), start.get('lut_number'), float(start['angle_offset']),
+            float(start['e0']), pulses_per_deg, tuple(sorted(grid_kwargs.items())))
+
+
+class BinningPlanCache:
+    '''
+    The binning plans of the last max_plans trajectories, the least
+    recently used plan is dropped when the cache is full.
+    '''
+    def __init__(self, max_plans=16):
+        self.max_plans = max_plans
+        self._plans = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._plans)
+
+    def __contains__(self, key):
+        return key in self._plans
+
+    def get(self, key, make_plan):
+        '''
+        Return the plan stored under key, calling make_plan() to compute it
+        if it is not in the cache (anymore).
+        '''
+        with self._lock:
+            if key in self._plans:
+                self.hits += 1
+                self._plans.move_to_end(key)
+                return self._plans[key]
+            self.misses += 1
+            plan = make_plan()
+            self._plans[key] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+                self.evictions += 1
+            return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self):
+        return {'plans': len(self._plans), 'max_plans': self.max_plans,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+binning_plan_cache = BinningPlanCache()
@@ -0,0 +1,224 @@
+"""
+Local auto-processing of the fly scans: a RunEngine callback which queues
+the runs when they stop and bins them on a local process pool, writing the
+spectra to the interp_filename of the runs.
+"""
+import itertools
+import os
+import queue
+import threading
+import time as ttime
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from .flyscan import bin_fly_scan
+from .sweeps import bin_oscillatory_scan, is_oscillatory
+from .workers import make_process_pool
+
+
+header_keys = ['uid', 'scan_id', 'name', 'time', 'element', 'edge', 'e0', 'trajectory_name', 'lut_number',
+               'angle_offset', 'pulses_per_degree', 'oscillatory', 'experiment', 'hutch']
+
+
+def write_binned_file(fpath, spectrum, start, sweeps=None):
+    '''
+    Write a binned spectrum (or the spectra of all sweeps, with a sweep
+    column) as a space separated text file, with the main metadata of the
+    start document (and the sweeps table) in '#' comment lines. The file is
+    written next to fpath and renamed, so it is never seen half written.
+    '''
+    lines = [f'# {key}: {start[key]}' for key in header_keys if key in start]
+    if sweeps is not None:
+        lines.append('# sweeps: ' + ' '.join(sweeps.columns))
+        lines += [f'# sweep {i}: ' + ' '.join(str(value) for value in row)
+                  for i, row in enumerate(sweeps.itertuples(index=False))]
+    lines.append('# ' + ' '.join(spectrum.columns))
+    os.makedirs(os.path.dirname(fpath) or '.', exist_ok=True)
+    tmp_fpath = f'{fpath}.{os.getpid()}.tmp'
+    with open(tmp_fpath, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+        spectrum.to_csv(f, sep=' ', header=False, index=False, float_format='%.6e')
+    os.replace(tmp_fpath, fpath)
+
+
+_worker_db = {}
+
+
+def _broker(db_name):
+    # one broker per worker process, with the QAS handlers registered
+    if db_name not in _worker_db:
+        from databroker.v0 import Broker
+        import qas_handlers
+        db = Broker.named(db_name)
+        qas_handlers.register_handlers(db.reg)
+        _worker_db[db_name] = db
+    return _worker_db[db_name]
+
+
+def process_fly_scan(uid, db_name='qas', fpath=None, **kwargs):
+    '''
+    Bin the fly scan uid (bin_fly_scan, or bin_oscillatory_scan for the
+    oscillatory trajectories) and write it to fpath, by default the
+    interp_filename of the run. Runs in the worker processes of
+    AutoProcessing, returns the path of the file.
+    '''
+    hdr = _broker(db_name)[uid]
+    start = hdr.start
+    fpath = fpath or start['interp_filename']
+    if is_oscillatory(start):
+        spectra, sweeps = bin_oscillatory_scan(_broker(db_name), hdr, max_workers=1, **kwargs)
+        spectrum = pd.concat([spectrum.assign(sweep=i) for i, spectrum in enumerate(spectra)], ignore_index=True)
+        spectrum = spectrum[['sweep'] + list(spectrum.columns[:-1])]
+        write_binned_file(fpath, spectrum, start, sweeps=sweeps)
+    else:
+        write_binned_file(fpath, bin_fly_scan(_broker(db_name), hdr, **kwargs), start)
+    return fpath
+
+
+class AutoProcessing:
+    '''
+    RunEngine callback (RE.subscribe(auto_processing)) which processes the
+    runs of the experiments starting with one of experiment_prefixes when
+    their stop document arrives, with process_fly_scan on a pool of
+    max_workers processes, so nothing runs on the RunEngine thread.
+
+    The runs wait in a priority queue until a worker is free: the lowest
+    priority first, by default 0 for the runs which stopped successfully
+    and 1 for the others, then in the order of arrival. A run which fails
+    is queued again after retry_delay seconds, up to max_retries times
+    (e.g. if its files are not completely written yet). The state of every
+    run is in jobs[uid]. If the pool breaks (a worker was killed), the run
+    is retried and the next one starts a new pool.
+    '''
+    def __init__(self, db_name='qas', max_workers=2, max_retries=2, retry_delay=10,
+                 experiment_prefixes=('fly_energy_scan_',), **process_kwargs):
+        self.db_name = db_name
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.experiment_prefixes = tuple(experiment_prefixes)
+        self.process_kwargs = process_kwargs
+        self.jobs = {}
+        self._starts = {}
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._workers = threading.Semaphore(max_workers)
+        self._closing = threading.Event()
+        self._executor_lock = threading.Lock()
+        self._executor = None
+        self._dispatcher = None
+
+    def __call__(self, name, doc):
+        if name == 'start':
+            if str(doc.get('experiment', '')).startswith(self.experiment_prefixes):
+                self._starts[doc['uid']] = doc
+        elif name == 'stop':
+            start = self._starts.pop(doc['run_start'], None)
+            if start is not None:
+                self.submit(doc['run_start'], priority=0 if doc.get('exit_status') == 'success' else 1)
+
+    def submit(self, uid, priority=0, **kwargs):
+        '''
+        Queue the run uid (also by hand, e.g. to process it again), kwargs
+        are passed on to process_fly_scan.
+        '''
+        self.jobs[uid] = {'state': 'queued', 'priority': priority, 'attempts': 0, 'error': None,
+                          'fpath': None, 'submitted': ttime.time(), 'started': None, 'duration': None}
+        if self._closing.is_set() and self._dispatcher is not None:
+            # after close(), the old dispatcher stops within the timeout of its wait for a worker
+            self._dispatcher.join()
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._closing.clear()
+            self._dispatcher = threading.Thread(target=self._dispatch, name='auto-processing', daemon=True)
+            self._dispatcher.start()
+        self._put(uid, priority, {**self.process_kwargs, **kwargs})
+
+    def _put(self, uid, priority, kwargs):
+        self._queue.put((priority, next(self._order), uid, kwargs))
+
+    def _dispatch(self):
+        while not self._closing.is_set():
+            priority, _, uid, kwargs = self._queue.get()
+            if uid is None:
+                # the stop of close(), unless it was left over by a previous dispatcher
+                if self._closing.is_set():
+                    return
+                continue
+            # wait for a free worker, with a timeout so close() stops the dispatcher
+            while not self._workers.acquire(timeout=0.5):
+                if self._closing.is_set():
+                    return
+            if self._closing.is_set():
+                self._workers.release()
+                return
+            job = self.jobs[uid]
+            job['state'] = 'running'
+            job['attempts'] += 1
+            job['started'] = ttime.time()
+            try:
+                with self._executor_lock:
+                    if self._executor is None:
+                        self._executor = make_process_pool(self.max_workers)
+                    executor = self._executor
+                future = executor.submit(process_fly_scan, uid, db_name=self.db_name, **kwargs)
+            except Exception as e:
+                # e.g. BrokenProcessPool: the worker is free again and the pool is built again
+                self._workers.release()
+                self._drop_executor()
+                self._failed(uid, priority, kwargs, e)
+                continue
+            future.add_done_callback(lambda future, uid=uid, priority=priority, kwargs=kwargs, executor=executor:
+                                     self._done(future, uid, priority, kwargs, executor))
+
+    def _drop_executor(self, executor=None):
+        # shut down the pool (only if it is still executor), the next run builds a new one
+        with self._executor_lock:
+            if self._executor is None or (executor is not None and self._executor is not executor):
+                return
+            executor, self._executor = self._executor, None
+        executor.shutdown(wait=False)
+
+    def _done(self, future, uid, priority, kwargs, executor=None):
+        self._workers.release()
+        job = self.jobs[uid]
+        job['duration'] = ttime.time() - job['started']
+        try:
+            job['fpath'] = future.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._drop_executor(executor)
+            self._failed(uid, priority, kwargs, e)
+        else:
+            job['state'] = 'done'
+            job['error'] = None
+            print(f'Auto-processing of {uid} done in {job["duration"]:.1f} s: {job["fpath"]}')
+
+    def _failed(self, uid, priority, kwargs, e):
+        job = self.jobs[uid]
+        job['error'] = repr(e)
+        if job['attempts'] <= self.max_retries and not self._closing.is_set():
+            job['state'] = 'retrying'
+            print(f'Auto-processing of {uid} failed ({e!r}), trying again in {self.retry_delay} s')
+            threading.Timer(self.retry_delay, self._put, (uid, priority, kwargs)).start()
+        else:
+            job['state'] = 'failed'
+            print(f'Auto-processing of {uid} failed: {e!r}')
+
+    def pending(self):
+        return [uid for uid, job in self.jobs.items() if job['state'] in ('queued', 'running', 'retrying')]
+
+    def close(self, wait=False):
+        '''
+        Stop the dispatcher and the worker processes, the queued runs are
+        dropped.
+        '''
+        self._closing.set()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if self._dispatcher is not None and self._dispatcher.is_alive():
+            self._queue.put((float('-inf'), next(self._order), None, None))
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,154 @@
+"""
+Oscillatory fly scans: one APB stream with many up and down sweeps of the
+mono, split at the turning points of the encoder and binned one spectrum
+per sweep, the sweeps in parallel on a process pool.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import qas_handlers
+from .binning import encoder_to_energy
+from .flyscan import apb_channels, apb_stream_names, bin_apb_stream_with_plan, read_fly_streams, stream_resource
+from .plans import BinningPlan, binning_plan_cache, binning_plan_key
+from .workers import make_process_pool
+
+
+def is_oscillatory(start):
+    '''
+    Whether the trajectory of the scan is oscillatory, from the 'oscillatory'
+    key of the start document. get_md_for_scan stores curr_traj.type.get()
+    there, the value of the -Type PV of the trajectory: a number for a
+    numeric or enum PV (nonzero is oscillatory), or text ('Oscillatory',
+    'True', '1'). The scans without the key are not oscillatory.
+    '''
+    value = start.get('oscillatory', False)
+    if isinstance(value, str):
+        value = value.strip().lower()
+        try:
+            return float(value) != 0
+        except ValueError:
+            return value in ('oscillatory', 'true', 'yes')
+    return bool(value)
+
+
+def turning_points(encoder, min_amplitude=0):
+    '''
+    Indices of the turning points of the encoder: the sign changes of its
+    nonzero steps, then the extrema closer than min_amplitude (counts) to
+    the previous one are dropped, so the jitter of the encoder at the
+    turns does not split the sweeps. The first and last samples are not
+    included.
+    '''
+    encoder = np.asarray(encoder)
+    moves = np.flatnonzero(np.diff(encoder))
+    if len(moves) == 0:
+        return np.array([], dtype=np.int64)
+    directions = np.sign(encoder[moves + 1] - encoder[moves])
+    extrema = moves[np.flatnonzero(directions[1:] != directions[:-1]) + 1]
+    if min_amplitude <= 0 or len(extrema) == 0:
+        return extrema
+
+    # zigzag over the candidates only, usually a few per sweep
+    values = encoder[extrema].astype(np.int64)
+    kept = []
+    anchor, current, direction = int(encoder[0]), 0, 0
+    for i, value in enumerate(values):
+        if direction == 0:
+            if abs(value - anchor) >= min_amplitude:
+                direction, current = np.sign(value - anchor), i
+            continue
+        if (value - values[current]) * direction > 0:
+            current = i
+        elif abs(value - values[current]) >= min_amplitude:
+            kept.append(current)
+            anchor, current, direction = values[current], i, -direction
+    if direction != 0 and abs(int(encoder[-1]) - values[current]) >= min_amplitude:
+        kept.append(current)
+    return extrema[kept]
+
+
+def split_sweeps(encoder, min_amplitude=0):
+    '''
+    (start, stop) of the sweeps in the encoder samples, from turning point
+    to turning point (and from the first and to the last sample).
+    '''
+    points = np.concatenate([[0], turning_points(encoder, min_amplitude), [len(encoder) - 1]])
+    return np.column_stack([points[:-1], points[1:] + 1])
+
+
+_worker = {}
+
+
+def _init_worker(fpath, resource_kwargs, plan, channels):
+    handler = qas_handlers.APBBinFileHandler(fpath, **{**resource_kwargs, 'lazy': True, 'ns_timestamps': True})
+    _worker['handler'] = handler
+    _worker['settings'] = handler.settings
+    _worker['plan'] = plan
+    _worker['channels'] = channels
+
+
+def _bin_sweep(apb_start, apb_stop, encoder_timestamps, encoder):
+    apb = _worker['handler']()
+    apb = type(apb)(apb.records[apb_start:apb_stop], ns_timestamps=True)
+    return bin_apb_stream_with_plan(apb, _worker['settings'], encoder_timestamps, encoder, _worker['plan'],
+                                    channels=_worker['channels'])
+
+
+def bin_oscillatory_scan(db, hdr, channels=None, min_amplitude=None, max_workers=None,
+                         plan_cache=binning_plan_cache, **grid_kwargs):
+    '''
+    Bin every sweep of an oscillatory fly scan on the same energy grid (the
+    BinningPlan of the trajectory, see bin_fly_scan). min_amplitude
+    (encoder counts) is by default 1/10 of the encoder range. The sweeps
+    are binned on a pool of max_workers processes, max_workers=1 bins them
+    in this process.
+
+    Returns (spectra, sweeps): the list of DataFrames of bin_apb_stream,
+    one per sweep, and a DataFrame with the direction (+1 for increasing
+    energy), times (int64 ns, and in s from the start of the first sweep),
+    energy range and number of APB samples of the sweeps.
+    '''
+    channels = channels or apb_channels
+    apb, settings, encoder_df = read_fly_streams(db, hdr)
+    encoder_timestamps = encoder_df['timestamp'].to_numpy()
+    encoder = encoder_df['encoder'].to_numpy()
+    start = hdr.start
+    pulses_per_deg, angle_offset = start['pulses_per_degree'], start['angle_offset']
+
+    if min_amplitude is None:
+        min_amplitude = (encoder.max() - encoder.min()) / 10
+    bounds = split_sweeps(encoder, min_amplitude)
+    t_start = encoder_timestamps[bounds[:, 0]]
+    t_stop = encoder_timestamps[bounds[:, 1] - 1]
+    apb_timestamps = apb['timestamp']
+    apb_bounds = np.column_stack([np.searchsorted(apb_timestamps, t_start, side='left'),
+                                  np.searchsorted(apb_timestamps, t_stop, side='right')])
+
+    def make_plan():
+        return BinningPlan.from_encoder(encoder, float(start['e0']), pulses_per_deg, angle_offset, **grid_kwargs)
+    plan = plan_cache.get(binning_plan_key(start, **grid_kwargs), make_plan) if plan_cache is not None \
+        else make_plan()
+
+    apb_stream_name = next(name for name in apb_stream_names if name in hdr.stream_names)
+    _, fpath, resource_kwargs = stream_resource(db, hdr, apb_stream_name)
+    tasks = [(apb_start, apb_stop, encoder_timestamps[first:last], encoder[first:last])
+             for (apb_start, apb_stop), (first, last) in zip(apb_bounds, bounds)]
+    if max_workers == 1:
+        _init_worker(fpath, resource_kwargs, plan, channels)
+        spectra = [_bin_sweep(*task) for task in tasks]
+    else:
+        max_workers = min(max_workers or os.cpu_count(), len(tasks))
+        with make_process_pool(max_workers, initializer=_init_worker,
+                               initargs=(fpath, resource_kwargs, plan, channels)) as executor:
+            spectra = list(executor.map(_bin_sweep, *zip(*tasks)))
+
+    energy_start = encoder_to_energy(encoder[bounds[:, 0]], pulses_per_deg, angle_offset)
+    energy_stop = encoder_to_energy(encoder[bounds[:, 1] - 1], pulses_per_deg, angle_offset)
+    sweeps = pd.DataFrame({'direction': np.sign(energy_stop - energy_start).astype(int),
+                           'timestamp_start': t_start, 'timestamp_stop': t_stop,
+                           'time_start': (t_start - t_start[0]) / 1e9, 'duration': (t_stop - t_start) / 1e9,
+                           'energy_start': energy_start, 'energy_stop': energy_stop,
+                           'num_samples': apb_bounds[:, 1] - apb_bounds[:, 0]})
+    return spectra, sweeps
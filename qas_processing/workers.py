@@ -0,0 +1,16 @@
+"""
+The process pools of the processing, shared by the sweeps of the
+oscillatory scans and the auto-processing.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def make_process_pool(max_workers, **kwargs):
+    '''
+    ProcessPoolExecutor with spawned workers (kwargs are passed on, e.g.
+    initializer and initargs). A forked worker would inherit the threads
+    and locks of the session (EPICS, ZMQ, the RunEngine), which can hang
+    it, the spawned ones start from a fresh interpreter.
+    '''
+    return ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn'), **kwargs)
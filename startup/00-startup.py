@@ -48,6 +48,11 @@ def stop_callback(name, doc):
     logger_open_files.info(f"\nBluesky scan UID: {doc['run_start']}\n"
                            f"Current open files: {nums[0]}  |  Max open files: {nums[-1]}\n"
                            f"{pformat(proc.open_files())}")
+    try:
+        # imported in 11-handlers.py
+        logger_open_files.info(f"Handler file pool: {file_handle_pool.stats()}")
+    except NameError:
+        pass
 
 
 import nslsii
@@ -253,10 +253,21 @@ def make_filename(filename):
 # #                                 'dtype': 'array'}}}
 
 
+def transcode_pizzabox_file(full_path, kind):
+    '''
+    Queue a finished pizza box text file for its binary copy, written on a
+    background thread (PizzaBoxTranscoder in qas_handlers). The resource
+    keeps the text file, its handler reads the copy once it is there.
+    '''
+    from qas_handlers import pizzabox_transcoder
+    pizzabox_transcoder.submit(full_path, kind)
+
+
 # TODO: Move this class to ophyd.
 class EncoderFS(Encoder):
     "Encoder Device, when read, returns references to data in filestore."
     chunk_size = 2**20
+    transcode = False  # write a binary copy of the file after complete(), read instead of the text file
     write_path_template = '/nsls2/data/qas-new/legacy/raw/pizza_box_data/%Y/%m/%d/'
 
     def __init__(self, *args, **kwargs):
@@ -454,6 +465,9 @@ class EncoderFS(Encoder):
     def collect_asset_docs(self):
         items = list(self._asset_docs_cache)
         self._asset_docs_cache.clear()
+        if self.transcode and self._datum_ids is not None:
+            # complete() is done, so the file is finished
+            transcode_pizzabox_file(self._full_path, 'enc')
         for item in items:
             yield item
 
@@ -499,6 +513,7 @@ class DigitalInput(Device):
 class DIFS(DigitalInput):
     "Encoder Device, when read, returns references to data in filestore."
     chunk_size = 2**20
+    transcode = False  # write a binary copy of the file after complete(), read instead of the text file
     write_path_template = '/data/nsls2/qas-new/legacy/raw/pizza_box_data/%Y/%m/%d/'
 
     def stage(self):
@@ -559,6 +574,8 @@ class DIFS(DigitalInput):
         now = ttime.time()
         ttime.sleep(1)  # wait for file to be written by pizza box
         if os.path.isfile(self._full_path):
+            if self.transcode:
+                transcode_pizzabox_file(self._full_path, 'di')
             with open(self._full_path, 'r') as f:
                 linecount = len(list(f))
             chunk_count = linecount // self.chunk_size + int(linecount % self.chunk_size != 0)
@@ -792,6 +809,7 @@ class DualAdcFS(TriggerAdc):
     # column is the column and enable_sel is what triggers the collection
     # rename because of existing children pv's
     chunk_size = 2**20
+    transcode = False  # write a binary copy of the file after complete(), read instead of the text file
     write_path_template = '/data/nsls2/qas-new/legacy/raw/pizza_box_data/%Y/%m/%d/'
     volt = FC(EpicsSignal, '{self._adc_read}}}E-I')
     offset = FC(EpicsSignal, '{self._adc_read}}}Offset')
@@ -833,6 +851,9 @@ class DualAdcFS(TriggerAdc):
             return
         self.generate_those_documents()
         items = list(self._asset_docs_cache)
+        if self.transcode and any(name == 'resource' for name, _ in items):
+            # only the twin which staged the file has its resource in the cache
+            transcode_pizzabox_file(self._full_path, 'an')
         print(f"DOCS!!! for DualAdcFS {self}", items)
         self._asset_docs_cache.clear()
         for item in items:
@@ -0,0 +1,22 @@
+print(__file__)
+
+# Parallel loading of the external data of a run, see qas_handlers.prefetch,
+# here with the broker of the profile.
+import qas_handlers
+
+
+def prefetch_run(hdr, max_workers=8):
+    '''
+    Load the data of all the resources of a run (APB, encoder, trigger,
+    Xspress3/Pilatus files...) at the same time, one resource per thread.
+    Returns a dict {datum_id: data}.
+    '''
+    return qas_handlers.prefetch_run(db, hdr, max_workers=max_workers)
+
+
+def fill_run(hdr, max_workers=8):
+    '''
+    Like hdr.documents(fill=True), but all the resources of the run are
+    prefetched in parallel first (see prefetch_run).
+    '''
+    return qas_handlers.fill_run(db, hdr, max_workers=max_workers)
@@ -0,0 +1,52 @@
+print(__file__)
+
+# The processing is in the qas_processing package in the profile directory
+# (put on sys.path in 11-handlers.py), so it can run without the profile.
+from qas_processing import (BinningPlan, LiveFlyScan, bin_fly_scan, bin_oscillatory_scan, binning_plan_cache,
+                            binning_plan_key, encoder_to_energy, is_oscillatory, xas_energy_grid)
+
+
+def bin_run(uid, **kwargs):
+    '''
+    Bin the APB channels of the fly scan uid on an energy grid, see
+    qas_processing.bin_fly_scan:
+
+        df = bin_run(uid)
+        df = bin_run(uid, xanes_spacing=0.5, exafs_k_spacing=0.05)
+    '''
+    return bin_fly_scan(db, db[uid], **kwargs)
+
+
+def bin_sweeps(uid, **kwargs):
+    '''
+    Bin every sweep of the oscillatory fly scan uid, one spectrum per sweep,
+    see qas_processing.bin_oscillatory_scan:
+
+        spectra, sweeps = bin_sweeps(uid)
+        spectra, sweeps = bin_sweeps(uid, max_workers=4)
+    '''
+    hdr = db[uid]
+    if not is_oscillatory(hdr.start):
+        print(f'{uid} is not an oscillatory scan, its sweeps are binned anyway')
+    return bin_oscillatory_scan(db, hdr, **kwargs)
+
+
+def live_binning_plan(e_start=-200, e_stop=1000, **grid_kwargs):
+    '''
+    The BinningPlan of the live binning of the loaded trajectory (see
+    FlyerAPB.live_callback): the cached plan of its previous cycles if there
+    is one, so the live and final spectra have the same grid, otherwise the
+    xas_energy_grid from e0 + e_start to e0 + e_stop (eV).
+    '''
+    lut_number = int(mono1.lut_number_rbv.get())
+    e0 = float(getattr(mono1, f'traj{lut_number}').e0.get())
+    start = {'trajectory_name': mono1.trajectory_name.get(),
+             'lut_number': lut_number,
+             'angle_offset': str(mono1.angle_offset.get()),
+             'e0': e0,
+             'pulses_per_degree': mono1.pulses_per_deg}
+    key = binning_plan_key(start, **grid_kwargs)
+    if key in binning_plan_cache:
+        return binning_plan_cache.get(key, None)
+    return BinningPlan(*xas_energy_grid(e0, e0 + e_start, e0 + e_stop, **grid_kwargs), mono1.pulses_per_deg,
+                       start['angle_offset'])
@@ -150,27 +150,3 @@ class AnalogPizzaBoxTrigger(Device):
 #XF:07BMB-CT{PBA:1}:Pulse:1:Frequency-SP
 apb_trigger = AnalogPizzaBoxTrigger(prefix="XF:07BMB-CT{PBA:1}:Pulse:1:", name="apb_trigger")
 apb_trigger_pil900k = AnalogPizzaBoxTrigger(prefix="XF:07BMB-CT{PBA:1}:Pulse:2:", name="apb_trigger_pil900k")
-
-
-
-class APBTriggerFileHandler(HandlerBase):
-    "Read APB trigger *.bin files"
-    def __init__(self, fpath):
-        raw_data = np.fromfile(fpath, dtype=np.int32)
-        raw_data = raw_data.reshape((raw_data.size // 3, 3))
-        columns = ['timestamp', 'transition']
-        derived_data = np.zeros((raw_data.shape[0], 2))
-        derived_data[:, 0] = raw_data[:, 1] + raw_data[:, 2]  * 8.0051232 * 1e-9  # Unix timestamp with nanoseconds
-        derived_data[:, 1] = raw_data[:, 0]
-
-        self.df = pd.DataFrame(data=derived_data, columns=columns)
-        self.raw_data = raw_data
-
-    def __call__(self):
-        return self.df
-
-
-
-
-db.reg.register_handler('APB_TRIGGER',
-                        APBTriggerFileHandler, overwrite=True)
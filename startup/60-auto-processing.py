@@ -1,90 +1,35 @@
-# print(__file__)
-# # Things for the ZMQ communication
-# import socket
-#
-# PB_PULSES_PER_DEGREE = 23600*400/360
-#
-# from bluesky.callbacks import CallbackBase
-#
-# # Needs the lightflow environment
-# from lightflow.config import Config
-# from lightflow.workflows import start_workflow
-#
-# # set where the lightflow config file is
-# lightflow_config_file = "/home/xf07bm/.config/lightflow/lightflow.cfg"
-# import socket
-#
-# def create_interp_request(uid):
-#     '''
-#         Create an interpolation request.
-#
-#     '''
-#     data = dict()
-#     requester = str(socket.gethostname())
-#     request = {
-#             'uid': uid,
-#             'pulses_per_deg': PB_PULSES_PER_DEGREE,
-#             'requester': requester,
-#             'type': 'spectroscopy',
-#             'processing_info': {
-#                 'type': 'interpolate',
-#                 'interp_base': 'i0'
-#             }
-#         }
-#     return request
-#
-#
-#
-# def submit_lightflow_job(req):
-#     '''
-#         Submit an interpolation job to lightflow
-#
-#         uid : the uid of the data set
-#         lightflow_config : the lightflow config filename
-#     '''
-#     config = Config()
-#     config.load_from_file(lightflow_config_file)
-#
-#     store_args = dict()
-#     store_args['request'] = req
-#     job_id = start_workflow(name='interpolation', config=config,
-#                             store_args=store_args, queue="qas-workflow")
-#     print('Started workflow with ID', job_id)
-#
-# class InterpolationRequester(CallbackBase):
-#     '''
-#         The interpolation requester
-#
-#         On a stop doc, submits request to lightflow
-#     '''
-#     def stop(self, doc):
-#         uid = doc['run_start']
-#         req = create_interp_request(uid)
-#         submit_lightflow_job(req)
-#
-#
-# import sys
-# sys.path.append("/home/xf07bm/Repos/workflows")
-# class InterpolationRequesterNoLightFlow(CallbackBase):
-#     '''
-#         The interpolation requester
-#
-#         On a stop doc, submits request to lightflow
-#     '''
-#     # NOTE : for testing ONLY
-#     def stop(self, doc):
-#         uid = doc['run_start']
-#         request = create_interp_request(uid)
-#         #submit_lightflow_job(request)
-#         store = dict()
-#         store['request'] = request
-#         data = dict()
-#         import interpolation
-#         interpolation.process_run_func(data, store, None, None)
-#
-#
-#
-#
-# interpolator = InterpolationRequester()
-# #interpolator = InterpolationRequesterNoLightFlow()
-# interpolation_subscribe_id = RE.subscribe(interpolator)
+print(__file__)
+
+# The fly scans (experiments 'fly_energy_scan_*') are binned when they stop, on
+# a local process pool, and the spectra are written to their interp_filename,
+# see qas_processing.AutoProcessing. The state of the runs is in
+# auto_processing.jobs, a run can be (re)processed with auto_processing.submit(uid).
+#
+# It is on by default, the worker processes are started by the first run. Start
+# the session with QAS_AUTO_PROCESSING=0 in the environment to leave it off, or
+# call disable_auto_processing() (and enable_auto_processing()).
+import atexit
+import os
+
+from qas_processing import AutoProcessing
+
+auto_processing = AutoProcessing(db_name=beamline_id, max_workers=2)
+atexit.register(auto_processing.close)
+auto_processing_subscribe_id = None
+
+
+def enable_auto_processing():
+    global auto_processing_subscribe_id
+    if auto_processing_subscribe_id is None:
+        auto_processing_subscribe_id = RE.subscribe(auto_processing)
+
+
+def disable_auto_processing():
+    global auto_processing_subscribe_id
+    if auto_processing_subscribe_id is not None:
+        RE.unsubscribe(auto_processing_subscribe_id)
+        auto_processing_subscribe_id = None
+
+
+if os.environ.get('QAS_AUTO_PROCESSING', '1').lower() not in ('0', 'false', 'no'):
+    enable_auto_processing()
@@ -170,11 +170,18 @@ class FileStoreHDF5Squashing(FileStorePluginBase):
         # print(f"After staging: {self._fn = }\n{self._fp = }")
 
 
-class QASHDF5Plugin(HDF5Plugin_V33, FileStoreHDF5Squashing, FileStoreIterativeWrite):
+class HDF5PluginBloscV33(HDF5Plugin_V33):
+    """HDF5 plugin with the settings of the Blosc compression."""
+    blosc_shuffle = Cpt(SignalWithRBV, "BloscShuffle", string=True, kind="config")
+    blosc_compressor = Cpt(SignalWithRBV, "BloscCompressor", string=True, kind="config")
+    blosc_level = Cpt(SignalWithRBV, "BloscCompressLevel", kind="config")
+
+
+class QASHDF5Plugin(HDF5PluginBloscV33, FileStoreHDF5Squashing, FileStoreIterativeWrite):
     pass
 
 
-class HDF5PluginWithFileStore(HDF5Plugin_V33, FileStoreHDF5IterativeWrite):
+class HDF5PluginWithFileStore(HDF5PluginBloscV33, FileStoreHDF5IterativeWrite):
     """Add this as a component to detectors that write HDF5s."""
 
     def get_frames_per_point(self):
@@ -321,7 +328,41 @@ class PilatusBase(SingleTriggerV33, PilatusDetectorNonBlocking):
         return md
 
 
+class SWMRFlushPolicy:
+    """
+    Picks how many frames the HDF5 plugin writes between the SWMR flushes.
+
+    Interactive acquisitions (no frame rate) flush every frame. Streams flush
+    about every max_latency seconds, or every live_max_latency seconds when
+    a live consumer follows the file, and at least every max_frames frames.
+    """
+
+    def __init__(self, max_latency=1.0, live_max_latency=0.05, max_frames=1000):
+        self.max_latency = max_latency
+        self.live_max_latency = live_max_latency
+        self.max_frames = max_frames
+
+    def num_frames_flush(self, frame_rate=None, live=False):
+        if not frame_rate or frame_rate <= 0:
+            return 1
+        latency = self.live_max_latency if live else self.max_latency
+        return int(min(max(1, frame_rate * latency), self.max_frames))
+
+
+# settings of the HDF5 plugin for PilatusHDF5.set_compression, the frames are
+# decoded by the handler with the filters from hdf5plugin
+pilatus_hdf5_compression = {
+    None: {"compression": "None"},
+    "blosc-lz4": {"compression": "Blosc", "blosc_shuffle": "Bit", "blosc_compressor": "LZ4", "blosc_level": 5},
+    "blosc-zstd": {"compression": "Blosc", "blosc_shuffle": "Bit", "blosc_compressor": "ZSTD", "blosc_level": 3},
+    "bslz4": {"compression": "BSLZ4"},
+}
+
+
 class PilatusHDF5(PilatusBase):
+    flush_policy = SWMRFlushPolicy()
+    live_consumer = False  # set to True when the file is followed during the acquisition
+
     hdf5 = Cpt(
         HDF5PluginWithFileStore,
         suffix="HDF1:",
@@ -343,6 +384,37 @@ class PilatusHDF5(PilatusBase):
                 (self.hdf5.num_frames_flush, 1),
             ]
         )
+        self.compression_mode = None
+        # the flush interval picked in stage() goes to the configuration of the descriptors
+        self.configuration_attrs = self.configuration_attrs + ["hdf5.num_frames_flush"]
+
+    def get_frame_rate(self):
+        # single images are counted interactively
+        return None
+
+    def stage(self):
+        # recorded with the configuration of the detector (hdf5.num_frames_flush), the
+        # resource_kwargs stay those of the stock AD_HDF5_SWMR handlers
+        num_frames_flush = self.flush_policy.num_frames_flush(self.get_frame_rate(), live=self.live_consumer)
+        self.hdf5.stage_sigs[self.hdf5.num_frames_flush] = num_frames_flush
+        return super().stage()
+
+    def set_compression(self, mode=None):
+        """
+        Compress the frames written by the HDF5 plugin, with one of the modes of
+        pilatus_hdf5_compression ("blosc-lz4", "blosc-zstd", "bslz4"), or write
+        them uncompressed with mode=None. Applied when the detector is staged.
+        """
+        if mode not in pilatus_hdf5_compression:
+            raise ValueError(f"mode={mode!r} must be one of {list(pilatus_hdf5_compression)}")
+        for attr in ["compression", "blosc_shuffle", "blosc_compressor", "blosc_level"]:
+            self.hdf5.stage_sigs.pop(getattr(self.hdf5, attr), None)
+        for attr, value in pilatus_hdf5_compression[mode].items():
+            self.hdf5.stage_sigs[getattr(self.hdf5, attr)] = value
+        # the file has to be configured before the capture starts
+        if "capture" in self.hdf5.stage_sigs:
+            self.hdf5.stage_sigs.move_to_end("capture")
+        self.compression_mode = mode
 
     def set_primary_roi(self, num):
         st = f"stats{num}"
@@ -404,6 +476,10 @@ class PilatusStreamHDF5(PilatusHDF5):
             output += f'{input_dict["roi_num"]:01d}'
         return output
 
+    def get_frame_rate(self):
+        # the rate of the trigger now, acq_rate may be left from the previous fly scan
+        return self.ext_trigger_device.freq.get()
+
     def prepare_to_fly(self, traj_duration):
         self.acq_rate = self.ext_trigger_device.freq.get()
         self.num_points = int(self.acq_rate * (traj_duration + 1))
@@ -605,97 +681,25 @@ def pil_count(acq_time: int = 1, num_frames: int = 1, open_shutter: bool = True)
         yield from shutter.close_plan()
 
 
-from itertools import product
-
-import pandas as pd
-from databroker.assets.handlers import AreaDetectorTiffHandler, HandlerBase, PilatusCBFHandler, Xspress3HDF5Handler, AreaDetectorHDF5SWMRHandler
-# Note: the databroker is v0 and follows the old code path, so it uses databroker.assets.handlers.AreaDetectorHDF5SWMRHandler.
-# from area_detector_handlers.handlers import AreaDetectorHDF5SWMRHandler
-
-
-class QASAreaDetectorHDF5SWMRHandler(AreaDetectorHDF5SWMRHandler):
+def recompute_pilatus_rois(uid, rois, data_key='pilatus_image', max_block_bytes=2**26):
     '''
-    The reason we need this custom handles is that the reference to `self._dataset` is not refreshed correctly,
-    so we redefine `self._dataset` on every call.
-
-    file = "<path>/575d134b-adf9-453a-a1a8_000000.h5"
-    swmr = AreaDetectorHDF5SWMRHandler(file)
-
-
-    In [150]: swmr._file["/entry/data/data"]
-    Out[150]: <HDF5 dataset "data": shape (3, 1043, 981), type "<u2">
-
-    In [151]: swmr._dataset
-    Out[151]: <HDF5 dataset "data": shape (1, 1043, 981), type "<u2">
-
-    ERROR:
-    ------
-
-    In [186]: list(swmr(0))
-    Out[186]:
-    [Frame([[    0,     0,     0, ...,     0,     0,     0],
-            [    0,     0,     0, ...,     0,     0,     0],
-            [    0,     0,     0, ...,     0,     0,     0],
-            ...,
-            [    0,     0,     0, ..., 65534, 65534, 65534],
-            [    0,     0,     0, ..., 65534, 65534, 65534],
-            [    0,     0,     0, ..., 65534, 65534, 65534]], dtype=uint16)]
-
-    In [187]: list(swmr(1))
-    ---------------------------------------------------------------------------
-    IndexError                                Traceback (most recent call last)
-    Cell In[187], line 1
-    ----> 1 list(swmr(1))
-
-    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/slicerator/__init__.py:226, in <genexpr>(.0)
-        225 def __iter__(self):
-    --> 226     return (self._get(i) for i in self.indices)
-
-    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/slicerator/__init__.py:206, in Slicerator._get(self, key)
-        205 def _get(self, key):
-    --> 206     return self._ancestor[key]
+    Recompute the ROI sums of a Pilatus run from the stored images, e.g. for
+    ROIs which were misconfigured on the IOC during the scan:
 
-    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/slicerator/__init__.py:187, in Slicerator.from_class.<locals>.SliceratorSubclass.__getitem__(self, i)
-        185 indices, new_length = key_to_indices(i, len(self))
-        186 if new_length is None:
-    --> 187     return self._get(indices)
-        188 else:
-        189     return cls(self, indices, new_length, propagate_attrs)
-
-    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/pims/base_frames.py:100, in FramesSequence.__getitem__(self, key)
-        97 def __getitem__(self, key):
-        98     """__getitem__ is handled by Slicerator. In all pims readers, the data
-        99     returning function is get_frame."""
-    --> 100     return self.get_frame(key)
-
-    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/databroker/assets/handlers.py:37, in ImageStack.get_frame(self, i)
-        36 def get_frame(self, i):
-    ---> 37     return Frame(self._dataset[self._start + i], frame_no=i)
-
-    File h5py/_objects.pyx:54, in h5py._objects.with_phil.wrapper()
-
-    File h5py/_objects.pyx:55, in h5py._objects.with_phil.wrapper()
-
-    File /nsls2/conda/envs/2023-1.3-py310-tiled/lib/python3.10/site-packages/h5py/_hl/dataset.py:741, in Dataset.__getitem__(self, args, new_dtype)
-        739 if self._fast_read_ok and (new_dtype is None):
-        740     try:
-    --> 741         return self._fast_reader.read(args)
-        742     except TypeError:
-        743         pass  # Fall back to Python read pathway below
-
-    File h5py/_selector.pyx:355, in h5py._selector.Reader.read()
-
-    File h5py/_selector.pyx:151, in h5py._selector.Selector.apply_args()
-
-    IndexError: Index (1) out of range for (0-0)
+        recompute_pilatus_rois(uid, {'roi1': {'x': 100, 'dx': 20, 'y': 50, 'dy': 10}})
     '''
-    def __call__(self, point_number):
-        self._dataset = self._file["/entry/data/data"]
-        return super().__call__(point_number)
-
-
-db.reg.register_handler('AD_HDF5_SWMR',
-                         QASAreaDetectorHDF5SWMRHandler, overwrite=True)
+    from qas_handlers import QASAreaDetectorHDF5SWMRHandler
+
+    hdr = db[uid]
+    for name, doc in hdr.documents(fill=False):
+        if name == 'event' and data_key in doc['data']:
+            datum_id = doc['data'][data_key]
+            break
+    else:
+        raise KeyError(f'{data_key!r} is not in the events of {uid}')
+    resource = db.reg.resource_given_datum_id(datum_id)
+    handler = QASAreaDetectorHDF5SWMRHandler(os.path.join(resource['root'], resource['resource_path']))
+    return handler.roi_sums(rois, max_block_bytes=max_block_bytes)
 
 # An exception has occurred, use '%tb verbose' to see the full traceback.
 # AttributeError: 'Array' object has no attribute 'id'
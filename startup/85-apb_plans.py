@@ -20,6 +20,11 @@ class FlyerAPB:
         self.motor = motor
         self._motor_status = None
         self._mount_exists = False
+        # callback(spectrum) for the live binning of the scans (see LiveFlyScan), e.g.
+        # flyer_apb.live_callback = lambda spectrum: print(spectrum['counts'].sum())
+        self.live_callback = None
+        self.live_interval = 0.5
+        self._live = None
 
     def kickoff(self, *args, **kwargs):
 
@@ -59,6 +64,10 @@ class FlyerAPB:
 
         streaming_st = SubscriptionStatus(self.det.streaming, callback, run=False)
 
+        if self.live_callback is not None:
+            self._live = LiveFlyScan(f'{self.det.filename}.bin', self.pbs[0]._full_path, live_binning_plan(),
+                                     self.live_callback, interval=self.live_interval).start()
+
         # Start apb after encoder pizza-boxes, which will trigger the motor.
         self.det.stream.set(1)
 
@@ -94,6 +103,9 @@ class FlyerAPB:
     def stop(self):
         self.det.stream.set(0).wait()
         self.det.complete().wait()
+        if self._live is not None:
+            self._live.stop()
+            self._live = None
         self.det.unstage()
 
         for pb in self.pbs:
@@ -236,6 +248,7 @@ def get_md_for_scan(name, mono_scan_type, plan_name, experiment, detector=None,
               'interp_filename': interp_fn,
               'angle_offset': str(mono1.angle_offset.get()),
               'trajectory_name': mono1.trajectory_name.get(),
+              'lut_number': int(mono1.lut_number_rbv.get()),
               'element': curr_traj.elem.get(),
               'element_full': full_element_name,
               'edge': curr_traj.edge.get(),
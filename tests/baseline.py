@@ -0,0 +1,80 @@
+# Straightforward reference implementations of the processing, sample by
+# sample and bin by bin, and of the original handlers, the optimized code of
+# qas_processing and qas_handlers is checked against them in the tests.
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def bin_samples(timestamps, signals, encoder_timestamps, position, edges, to_energy=None):
+    '''
+    The position of every sample interpolated from the encoder stream (and
+    converted with to_energy), then the samples of every bin picked with a
+    mask. The samples outside the encoder stream are in no bin. Returns
+    (counts, means) like bin_stream.
+    '''
+    timestamps = np.asarray(timestamps)
+    inside = (timestamps >= encoder_timestamps[0]) & (timestamps <= encoder_timestamps[-1])
+    # relative times, the int64 ns since the epoch are not exact in float64
+    t0 = encoder_timestamps[0]
+    value = np.interp(timestamps - t0, encoder_timestamps - t0, position)
+    if to_energy is not None:
+        value = to_energy(value)
+    counts = np.zeros(len(edges) - 1, dtype=np.int64)
+    means = {name: np.full(len(edges) - 1, np.nan) for name in signals}
+    for i, (low, high) in enumerate(zip(edges[:-1], edges[1:])):
+        mask = inside & (value >= min(low, high)) & (value < max(low, high))
+        counts[i] = mask.sum()
+        for name, signal in signals.items():
+            if counts[i]:
+                means[name][i] = np.asarray(signal)[mask].mean()
+    return counts, means
+
+
+def sweep_bounds(encoder, min_amplitude):
+    '''
+    (start, stop) of the sweeps of an oscillating encoder, walking the
+    samples one by one: a turn is the first extremum (its last sample if
+    it is flat) of a move of at least min_amplitude counts in one direction, followed by a
+    move of at least min_amplitude in the other.
+    '''
+    encoder = [int(value) for value in encoder]
+    turns = []
+    anchor, extremum, direction = encoder[0], 0, 0
+    for i, value in enumerate(encoder):
+        if direction == 0:
+            if abs(value - anchor) >= min_amplitude:
+                direction, extremum = (1 if value > anchor else -1), i
+        elif (value - encoder[extremum]) * direction > 0 or (value == encoder[extremum] and extremum == i - 1):
+            extremum = i  # further, or on the flat top of the extremum
+        elif abs(value - encoder[extremum]) >= min_amplitude:
+            turns.append(extremum)
+            extremum, direction = i, -direction
+    if direction != 0 and abs(encoder[-1] - encoder[extremum]) >= min_amplitude:
+        turns.append(extremum)
+    points = [0] + turns + [len(encoder) - 1]
+    return [(start, stop + 1) for start, stop in zip(points[:-1], points[1:])]
+
+
+def apb_volts_dataframe(fpath):
+    '''
+    The APB stream as the original handler read it, a DataFrame of float64
+    columns, with every channel then converted to volts column by column,
+    with the gains and offsets parsed from the .txt settings file like its
+    commented out code did.
+    '''
+    with open(f'{os.path.splitext(fpath)[0]}.txt') as fp:
+        content = [x.strip() for x in fp.readlines()]
+    gains = [int(x) for x in content[1].split(':')[1].split(',')]
+    offsets = [int(x) for x in content[2].split(':')[1].split(',')]
+
+    columns = ['timestamp', 'i0', 'it', 'ir', 'iff', 'aux1', 'aux2', 'aux3', 'aux4']
+    raw_data = np.fromfile(fpath, dtype=np.int32).reshape(-1, len(columns) + 1)
+    derived_data = np.zeros((raw_data.shape[0], raw_data.shape[1] - 1))
+    derived_data[:, 0] = raw_data[:, -2] + raw_data[:, -1] * 8.0051232 * 1e-9
+    derived_data[:, 1:] = raw_data[:, :-2]
+    df = pd.DataFrame(data=derived_data, columns=columns)
+    for i, column in enumerate(columns[1:len(gains) + 1]):
+        df[column] = (df[column] - offsets[i]) / gains[i]
+    return df
@@ -0,0 +1,162 @@
+# Benchmark of the QAS databroker handlers on synthetic data (see
+# synthetic_data.py). Every case is timed and its peak memory is measured with
+# tracemalloc, the results are saved as JSON and can be compared with an
+# earlier run:
+#
+#   python tests/benchmark_handlers.py --size production --output bench.json
+#   python tests/benchmark_handlers.py --compare bench.json
+#
+# It needs the same environment as the profile (databroker, h5py, pandas).
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from synthetic_data import SIZES, XS3_DATA_KEY, make_data
+
+
+# the handlers are imported from the qas_handlers package in the profile directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import qas_handlers
+
+
+def get_cases(paths):
+    '''
+    (name, file, function) for every benchmark case, the function opens the
+    file with the handler and reads it like the filling of a run does
+    '''
+    enc_chunk_size = adc_chunk_size = di_chunk_size = 1024
+
+    def pizzabox_enc():
+        return qas_handlers.PizzaBoxEncHandlerTxt(paths['enc'], chunk_size=enc_chunk_size)(0)
+
+    def pizzabox_an():
+        handler = qas_handlers.PizzaBoxAnHandlerTxt(paths['adc'], chunk_size=adc_chunk_size)
+        return [handler(0, column=column) for column in range(2)]
+
+    def pizzabox_di():
+        handler = qas_handlers.PizzaBoxDIHandlerTxt(paths['di'], chunk_size=di_chunk_size)
+        return [handler(chunk_num) for chunk_num in range(-(-handler.num_lines // di_chunk_size))]
+
+    def apb():
+        return qas_handlers.APBBinFileHandler(paths['apb'])()
+
+    def apb_volts():
+        return qas_handlers.APBBinFileHandler(paths['apb'], volts=True)()
+
+    def apb_window():
+        handler = qas_handlers.APBBinFileHandler(paths['apb'], lazy=True)
+        data = handler()
+        t_start, t_stop = data.timestamp_at(len(data) // 4), data.timestamp_at(len(data) // 2)
+        return handler(t_start, t_stop).to_dataframe()
+
+    def apb_overview():
+        # the first call builds the pyramid file, the repeats read it
+        return qas_handlers.APBBinFileHandler(paths['apb'], volts=True).decimated(max_points=2000)
+
+    def apb_trigger():
+        return qas_handlers.APBTriggerFileHandler(paths['trigger'])()
+
+    def xspress3_frames():
+        handler = qas_handlers.QASXspress3HDF5Handler(paths['xs'], key=XS3_DATA_KEY)
+        return [handler(frame=frame) for frame in range(handler.num_frames)]
+
+    def xspress3_bulk():
+        return qas_handlers.QASXspress3HDF5Handler(paths['xs'], key=XS3_DATA_KEY).read_frames()
+
+    def pilatus_swmr():
+        handler = qas_handlers.QASAreaDetectorHDF5SWMRHandler(paths['pilatus'], frame_per_point=1)
+        return [np.asarray(handler(point)[0]) for point in range(handler.refresh())]
+
+    return [('PIZZABOX_ENC_FILE_TXT', 'enc', pizzabox_enc),
+            ('PIZZABOX_AN_FILE_TXT', 'adc', pizzabox_an),
+            ('PIZZABOX_DI_FILE_TXT', 'di', pizzabox_di),
+            ('APB', 'apb', apb),
+            ('APB volts', 'apb', apb_volts),
+            ('APB time window', 'apb', apb_window),
+            ('APB overview', 'apb', apb_overview),
+            ('APB_TRIGGER', 'trigger', apb_trigger),
+            ('XSP3 per frame', 'xs', xspress3_frames),
+            ('XSP3 read_frames', 'xs', xspress3_bulk),
+            ('AD_HDF5_SWMR', 'pilatus', pilatus_swmr)]
+
+
+def run_case(func, repeat, file_handle_pool=None):
+    seconds = []
+    for _ in range(repeat):
+        if file_handle_pool is not None:
+            file_handle_pool.clear()  # every repeat starts from closed files
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+
+    if file_handle_pool is not None:
+        file_handle_pool.clear()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': seconds, 'best': min(seconds), 'median': statistics.median(seconds),
+            'peak_memory_mb': peak / 2**20}
+
+
+def run(size='small', repeat=5, data_dir=None, only=None):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = data_dir or tmp_dir
+        print(f'writing {size} data to {data_dir}')
+        paths = make_data(data_dir, size)
+
+        results = []
+        for name, file_key, func in get_cases(paths):
+            if only and not any(pattern in name for pattern in only):
+                continue
+            result = {'name': name, 'file_size_mb': os.path.getsize(paths[file_key]) / 2**20,
+                      **run_case(func, repeat, qas_handlers.file_handle_pool)}
+            print(f"{name:24s} best {result['best']:9.4f} s  median {result['median']:9.4f} s  "
+                  f"peak {result['peak_memory_mb']:9.1f} MB")
+            results.append(result)
+
+    return {'metadata': {'date': datetime.datetime.now().isoformat(), 'size': size, 'repeat': repeat,
+                         'sizes': SIZES[size], 'python': sys.version.split()[0], 'platform': platform.platform(),
+                         'numpy': np.__version__, 'pandas': pd.__version__, 'h5py': h5py.__version__},
+            'results': results}
+
+
+def compare(results, reference):
+    '''
+    print the ratio of the best times to the ones of a previous run
+    '''
+    reference_results = {result['name']: result for result in reference['results']}
+    for result in results['results']:
+        if result['name'] in reference_results:
+            ratio = result['best'] / reference_results[result['name']]['best']
+            print(f"{result['name']:24s} {ratio:6.2f}x of the reference{'  <-- slower' if ratio > 1.1 else ''}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the QAS handlers on synthetic data')
+    parser.add_argument('--size', choices=list(SIZES), default='small')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--data-dir', help='keep the synthetic files here instead of a temporary directory')
+    parser.add_argument('--only', nargs='*', help='run only the cases with these substrings in the name')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare with')
+    args = parser.parse_args()
+
+    results = run(args.size, args.repeat, args.data_dir, args.only)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
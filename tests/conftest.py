@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the qas_handlers and qas_processing packages are in the profile directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# needs the databroker configuration of the beamline
+collect_ignore = ['test_new_handler.py']
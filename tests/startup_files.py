@@ -0,0 +1,31 @@
+# The startup files of the IPython profile run in one namespace, together with
+# the devices of the beamline. The tests run only the definitions they need
+# from them.
+import ast
+import os
+
+STARTUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'startup')
+
+
+def load_startup(fname, names, namespace=None, imports=True):
+    '''
+    Runs the classes, functions and constants `names` of the startup file
+    fname (after its imports, with imports=True) in namespace, which holds
+    what the earlier startup files define. Returns the namespace.
+    '''
+    with open(os.path.join(STARTUP_DIR, fname)) as f:
+        tree = ast.parse(f.read(), filename=fname)
+    body = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            if imports:
+                body.append(node)
+        elif isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+            if node.name in names:
+                body.append(node)
+        elif isinstance(node, ast.Assign):
+            if any(isinstance(target, ast.Name) and target.id in names for target in node.targets):
+                body.append(node)
+    namespace = {} if namespace is None else namespace
+    exec(compile(ast.Module(body=body, type_ignores=[]), fname, 'exec'), namespace)
+    return namespace
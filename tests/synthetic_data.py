@@ -0,0 +1,162 @@
+# Synthetic data files in the formats written at QAS, for the handler benchmarks
+# (see benchmark_handlers.py). The sizes are given per file, 'production' is
+# about what a one minute fly scan produces.
+import os
+
+import h5py
+import numpy as np
+
+
+SIZES = {
+    'small': {'enc': 20_000, 'adc': 20_000, 'di': 2_000, 'apb': 100_000, 'trigger': 2_000,
+              'xs_frames': 500, 'pilatus_frames': 50},
+    'production': {'enc': 1_000_000, 'adc': 1_000_000, 'di': 100_000, 'apb': 6_000_000, 'trigger': 60_000,
+                   'xs_frames': 10_000, 'pilatus_frames': 1_000},
+}
+
+START_TIME = 1_600_000_000
+APB_TICK = 8.0051232e-9
+XS3_DATA_KEY = 'entry/instrument/detector/data'
+XS3_ROI_KEY = 'entry/instrument/detector/NDAttributes'
+PILATUS_DATA_KEY = 'entry/data/data'
+
+
+def _timestamps(num, rate, rng):
+    '''
+    seconds and nanoseconds columns for num samples at about rate Hz
+    '''
+    ns = START_TIME * 10**9 + np.cumsum(rng.integers(int(0.9e9 / rate), int(1.1e9 / rate), num))
+    return ns // 10**9, ns % 10**9
+
+
+def write_pizzabox_enc(fpath, num_lines, seed=0):
+    '''
+    times timens encoder counter di, the encoder follows an oscillating
+    trajectory in the raw 24-bit format of the pizza box
+    '''
+    rng = np.random.default_rng(seed)
+    sec, nsec = _timestamps(num_lines, 10_000, rng)
+    position = (-200_000 + 150_000 * np.sin(np.linspace(0, 4 * np.pi, num_lines))).astype(np.int64)
+    encoder = np.where(position <= 0, -position ^ (0xffffff - 1), position)
+    data = np.column_stack([sec, nsec, encoder, np.arange(num_lines), np.zeros(num_lines, dtype=np.int64)])
+    np.savetxt(fpath, data, fmt='%d', delimiter=' ')
+
+
+def write_pizzabox_adc(fpath, num_lines, num_columns=2, seed=0):
+    '''
+    sec ns index 0xHEX..., the 18-bit ADC readings are shifted by 8 bits
+    '''
+    rng = np.random.default_rng(seed)
+    sec, nsec = _timestamps(num_lines, 10_000, rng)
+    adc = rng.integers(-0x20000, 0x20000, (num_lines, num_columns)) & 0x3FFFF
+    with open(fpath, 'w') as f:
+        for i in range(num_lines):
+            hex_columns = ' '.join(f'0x{value << 8:08x}' for value in adc[i])
+            f.write(f'{sec[i]} {nsec[i]} {i} {hex_columns}\t\n')
+
+
+def write_pizzabox_di(fpath, num_lines, seed=0):
+    '''
+    ts_s ts_ns encoder index di
+    '''
+    rng = np.random.default_rng(seed)
+    sec, nsec = _timestamps(num_lines, 1_000, rng)
+    data = np.column_stack([sec, nsec, rng.integers(0, 2**24, num_lines), np.arange(num_lines),
+                            np.arange(num_lines) % 2])
+    np.savetxt(fpath, data, fmt='%d', delimiter=' ')
+
+
+def _apb_timestamps(num, rate):
+    ticks = np.rint(np.arange(num) / rate / APB_TICK).astype(np.int64)
+    ticks_per_second = int(1 / APB_TICK)
+    return START_TIME + ticks // ticks_per_second, ticks % ticks_per_second
+
+
+def write_apb(fpath, num_records, fa_rate=100_000, seed=0):
+    '''
+    APB stream: records of 8 int32 channels, seconds and ticks in the .bin
+    file, with the gains/offsets settings in the .txt file next to it
+    '''
+    rng = np.random.default_rng(seed)
+    data = np.empty((num_records, 10), dtype=np.int32)
+    data[:, :8] = rng.integers(-2**20, 2**20, (num_records, 8))
+    data[:, 8], data[:, 9] = _apb_timestamps(num_records, fa_rate)
+    data.tofile(fpath)
+
+    with open(f'{os.path.splitext(fpath)[0]}.txt', 'w') as f:
+        f.write('Version: 1\n')
+        f.write(f"Gains: {','.join(str(g) for g in range(1, 9))}\n")
+        f.write(f"Offsets: {','.join(str(10 * o) for o in range(1, 9))}\n")
+        f.write('FAdiv: 1.0\n')
+        f.write(f'FArate: {float(fa_rate)}\n')
+        f.write(f'Trigger timestamp: {START_TIME},0\n')
+
+
+def write_apb_trigger(fpath, num_records, rate=1_000):
+    '''
+    APB trigger: records of transition, seconds and ticks (int32)
+    '''
+    data = np.empty((num_records, 3), dtype=np.int32)
+    data[:, 0] = np.arange(num_records) % 2
+    data[:, 1], data[:, 2] = _apb_timestamps(num_records, rate)
+    data.tofile(fpath)
+
+
+def write_xspress3(fpath, num_frames, num_channels=6, num_bins=4096, seed=0):
+    '''
+    Xspress3 file with the spectra and the CHAN<c>ROI<r> attributes
+    '''
+    rng = np.random.default_rng(seed)
+    with h5py.File(fpath, 'w') as f:
+        dataset = f.create_dataset(XS3_DATA_KEY, shape=(num_frames, num_channels, num_bins), dtype='<u4',
+                                   chunks=(1, num_channels, num_bins))
+        for start in range(0, num_frames, 100):
+            stop = min(start + 100, num_frames)
+            dataset[start:stop] = rng.poisson(2, (stop - start, num_channels, num_bins))
+        for c in range(1, 7):
+            for r in range(1, 5):
+                f[f'{XS3_ROI_KEY}/CHAN{c}ROI{r}'] = rng.random(num_frames) * 1e4
+
+
+def write_pilatus(fpath, num_frames, frame_shape=(1043, 981), seed=0):
+    '''
+    Pilatus file as written by the HDF5 plugin in SWMR mode
+    '''
+    rng = np.random.default_rng(seed)
+    with h5py.File(fpath, 'w', libver='latest') as f:
+        dataset = f.create_dataset(PILATUS_DATA_KEY, shape=(num_frames,) + frame_shape, dtype='<u2',
+                                   maxshape=(None,) + frame_shape, chunks=(1,) + frame_shape)
+        frame = rng.poisson(5, frame_shape).astype(np.uint16)
+        for i in range(num_frames):
+            dataset[i] = frame + i
+
+
+def make_data(directory, size='small'):
+    '''
+    Write one file of each kind to directory, returns {name: path}
+    '''
+    sizes = SIZES[size]
+    os.makedirs(directory, exist_ok=True)
+    paths = {name: os.path.join(directory, filename) for name, filename in [
+        ('enc', 'pb_enc.txt'), ('adc', 'pb_adc.txt'), ('di', 'pb_di.txt'), ('apb', 'apb.bin'),
+        ('trigger', 'apb_trigger.bin'), ('xs', 'xspress3.h5'), ('pilatus', 'pilatus.h5')]}
+
+    write_pizzabox_enc(paths['enc'], sizes['enc'])
+    write_pizzabox_adc(paths['adc'], sizes['adc'])
+    write_pizzabox_di(paths['di'], sizes['di'])
+    write_apb(paths['apb'], sizes['apb'])
+    write_apb_trigger(paths['trigger'], sizes['trigger'])
+    write_xspress3(paths['xs'], sizes['xs_frames'])
+    write_pilatus(paths['pilatus'], sizes['pilatus_frames'])
+    return paths
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Write synthetic QAS data files')
+    parser.add_argument('directory')
+    parser.add_argument('--size', choices=list(SIZES), default='small')
+    args = parser.parse_args()
+    for name, path in make_data(args.directory, args.size).items():
+        print(f'{name:8s} {path}')
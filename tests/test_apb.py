@@ -0,0 +1,142 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('databroker')
+import qas_handlers
+from baseline import apb_volts_dataframe
+from synthetic_data import write_apb, write_apb_trigger
+
+
+@pytest.fixture
+def apb_file(tmp_path, monkeypatch):
+    fpath = str(tmp_path / 'data' / 'apb.bin')
+    (tmp_path / 'data').mkdir()
+    write_apb(fpath, 100_000)
+    monkeypatch.setattr(qas_handlers.APBBinFileHandler, 'pyramid_cache_dir', str(tmp_path / 'cache'))
+    yield fpath
+    qas_handlers.file_handle_pool.clear()
+
+
+@pytest.mark.parametrize('max_points', [500, 777, 2000, 100_000])
+def test_decimated(apb_file, max_points):
+    handler = qas_handlers.APBBinFileHandler(apb_file)
+    raw = handler.raw_data[:, :8]
+    df = handler.decimated(max_points=max_points)
+    assert len(df) <= max_points
+    assert df['it_min'].min() == raw[:, 1].min() and df['it_max'].max() == raw[:, 1].max()
+    # the bins start at the timestamps, the mean of all the samples is the weighted mean of the bins
+    starts = np.searchsorted(handler.data['timestamp'], df['timestamp'])
+    weights = np.diff(np.append(starts, len(raw)))
+    assert np.average(df['it_mean'], weights=weights) == pytest.approx(raw[:, 1].mean())
+
+
+def test_pyramid_cache(apb_file, tmp_path):
+    handler = qas_handlers.APBBinFileHandler(apb_file)
+    handler.decimated(max_points=500)
+    # nothing is written next to the raw data
+    assert sorted(p.name for p in (tmp_path / 'data').iterdir()) == ['apb.bin', 'apb.txt']
+    assert [p.name for p in (tmp_path / 'cache').iterdir()] == [handler.pyramid_path.split('/')[-1]]
+
+
+def test_growing_file(apb_file):
+    handler = qas_handlers.APBBinFileHandler(apb_file, lazy=True)
+    assert len(handler()) == 100_000
+    records = np.zeros((10, 10), dtype=np.int32)
+    with open(apb_file, 'ab') as f:
+        records.tofile(f)
+    # the pooled memory map of the old size is not used anymore
+    assert len(handler()) == 100_010
+
+
+@pytest.mark.parametrize('search_step', [4096, 7])
+@pytest.mark.parametrize('ns_timestamps', [False, True])
+def test_time_slice(apb_file, monkeypatch, ns_timestamps, search_step):
+    monkeypatch.setattr(qas_handlers.APBStreamData, 'search_step', search_step)
+    handler = qas_handlers.APBBinFileHandler(apb_file, lazy=True, ns_timestamps=ns_timestamps)
+    data = handler()
+    timestamps = np.asarray(data['timestamp'])
+    first, last = timestamps[0], timestamps[-1]
+    small = 1000 if ns_timestamps else 1e-6  # less than the 10 us between the records
+    windows = [
+        (None, None),
+        (first - 10 * small, first - small),  # before the first record
+        (None, first - small),
+        (last + small, last + 10 * small),  # after the last record
+        (last + small, None),
+        (first - small, first),  # the exact boundaries are included
+        (last, last + small),
+        (timestamps[5000], timestamps[5100]),
+        (timestamps[5000] + small, timestamps[5001] - small),  # between two records
+        (timestamps[5100], timestamps[5000]),
+    ]
+    for t_start, t_stop in windows:
+        inside = np.ones(len(timestamps), dtype=bool)
+        if t_start is not None:
+            inside &= timestamps >= t_start
+        if t_stop is not None:
+            inside &= timestamps <= t_stop
+        sliced = data.time_slice(t_start, t_stop)
+        np.testing.assert_array_equal(sliced.records, data.records[inside])
+        np.testing.assert_array_equal(sliced['timestamp'], timestamps[inside])
+    np.testing.assert_array_equal(handler(timestamps[5000], timestamps[5100]).records, data.records[5000:5101])
+
+    # the same positions as np.searchsorted over all the timestamps
+    probes = np.concatenate([timestamps[::997], timestamps[::991] + small, [first - small, last + small]])
+    for side in ('left', 'right'):
+        assert [data.search_timestamp(t, side=side) for t in probes] == \
+            list(np.searchsorted(timestamps, probes, side=side))
+
+
+def test_volts(apb_file):
+    expected = apb_volts_dataframe(apb_file)
+    channels = qas_handlers.APBStreamData.columns[1:]
+    settings = qas_handlers.read_apb_settings(apb_file.replace('.bin', '.txt'))
+    assert list(settings.gains) == list(range(1, 9)) and list(settings.offsets) == list(range(10, 90, 10))
+
+    df = qas_handlers.APBBinFileHandler(apb_file, volts=True)()
+    pd.testing.assert_frame_equal(df[channels], expected[channels], check_exact=True)
+    np.testing.assert_allclose(df['timestamp'], expected['timestamp'], rtol=0, atol=1e-6)
+
+    data = qas_handlers.APBBinFileHandler(apb_file, lazy=True, volts=True)()
+    np.testing.assert_array_equal(data.volts(), expected[channels].to_numpy())
+    for channel in channels:
+        np.testing.assert_array_equal(data[channel], expected[channel])
+    window = data.time_slice(data.timestamp_at(100), data.timestamp_at(199))
+    np.testing.assert_array_equal(window.volts(), expected[channels].to_numpy()[100:200])
+
+
+def test_ns_timestamps():
+    # int32 columns like the mapped records, up to the largest tick and second counts
+    rng = np.random.default_rng(3)
+    ticks = np.concatenate([rng.integers(0, 2**31, 10_000), np.arange(2**31 - 1000, 2**31)]).astype(np.int32)
+    seconds = np.full(len(ticks), 2**31 - 1, dtype=np.int32)
+    ns = qas_handlers.apb_timestamp(seconds, ticks, ns_timestamps=True)
+    assert ns.dtype == np.int64
+    expected = [int((Decimal(int(t)) * Decimal('8.0051232')).to_integral_value(ROUND_HALF_UP)) for t in ticks]
+    np.testing.assert_array_equal(ns - (2**31 - 1) * 10**9, expected)
+    # the ticks of one second are exact in float64
+    one_second = ticks[ticks < 124_920_049]
+    np.testing.assert_array_equal(qas_handlers.apb_timestamp(0, one_second, ns_timestamps=True),
+                                  np.rint(one_second * 8.0051232).astype(np.int64))
+
+
+def test_trigger_handler(tmp_path):
+    fpath = str(tmp_path / 'trigger.bin')
+    write_apb_trigger(fpath, 1000)
+    raw = np.fromfile(fpath, dtype=np.int32).reshape(-1, 3)
+    handler = qas_handlers.APBTriggerFileHandler(fpath)
+    df = handler()
+    assert list(df.columns) == ['timestamp', 'transition']
+    np.testing.assert_array_equal(df['transition'], raw[:, 0])
+    np.testing.assert_array_equal(df['timestamp'], qas_handlers.apb_timestamp(raw[:, 1], raw[:, 2]))
+    window = qas_handlers.APBTriggerFileHandler(fpath, lazy=True)(df['timestamp'][10], df['timestamp'][19])
+    np.testing.assert_array_equal(window['transition'], raw[10:20, 0])
+    # the trigger records have no channels to convert or decimate
+    for name in ('volts', 'settings', 'pyramid', 'decimated'):
+        assert not hasattr(handler, name) and not hasattr(window, name)
+    with pytest.raises(TypeError):
+        qas_handlers.APBTriggerFileHandler(fpath, volts=True)
+    qas_handlers.file_handle_pool.clear()
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from baseline import bin_samples
+from qas_processing.binning import bin_index, bin_stream, encoder_to_energy
+from qas_processing.plans import BinningPlan
+
+
+def bincount_reference(timestamps, signals, encoder_timestamps, energy, edges):
+    index = bin_index(timestamps, encoder_timestamps, energy, edges)
+    inside = index >= 0
+    counts = np.bincount(index[inside], minlength=len(edges) - 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = {name: np.bincount(index[inside], weights=signal[inside], minlength=len(edges) - 1) / counts
+                 for name, signal in signals.items()}
+    return counts, means
+
+
+@pytest.mark.parametrize('decreasing', [False, True])
+def test_bin_stream_trailing_empty_bins(decreasing):
+    rng = np.random.default_rng(0)
+    encoder_timestamps = np.linspace(0, 10, 1001)
+    energy = np.linspace(7000, 7100, 1001)
+    if decreasing:
+        energy = energy[::-1]
+    timestamps = np.sort(rng.uniform(-1, 11, 20000))
+    signals = {'i0': rng.integers(0, 1000, len(timestamps)), 'it': rng.normal(size=len(timestamps))}
+    # the last bins are above the end of the sweep, the first ones below its start
+    edges = np.linspace(6990, 7130, 71)
+
+    counts, means = bin_stream(timestamps, signals, encoder_timestamps, energy, edges)
+    expected_counts, expected_means = bincount_reference(timestamps, signals, encoder_timestamps, energy, edges)
+    assert (counts[-5:] == 0).all() and (counts[:5] == 0).all()
+    np.testing.assert_array_equal(counts, expected_counts)
+    for name in signals:
+        np.testing.assert_allclose(means[name], expected_means[name], equal_nan=True)
+
+
+@pytest.mark.parametrize('decreasing', [False, True])
+def test_plan_matches_the_energy_binning(decreasing):
+    # the plan bins on the encoder counts of the edges, like binning the energy of every sample
+    rng = np.random.default_rng(1)
+    pulses_per_deg, angle_offset = 100_000, 10
+    encoder_timestamps = np.arange(2000) * 100_000
+    encoder = np.linspace(-340_000, -60_000, 2000).astype(np.int64)
+    if decreasing:
+        encoder = encoder[::-1]
+    timestamps = np.sort(rng.integers(-10**6, 2000 * 100_000 + 10**6, 50_000))
+    signals = {'i0': rng.integers(-2**20, 2**20, len(timestamps))}
+    plan = BinningPlan.from_encoder(encoder, 9000., pulses_per_deg, angle_offset)
+
+    counts, means = plan.bin(timestamps, signals, encoder_timestamps, encoder)
+    expected_counts, expected_means = bin_samples(
+        timestamps, signals, encoder_timestamps, encoder, plan.edges,
+        to_energy=lambda position: encoder_to_energy(position, pulses_per_deg, angle_offset))
+    assert expected_counts.sum() > 0.9 * len(timestamps)
+    np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_allclose(means['i0'], expected_means['i0'], equal_nan=True)
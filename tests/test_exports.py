@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+import qas_handlers
+from synthetic_data import write_apb
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def run_python(code, *args):
+    # a fresh interpreter, which has imported nothing yet
+    result = subprocess.run([sys.executable, '-c', textwrap.dedent(code), *args], cwd=REPO_DIR,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split()
+
+
+class Registry:
+    def __init__(self):
+        self.handlers = {}
+
+    def register_handler(self, spec, handler, overwrite=False):
+        if spec in self.handlers and not overwrite:
+            raise KeyError(spec)
+        self.handlers[spec] = handler
+
+
+def test_import_is_cheap():
+    imported = run_python('''
+        import sys
+        import qas_handlers
+        qas_handlers.register_handlers(type('Registry', (), {'register_handler': lambda *args, **kwargs: None})())
+        print(*[name for name in ('h5py', 'pandas', 'databroker', 'qas_handlers.apb') if name in sys.modules])
+    ''')
+    assert imported == []
+
+
+def test_register_handlers():
+    reg = Registry()
+    qas_handlers.register_handlers(reg)
+    assert set(reg.handlers) == set(qas_handlers.handler_specs)
+    for spec, handler in reg.handlers.items():
+        # the registry keys its handler cache on the name of the class
+        assert handler.__name__ == qas_handlers.handler_specs[spec]
+    with pytest.raises(KeyError):
+        qas_handlers.register_handlers(reg, overwrite=False)
+
+
+def test_register_the_classes():
+    pytest.importorskip('databroker')
+    reg = Registry()
+    qas_handlers.register_handlers(reg, lazy=False)
+    assert reg.handlers == {spec: getattr(qas_handlers, name) for spec, name in qas_handlers.handler_specs.items()}
+
+
+def test_lazy_handler(tmp_path):
+    pytest.importorskip('databroker')
+    fpath = str(tmp_path / 'apb.bin')
+    write_apb(fpath, 1000)
+    modules = run_python('''
+        import sys
+        import qas_handlers
+        make_handler = qas_handlers.lazy_handler('APBBinFileHandler')
+        print('qas_handlers.apb' in sys.modules)
+        handler = make_handler(sys.argv[1], lazy=True)
+        print('qas_handlers.apb' in sys.modules, type(handler) is qas_handlers.APBBinFileHandler)
+    ''', fpath)
+    assert modules == ['False', 'True', 'True']
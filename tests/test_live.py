@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('databroker')
+import qas_handlers
+from baseline import bin_samples
+from qas_processing import BinningPlan, LiveBinner, encoder_to_energy
+from synthetic_data import write_apb, write_pizzabox_enc
+
+PULSES_PER_DEG, ANGLE_OFFSET = 100_000, 10
+
+
+def test_live_binner(tmp_path):
+    # an oscillating trajectory, the APB and encoder samples come in pieces of different sizes
+    write_pizzabox_enc(str(tmp_path / 'enc.txt'), 20_000)
+    write_apb(str(tmp_path / 'apb.bin'), 100_000, fa_rate=50_000)
+    encoder_df = qas_handlers.PizzaBoxEncHandlerTxt(str(tmp_path / 'enc.txt'), unwrap=True, ns_timestamps=True)(0)
+    encoder_timestamps, encoder = encoder_df['timestamp'].to_numpy(), encoder_df['encoder'].to_numpy()
+    records = np.fromfile(tmp_path / 'apb.bin', dtype=qas_handlers.APBBinFileHandler.record_dtype)
+    plan = BinningPlan.from_encoder(encoder, 9000., PULSES_PER_DEG, ANGLE_OFFSET)
+
+    binner = LiveBinner(plan, channels=['i0', 'it'])
+    apb_pieces = np.array_split(records, 37)
+    encoder_pieces = np.array_split(np.arange(len(encoder)), 23)
+    for i in range(max(len(apb_pieces), len(encoder_pieces))):
+        index = encoder_pieces[i] if i < len(encoder_pieces) else np.zeros(0, dtype=np.int64)
+        binner.add(apb_pieces[i] if i < len(apb_pieces) else records[:0], encoder_timestamps[index], encoder[index])
+    spectrum = binner.spectrum()
+
+    timestamps = qas_handlers.apb_timestamp(records['ts_s'], records['ts_ticks'], ns_timestamps=True)
+    counts, means = bin_samples(timestamps, {'i0': records['i0'], 'it': records['it']}, encoder_timestamps, encoder,
+                                plan.edges,
+                                to_energy=lambda position: encoder_to_energy(position, PULSES_PER_DEG, ANGLE_OFFSET))
+    np.testing.assert_array_equal(spectrum['counts'], counts)
+    for channel in ('i0', 'it'):
+        np.testing.assert_allclose(spectrum[channel], means[channel], equal_nan=True)
+    assert binner.num_samples == np.searchsorted(timestamps, encoder_timestamps[-1], side='right')
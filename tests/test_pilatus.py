@@ -0,0 +1,202 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip('databroker')
+pytest.importorskip('dask')
+import qas_handlers
+from startup_files import load_startup
+from synthetic_data import PILATUS_DATA_KEY, write_pilatus
+
+
+@pytest.fixture
+def pilatus_file(tmp_path):
+    fpath = str(tmp_path / 'pilatus.h5')
+    write_pilatus(fpath, 6, frame_shape=(20, 12))
+    with h5py.File(fpath, 'r') as f:
+        frames = f[PILATUS_DATA_KEY][()]
+    yield fpath, frames
+    qas_handlers.file_handle_pool.clear()
+
+
+@pytest.mark.parametrize('use', [lambda handler: handler(0), lambda handler: handler.refresh(),
+                                 lambda handler: handler.new_frames(), lambda handler: handler.roi_sums({})],
+                         ids=['call', 'refresh', 'new_frames', 'roi_sums'])
+def test_dask_array_after_the_handler(pilatus_file, use):
+    # the lazy array reads through the dataset the handler has opened (and refreshed)
+    fpath, frames = pilatus_file
+    handler = qas_handlers.QASAreaDetectorHDF5SWMRHandler(fpath)
+    use(handler)
+    array = handler.dask_array()
+    assert array.shape == frames.shape
+    np.testing.assert_array_equal(array[:, 3:10, 2:5].sum(axis=(1, 2)).compute(),
+                                  frames[:, 3:10, 2:5].sum(axis=(1, 2)))
+    # and the handler still reads after the lazy array
+    handler.refresh()
+    np.testing.assert_array_equal(np.asarray(handler(5)[0]), frames[5])
+
+
+ROIS = {
+    'roi1': {'x': 2, 'y': 3, 'dx': 5, 'dy': 7},
+    'roi2': (8, 15, 10, 10),  # clipped at the right and bottom edges
+    'roi3': {'x': -3, 'y': -2, 'dx': 6, 'dy': 5},  # clipped at the top left corner
+    'roi4': (4, 4, 0, 3),  # empty
+    'roi5': (30, 2, 4, 4),  # outside of the image
+}
+
+
+def numpy_roi_sums(frames, rois):
+    # the pixels of every ROI picked with a mask over the whole frames
+    rows, cols = np.arange(frames.shape[1])[:, None], np.arange(frames.shape[2])
+    sums = {}
+    for name, roi in rois.items():
+        x, y, dx, dy = (roi['x'], roi['y'], roi['dx'], roi['dy']) if isinstance(roi, dict) else roi
+        mask = (rows >= y) & (rows < y + dy) & (cols >= x) & (cols < x + dx)
+        sums[name] = (frames.astype(np.int64) * mask).sum(axis=(1, 2))
+    return sums
+
+
+def check_roi_sums(sums, frames):
+    expected = numpy_roi_sums(frames, ROIS)
+    assert set(sums) == set(expected)
+    for name in ROIS:
+        assert sums[name].dtype == np.int64
+        np.testing.assert_array_equal(sums[name], expected[name])
+    assert not sums['roi4'].any() and not sums['roi5'].any()
+
+
+@pytest.mark.parametrize('max_block_bytes', [1, 2 * 20 * 12 * 2, 2**26])
+def test_roi_sums(pilatus_file, max_block_bytes):
+    fpath, frames = pilatus_file
+    with h5py.File(fpath, 'r', swmr=True) as f:
+        check_roi_sums(qas_handlers.pilatus_roi_sums(f[PILATUS_DATA_KEY], ROIS, max_block_bytes=max_block_bytes),
+                       frames)
+    handler = qas_handlers.QASAreaDetectorHDF5SWMRHandler(fpath)
+    check_roi_sums(handler.roi_sums(ROIS, max_block_bytes=max_block_bytes), frames)
+
+
+class Header:
+    def __init__(self, datum_id):
+        self.datum_id = datum_id
+
+    def documents(self, fill=False):
+        yield 'start', {'uid': 'run'}
+        yield 'event', {'data': {'apb_ave_ch1': 0.5}}
+        yield 'event', {'data': {'pilatus_image': self.datum_id}}
+
+
+class Broker:
+    def __init__(self, resources):
+        self.resources = resources
+        self.reg = self
+
+    def __getitem__(self, uid):
+        return Header(f'{uid}/0')
+
+    def resource_given_datum_id(self, datum_id):
+        return self.resources[datum_id]
+
+
+def test_recompute_pilatus_rois(pilatus_file):
+    fpath, frames = pilatus_file
+    db = Broker({'run/0': {'root': os.path.dirname(fpath), 'resource_path': os.path.basename(fpath)}})
+    namespace = load_startup('82-pilatus.py', ['recompute_pilatus_rois'], {'os': os, 'db': db}, imports=False)
+    check_roi_sums(namespace['recompute_pilatus_rois']('run', ROIS), frames)
+    with pytest.raises(KeyError):
+        namespace['recompute_pilatus_rois']('run', ROIS, data_key='pilatus_stream_image')
+
+
+writer = textwrap.dedent('''
+    import sys
+    import h5py
+    import numpy as np
+    with h5py.File(sys.argv[1], 'w', libver='latest') as f:
+        frames = f.create_dataset({data_key!r}, shape=(0, 8, 6), maxshape=(None, 8, 6), dtype='<u2',
+                                  chunks=(1, 8, 6))
+        f.swmr_mode = True
+        for line in sys.stdin:
+            num_frames = frames.shape[0] + int(line)
+            frames.resize(num_frames, axis=0)
+            frames[num_frames - int(line):] = np.arange(num_frames - int(line), num_frames)[:, None, None]
+            frames.flush()
+            print(num_frames, flush=True)
+''').format(data_key=PILATUS_DATA_KEY)
+
+
+def test_new_frames(tmp_path):
+    fpath = str(tmp_path / 'pilatus_swmr.h5')
+    process = subprocess.Popen([sys.executable, '-c', writer, fpath], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, text=True)
+
+    def write(num_frames):
+        process.stdin.write(f'{num_frames}\n')
+        process.stdin.flush()
+        return int(process.stdout.readline())
+
+    def check_frames(frames, first, stop):
+        assert frames.shape == (stop - first, 8, 6)
+        np.testing.assert_array_equal(frames[:, 0, 0], np.arange(first, stop))
+
+    try:
+        write(3)
+        handler = qas_handlers.QASAreaDetectorHDF5SWMRHandler(fpath)
+        check_frames(handler.new_frames(), 0, 3)
+        # nothing new was written
+        check_frames(handler.new_frames(), 3, 3)
+        write(4)
+        check_frames(handler.new_frames(), 3, 7)
+        check_frames(handler.new_frames(), 7, 7)
+        # the frames read by the calls are not returned again
+        np.testing.assert_array_equal(np.asarray(handler(6)[0]), np.full((8, 6), 6))
+        write(1)
+        write(2)
+        check_frames(handler.new_frames(), 7, 10)
+        assert handler.num_frames == 10
+    finally:
+        process.stdin.close()
+        process.wait(10)
+        qas_handlers.file_handle_pool.clear()
+
+
+def test_unavailable_filter(tmp_path):
+    # a filter which no plugin provides, like Blosc without hdf5plugin
+    fpath = str(tmp_path / 'pilatus_filter.h5')
+    with h5py.File(fpath, 'w', libver='latest') as f:
+        f.create_dataset(PILATUS_DATA_KEY, data=np.ones((3, 8, 6), dtype='<u2'), chunks=(1, 8, 6),
+                         compression=47999, allow_unknown_filter=True)
+    try:
+        with pytest.raises(OSError, match='HDF5 filter 47999, which is not available'):
+            qas_handlers.QASAreaDetectorHDF5SWMRHandler(fpath).new_frames()
+        with h5py.File(fpath, 'r') as f:
+            with pytest.raises(OSError, match='install hdf5plugin'):
+                qas_handlers.check_hdf5_filters(f[PILATUS_DATA_KEY])
+    finally:
+        qas_handlers.file_handle_pool.clear()
+
+
+@pytest.mark.parametrize('mode', ['blosc-lz4', 'blosc-zstd', 'bslz4'])
+def test_compressed_frames(tmp_path, mode):
+    # the frames as the HDF5 plugin writes them with the modes of pilatus_hdf5_compression
+    hdf5plugin = pytest.importorskip('hdf5plugin')
+    compression = {
+        'blosc-lz4': hdf5plugin.Blosc(cname='lz4', clevel=5, shuffle=hdf5plugin.Blosc.BITSHUFFLE),
+        'blosc-zstd': hdf5plugin.Blosc(cname='zstd', clevel=3, shuffle=hdf5plugin.Blosc.BITSHUFFLE),
+        'bslz4': hdf5plugin.Bitshuffle(),
+    }[mode]
+    frames = np.random.default_rng(2).poisson(5, (7, 20, 12)).astype(np.uint16)
+    fpath = str(tmp_path / 'pilatus_compressed.h5')
+    with h5py.File(fpath, 'w', libver='latest') as f:
+        f.create_dataset(PILATUS_DATA_KEY, data=frames, maxshape=(None, 20, 12), chunks=(1, 20, 12),
+                         **compression)
+    try:
+        handler = qas_handlers.QASAreaDetectorHDF5SWMRHandler(fpath)
+        np.testing.assert_array_equal(handler.new_frames(), frames)
+        np.testing.assert_array_equal(np.asarray(handler(4)[0]), frames[4])
+        np.testing.assert_array_equal(handler.dask_array().compute(), frames)
+    finally:
+        qas_handlers.file_handle_pool.clear()
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('databroker')
+import qas_handlers
+from qas_handlers import pizzabox
+from synthetic_data import write_pizzabox_adc, write_pizzabox_di, write_pizzabox_enc
+
+
+def baseline_an(fpath):
+    # the ADC columns and timestamps as PizzaBoxAnHandlerTxt computed them with the adc2counts lambda
+    data = pd.read_csv(fpath, delimiter=' ', header=None)
+    volts = [data[j].apply(pizzabox.adc2counts).to_numpy() for j in data.columns[3:]]
+    return (data[0] + 1e-9 * data[1]).to_numpy(), volts
+
+
+def check_an_handler(fpath):
+    timestamp, volts = baseline_an(fpath)
+    handler = qas_handlers.PizzaBoxAnHandlerTxt(fpath)
+    assert handler.ncols == len(volts)
+    for column in range(handler.ncols):
+        df = handler(0, column=column)
+        np.testing.assert_array_equal(df['timestamp'].to_numpy(), timestamp)
+        np.testing.assert_array_equal(df['adc'].to_numpy(), volts[column])
+
+
+@pytest.mark.parametrize('num_columns', [1, 2, 8])
+def test_an_handler(tmp_path, num_columns):
+    fpath = str(tmp_path / 'an.txt')
+    write_pizzabox_adc(fpath, 3000, num_columns=num_columns)
+    check_an_handler(fpath)
+
+
+@pytest.mark.parametrize('edit', [
+    lambda text: text.replace('\t\n', '\n'),
+    lambda text: text.replace('\n', '\r\n'),
+    lambda text: text.replace('0x', '0X').upper(),
+    lambda text: text[:-1],
+    lambda text: text.replace('\n', '\n\n', 5),
+    lambda text: text.replace(' 0x0', ' 0x', 7),
+    lambda text: '99 ' + text.split(' ', 1)[1],
+    lambda text: text.replace(' 1', ' 000000001', 3),
+])
+def test_an_handler_layouts(tmp_path, edit):
+    # the same values as the lambda with other separators, letter cases and widths
+    fpath = str(tmp_path / 'an.txt')
+    write_pizzabox_adc(fpath, 2000, num_columns=3)
+    with open(fpath) as f:
+        text = edit(f.read())
+    with open(fpath, 'w') as f:
+        f.write(text)
+    check_an_handler(fpath)
+
+
+def write_enc_through_zero(fpath, num_lines=2000):
+    # the raw counter of the pizza box rolls over when the position crosses 0
+    position = np.linspace(-5000, 5000, num_lines).astype(np.int64)
+    encoder = np.where(position <= 0, -position ^ (0xffffff - 1), position)
+    lines = [f'{1600000000 + i // 1000} {(i % 1000) * 10**6} {value} {i} 0' for i, value in enumerate(encoder)]
+    with open(fpath, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return position
+
+
+@pytest.mark.parametrize('write', [write_pizzabox_enc, write_enc_through_zero])
+def test_enc_handler(tmp_path, write):
+    fpath = str(tmp_path / 'enc.txt')
+    if write is write_pizzabox_enc:
+        write(fpath, 2000)
+    else:
+        write(fpath)
+    data = pd.read_csv(fpath, delimiter=' ', header=None)
+    df = qas_handlers.PizzaBoxEncHandlerTxt(fpath)(0)
+    # the values of the lambda by default
+    np.testing.assert_array_equal(df['encoder'].to_numpy(), data[2].apply(pizzabox.enc2counts).to_numpy())
+    np.testing.assert_array_equal(df['timestamp'].to_numpy(), (data[0] + 1e-9 * data[1]).to_numpy())
+    np.testing.assert_array_equal(df['counter'].to_numpy(), data[3].to_numpy())
+    unwrapped = qas_handlers.PizzaBoxEncHandlerTxt(fpath, unwrap=True)(0)['encoder'].to_numpy()
+    assert np.abs(np.diff(unwrapped)).max() < 2**20
+
+
+def test_read_new_txt_fields(tmp_path):
+    fpath = str(tmp_path / 'enc.txt')
+    write_enc_through_zero(str(tmp_path / 'full.txt'))
+    with open(tmp_path / 'full.txt', 'rb') as f:
+        text = f.read()
+    expected = qas_handlers.PizzaBoxEncHandlerTxt(str(tmp_path / 'full.txt'), unwrap=True,
+                                                  ns_timestamps=True)(0)
+
+    # the file grows by pieces which end in the middle of the lines
+    offset, last, timestamps, counts = 0, None, [], []
+    with open(fpath, 'wb') as f:
+        for size in list(range(0, len(text), 7777)) + [len(text)]:
+            f.write(text[f.tell():size])
+            f.flush()
+            buf, starts, ends, offset = qas_handlers.read_new_txt_fields(fpath, offset)
+            assert offset == text.rfind(b'\n', 0, size) + 1
+            if starts.size == 0:
+                continue
+            timestamps.append(qas_handlers.txt_timestamp(qas_handlers.parse_txt_field(buf, starts[:, 0], ends[:, 0]),
+                                                         qas_handlers.parse_txt_field(buf, starts[:, 1], ends[:, 1]),
+                                                         ns_timestamps=True))
+            counts.append(qas_handlers.enc2counts_array(qas_handlers.parse_txt_field(buf, starts[:, 2], ends[:, 2]),
+                                                        unwrap=True, previous=last))
+            last = counts[-1][-1]
+    np.testing.assert_array_equal(np.concatenate(timestamps), expected['timestamp'].to_numpy())
+    np.testing.assert_array_equal(np.concatenate(counts), expected['encoder'].to_numpy())
+    assert qas_handlers.read_new_txt_fields(str(tmp_path / 'missing.txt'))[3] == 0
+
+
+def test_parse_txt_field(tmp_path):
+    rng = np.random.default_rng(1)
+    decimal = rng.integers(-10**15, 10**15, 5000) // 10**rng.integers(0, 16, 5000)
+    hexadecimal = rng.integers(0, 2**32, 5000) >> rng.integers(0, 32, 5000)
+    lines = [f'{d} {h:#x} {h:x}\t' for d, h in zip(decimal, hexadecimal)]
+    buf = np.frombuffer('\n'.join(lines).encode(), dtype=np.uint8)
+    starts, ends = qas_handlers.split_txt_fields(buf)
+    np.testing.assert_array_equal(qas_handlers.parse_txt_field(buf, starts[:, 0], ends[:, 0]), decimal)
+    for column in (1, 2):
+        np.testing.assert_array_equal(qas_handlers.parse_txt_field(buf, starts[:, column], ends[:, column], base=16),
+                                      hexadecimal)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 64, 1000, 5000])
+def test_di_handler(tmp_path, chunk_size):
+    # the chunks of the rows as PizzaBoxDIHandlerTxt made them from the lines
+    fpath = str(tmp_path / 'di.txt')
+    write_pizzabox_di(fpath, 1000)
+    with open(fpath) as f:
+        lines = list(f)
+    handler = qas_handlers.PizzaBoxDIHandlerTxt(fpath, chunk_size=chunk_size)
+    for chunk_num in range(-(-len(lines) // chunk_size) + 1):
+        rows = [tuple(int(v) for v in line.split()) for line in lines[chunk_num*chunk_size:(chunk_num+1)*chunk_size]]
+        chunk = handler(chunk_num)
+        assert [tuple(row) for row in chunk.tolist()] == rows
+        if rows:
+            assert chunk[0].di == rows[0][4] and chunk.ts_s[-1] == rows[-1][0]
+
+
+def test_di_handler_blank_lines(tmp_path):
+    # the chunks have to stay aligned with the lines of the file
+    fpath = str(tmp_path / 'di.txt')
+    write_pizzabox_di(fpath, 100)
+    with open(fpath) as f:
+        lines = f.readlines()
+    handler = qas_handlers.PizzaBoxDIHandlerTxt(fpath, chunk_size=30)
+    np.testing.assert_array_equal(handler(1).ts_ns, [int(line.split()[1]) for line in lines[30:60]])
+    with open(fpath, 'w') as f:
+        f.writelines(lines[:40] + ['\n'] + lines[40:])
+    with pytest.raises(ValueError):
+        qas_handlers.PizzaBoxDIHandlerTxt(fpath, chunk_size=30)(1)
+
+
+def test_transcoder(tmp_path, caplog):
+    paths = {'enc': str(tmp_path / 'enc.txt'), 'an': str(tmp_path / 'an.txt'), 'di': str(tmp_path / 'di.txt')}
+    write_pizzabox_enc(paths['enc'], 500)
+    write_pizzabox_adc(paths['an'], 500)
+    write_pizzabox_di(paths['di'], 500)
+    txt = {'enc': qas_handlers.PizzaBoxEncHandler(paths['enc'])(0),
+           'an': qas_handlers.PizzaBoxAnHandler(paths['an'])(0, column=1),
+           'di': qas_handlers.PizzaBoxDIHandler(paths['di'], chunk_size=200)(2)}
+    for kind, fpath in paths.items():
+        qas_handlers.pizzabox_transcoder.submit(fpath, kind)
+    bad_path = str(tmp_path / 'bad.txt')
+    with open(bad_path, 'w') as f:
+        f.write('1 2 3\n')
+    qas_handlers.pizzabox_transcoder.submit(bad_path, 'enc')
+    qas_handlers.pizzabox_transcoder.join()
+
+    # the handlers of the TXT specs read the copies
+    handler = qas_handlers.PizzaBoxEncHandler(paths['enc'])
+    assert isinstance(handler, qas_handlers.PizzaBoxEncHandlerBin)
+    pd.testing.assert_frame_equal(handler(0), txt['enc'], check_dtype=False)
+    handler = qas_handlers.PizzaBoxAnHandler(paths['an'])
+    assert isinstance(handler, qas_handlers.PizzaBoxAnHandlerBin)
+    pd.testing.assert_frame_equal(handler(0, column=1), txt['an'])
+    handler = qas_handlers.PizzaBoxDIHandler(paths['di'], chunk_size=200)
+    assert isinstance(handler, qas_handlers.PizzaBoxDIHandlerBin)
+    np.testing.assert_array_equal(handler(2).ts_ns, txt['di'].ts_ns)
+
+    assert bad_path in qas_handlers.pizzabox_transcoder.failed
+    assert 'could not transcode' in caplog.text
+    assert qas_handlers.pizzabox_bin_copy(bad_path) is None
@@ -0,0 +1,128 @@
+import gc
+
+import numpy as np
+import pytest
+
+from qas_handlers.pool import FileHandlePool, file_handle_pool
+from synthetic_data import PILATUS_DATA_KEY, XS3_DATA_KEY, write_apb, write_pilatus, write_xspress3
+
+
+class Handle:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_lru_eviction():
+    pool = FileHandlePool(max_open=2)
+    handles = {key: pool.get(key, lambda key=key: Handle(key)) for key in 'abc'}
+    assert handles['a'].closed and not handles['b'].closed and len(pool) == 2
+    assert pool.get('b', lambda: Handle('b2')) is handles['b']
+    pool.get('d', lambda: Handle('d'))
+    # 'c' was used less recently than 'b'
+    assert handles['c'].closed and not handles['b'].closed
+    assert pool.stats()['evictions'] == 2
+
+
+def test_pinned_handles_are_not_evicted():
+    pool = FileHandlePool(max_open=1)
+    a = pool.acquire('a', lambda: Handle('a'))
+    b = pool.acquire('b', lambda: Handle('b'))
+    assert not a.closed and not b.closed and len(pool) == 2
+    assert pool.stats()['pinned'] == 2
+    with pool.pinned('a', lambda: Handle('a2')) as handle:
+        assert handle is a
+    assert not a.closed
+    pool.release('a', a)
+    # over max_open, 'a' goes as soon as it is released
+    assert a.closed and not b.closed
+
+    pool.close('b')
+    assert not b.closed
+    pool.release('b', b)
+    assert b.closed and len(pool) == 0
+
+
+def test_clear_closes_pinned_handles():
+    pool = FileHandlePool(max_open=4)
+    a = pool.acquire('a', lambda: Handle('a'))
+    pool.clear()
+    assert a.closed
+    a2 = pool.acquire('a', lambda: Handle('a'))
+    # the release of the closed handle does not unpin the new one
+    pool.release('a', a)
+    assert pool.stats()['pinned'] == 1
+    pool.release('a', a2)
+    assert pool.stats()['pinned'] == 0
+
+
+@pytest.fixture
+def small_pool():
+    max_open = file_handle_pool.max_open
+    file_handle_pool.clear()
+    file_handle_pool.max_open = 1
+    yield file_handle_pool
+    file_handle_pool.max_open = max_open
+    file_handle_pool.clear()
+
+
+def test_image_stacks_keep_their_file(tmp_path, small_pool):
+    pytest.importorskip('databroker')
+    import qas_handlers
+    import h5py
+
+    fpaths = [str(tmp_path / f'pilatus{i}.h5') for i in range(2)]
+    for i, fpath in enumerate(fpaths):
+        write_pilatus(fpath, 4, frame_shape=(8, 6), seed=i)
+    stack = qas_handlers.QASAreaDetectorHDF5SWMRHandler(fpaths[0], frame_per_point=2)(1)
+    # opening the second file would evict the first one
+    other = qas_handlers.QASAreaDetectorHDF5SWMRHandler(fpaths[1])(0)
+    with h5py.File(fpaths[0], 'r') as f:
+        np.testing.assert_array_equal(np.asarray(stack[1]), f[PILATUS_DATA_KEY][3])
+    assert len(small_pool) == 2
+    del stack, other
+    gc.collect()
+    assert len(small_pool) == 1 and small_pool.stats()['pinned'] == 0
+
+
+def test_close_keeps_the_shared_file(tmp_path, small_pool):
+    pytest.importorskip('databroker')
+    import qas_handlers
+
+    fpath = str(tmp_path / 'xs.h5')
+    write_xspress3(fpath, 20, num_bins=16)
+    handler = qas_handlers.QASXspress3HDF5Handler(fpath)
+    expected = handler(frame=5)['ch_1'].copy()
+    other = qas_handlers.QASXspress3HDF5Handler(fpath)
+    other(frame=0)
+    other.close()
+    del other
+    gc.collect()
+    np.testing.assert_array_equal(handler.read_frames(5, 6)['ch_1'][0], expected)
+
+
+def test_pooled_reads_match_the_files(tmp_path, small_pool):
+    # reads jumping between more files than the pool keeps open, against reading the files directly
+    pytest.importorskip('databroker')
+    import qas_handlers
+    import h5py
+
+    rng = np.random.default_rng(0)
+    apb_paths = [str(tmp_path / f'apb{i}.bin') for i in range(3)]
+    xs_paths = [str(tmp_path / f'xs{i}.h5') for i in range(3)]
+    for i, (apb_path, xs_path) in enumerate(zip(apb_paths, xs_paths)):
+        write_apb(apb_path, 1000, seed=i)
+        write_xspress3(xs_path, 30, num_bins=16, seed=i)
+    apb_handlers = [qas_handlers.APBBinFileHandler(fpath, lazy=True) for fpath in apb_paths]
+    xs_handlers = [qas_handlers.QASXspress3HDF5Handler(fpath) for fpath in xs_paths]
+    for i in rng.integers(0, 3, 40):
+        records = np.fromfile(apb_paths[i], dtype=np.int32).reshape(-1, 10)
+        np.testing.assert_array_equal(apb_handlers[i]()['it'], records[:, 1])
+        frame = int(rng.integers(0, 30))
+        with h5py.File(xs_paths[i], 'r') as f:
+            expected = f[XS3_DATA_KEY][frame, 2]
+        np.testing.assert_array_equal(xs_handlers[i](frame=frame)['ch_3'], expected)
+    assert small_pool.stats()['evictions'] > 0 and small_pool.stats()['pinned'] == 0
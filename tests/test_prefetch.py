@@ -0,0 +1,93 @@
+import threading
+
+import numpy as np
+import pytest
+
+import qas_handlers
+from synthetic_data import write_xspress3
+
+
+class Registry:
+    # db.reg of a broker, with the handlers of the resources
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.threads = set()
+
+    def resource_given_datum_id(self, datum_id):
+        return {'uid': datum_id.split(':')[0]}
+
+    def retrieve(self, datum_id):
+        self.threads.add(threading.get_ident())
+        resource_uid, frame = datum_id.split('/') if '/' in datum_id else datum_id.split(':')
+        return self.handlers[resource_uid](int(frame))
+
+
+class Broker:
+    def __init__(self, handlers):
+        self.reg = Registry(handlers)
+
+
+class Header:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def documents(self, fill=False):
+        yield from self.docs
+
+
+def make_run(resources, num_events):
+    descriptor = {'uid': 'd1', 'data_keys': {name: {'external': 'FILESTORE:'} for name in resources}}
+    descriptor['data_keys']['energy'] = {}
+    events = [{'descriptor': 'd1', 'seq_num': i + 1,
+               # the DIFS-like datum ids without the resource uid are looked up
+               'data': {**{name: f'{uid}/{i}' if name != 'di' else f'{uid}:{i}' for name, uid in resources.items()},
+                        'energy': 7000.0 + i}}
+              for i in range(num_events)]
+    return Header([('start', {'uid': 'run'}), ('descriptor', descriptor)] + [('event', e) for e in events]
+                  + [('stop', {'run_start': 'run'})])
+
+
+def test_fill_run():
+    handlers = {'r_apb': lambda i: i * 10, 'r_enc': lambda i: -i, 'r_di': lambda i: np.full(3, i)}
+    db = Broker(handlers)
+    hdr = make_run({'apb': 'r_apb', 'enc': 'r_enc', 'di': 'r_di'}, 20)
+    assert {uid: len(ids) for uid, ids in qas_handlers.get_run_datum_ids(db, hdr).items()} == \
+        {'r_apb': 20, 'r_enc': 20, 'r_di': 20}
+    docs = list(qas_handlers.fill_run(db, hdr, max_workers=3))
+    events = [doc for name, doc in docs if name == 'event']
+    assert [name for name, _ in docs] == [name for name, _ in hdr.documents()]
+    for i, event in enumerate(events):
+        assert event['data']['apb'] == i * 10 and event['data']['enc'] == -i
+        np.testing.assert_array_equal(event['data']['di'], np.full(3, i))
+        assert event['data']['energy'] == 7000.0 + i
+        assert event['filled'] == {'apb': True, 'enc': True, 'di': True}
+
+
+def test_prefetch_shared_files(tmp_path):
+    # the resources of several runs read from the same files, with a pool
+    # smaller than the number of files, from many threads
+    pytest.importorskip('databroker')
+    fpaths = [str(tmp_path / f'xs{i}.h5') for i in range(3)]
+    for i, fpath in enumerate(fpaths):
+        write_xspress3(fpath, 40, num_bins=32, seed=i)
+    expected = [qas_handlers.QASXspress3HDF5Handler(fpath).read_frames()['ch_3'] for fpath in fpaths]
+
+    max_open = qas_handlers.file_handle_pool.max_open
+    qas_handlers.file_handle_pool.clear()
+    qas_handlers.file_handle_pool.max_open = 1
+    try:
+        handlers = {}
+        for r in range(12):
+            handler = qas_handlers.QASXspress3HDF5Handler(fpaths[r % 3])
+            handler.block_bytes = 5 * 6 * 32 * 4
+            handlers[f'r{r}'] = lambda frame, handler=handler: handler(frame=frame)['ch_3'].copy()
+        db = Broker(handlers)
+        hdr = make_run({f'xs{r}': f'r{r}' for r in range(12)}, 40)
+        data = qas_handlers.prefetch_run(db, hdr, max_workers=6)
+        for r in range(12):
+            np.testing.assert_array_equal([data[f'r{r}/{i}'] for i in range(40)], expected[r % 3])
+        assert len(db.reg.threads) > 1
+        assert qas_handlers.file_handle_pool.stats()['pinned'] == 0
+    finally:
+        qas_handlers.file_handle_pool.max_open = max_open
+        qas_handlers.file_handle_pool.clear()
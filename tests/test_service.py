@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from qas_processing import service
+
+
+class BrokenExecutor:
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool('a worker was killed')
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_broken_pool_is_rebuilt(monkeypatch):
+    # the thread pools stand in for the process pools, process_fly_scan for the binning
+    pools = [BrokenExecutor(), ThreadPoolExecutor(1)]
+    monkeypatch.setattr(service, 'make_process_pool', lambda max_workers: pools.pop(0))
+    monkeypatch.setattr(service, 'process_fly_scan', lambda uid, db_name: f'{uid}.dat')
+    auto_processing = service.AutoProcessing(max_workers=1, retry_delay=0)
+    try:
+        auto_processing.submit('run1')
+        assert wait_for(lambda: auto_processing.jobs['run1']['state'] == 'done')
+        assert auto_processing.jobs['run1']['attempts'] == 2 and not pools
+        # the worker of the failed submit was released
+        auto_processing.submit('run2')
+        assert wait_for(lambda: auto_processing.jobs['run2']['state'] == 'done')
+    finally:
+        auto_processing.close(wait=True)
+
+
+def test_close_stops_the_waiting_dispatcher(monkeypatch):
+    release = threading.Event()
+
+    def process_fly_scan(uid, db_name):
+        release.wait(10)
+        return f'{uid}.dat'
+    monkeypatch.setattr(service, 'make_process_pool', lambda max_workers: ThreadPoolExecutor(max_workers))
+    monkeypatch.setattr(service, 'process_fly_scan', process_fly_scan)
+    auto_processing = service.AutoProcessing(max_workers=1)
+    try:
+        auto_processing.submit('run1')
+        auto_processing.submit('run2')
+        assert wait_for(lambda: auto_processing.jobs['run1']['state'] == 'running')
+        # the dispatcher waits for the worker of run1
+        dispatcher = auto_processing._dispatcher
+        auto_processing.close()
+        dispatcher.join(5)
+        assert not dispatcher.is_alive()
+        assert auto_processing.jobs['run2']['state'] == 'queued'
+    finally:
+        release.set()
+    # a new dispatcher is started by the next run
+    assert wait_for(lambda: auto_processing.jobs['run1']['state'] == 'done')
+    auto_processing.submit('run3')
+    assert wait_for(lambda: auto_processing.jobs['run3']['state'] == 'done')
+    auto_processing.close(wait=True)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from startup_files import load_startup
+
+PILATUS_HDF5 = ['ROOT_PATH', 'RAW_PATH', 'PilatusDetectorCamV33', 'HDF5PluginBloscV33', 'HDF5PluginWithFileStore',
+                'QASROIStatPlugin', 'PilatusDetectorNonBlocking', 'PilatusBase', 'SWMRFlushPolicy',
+                'pilatus_hdf5_compression', 'PilatusHDF5']
+
+
+@pytest.mark.parametrize('frame_rate, live, expected', [
+    (None, False, 1), (0, True, 1), (10, False, 10), (10, True, 1), (400, True, 20), (5000, False, 1000),
+])
+def test_swmr_flush_policy(frame_rate, live, expected):
+    policy = load_startup('82-pilatus.py', ['SWMRFlushPolicy'], imports=False)['SWMRFlushPolicy']()
+    assert policy.num_frames_flush(frame_rate, live=live) == expected
+
+
+@pytest.fixture
+def pilatus_hdf5(monkeypatch):
+    pytest.importorskip('ophyd')
+    pytest.importorskip('nslsii')
+    from ophyd.sim import make_fake_device
+
+    namespace = load_startup('82-pilatus.py', PILATUS_HDF5, {'np': np})
+    # only the settings of PilatusHDF5 itself are staged
+    monkeypatch.setattr(namespace['PilatusBase'], 'stage', lambda self: [self])
+    return make_fake_device(namespace['PilatusHDF5'])('TEST:', name='pilatus')
+
+
+@pytest.mark.parametrize('frame_rate, live, expected', [(None, False, 1), (400, False, 400), (400, True, 20)])
+def test_pilatus_hdf5_stage(pilatus_hdf5, frame_rate, live, expected):
+    pilatus_hdf5.get_frame_rate = lambda: frame_rate
+    pilatus_hdf5.live_consumer = live
+    pilatus_hdf5.stage()
+    assert pilatus_hdf5.hdf5.stage_sigs[pilatus_hdf5.hdf5.num_frames_flush] == expected
+    assert pilatus_hdf5.hdf5.stage_sigs[pilatus_hdf5.hdf5.swmr_mode] == 'On'
+    # recorded with the configuration of the detector
+    assert 'pilatus_hdf5_num_frames_flush' in pilatus_hdf5.read_configuration()
+
+
+def test_set_compression(pilatus_hdf5):
+    hdf5 = pilatus_hdf5.hdf5
+    pilatus_hdf5.set_compression('blosc-zstd')
+    assert hdf5.stage_sigs[hdf5.compression] == 'Blosc'
+    assert hdf5.stage_sigs[hdf5.blosc_compressor] == 'ZSTD' and hdf5.stage_sigs[hdf5.blosc_level] == 3
+    # the file is configured before the capture starts
+    assert list(hdf5.stage_sigs)[-1] == 'capture'
+    pilatus_hdf5.set_compression('bslz4')
+    assert hdf5.stage_sigs[hdf5.compression] == 'BSLZ4' and hdf5.blosc_compressor not in hdf5.stage_sigs
+    pilatus_hdf5.set_compression(None)
+    assert hdf5.stage_sigs[hdf5.compression] == 'None' and pilatus_hdf5.compression_mode is None
+    with pytest.raises(ValueError):
+        pilatus_hdf5.set_compression('gzip')
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from baseline import bin_samples, sweep_bounds
+from qas_processing import binning, sweeps
+from synthetic_data import write_apb, write_pizzabox_enc
+
+PULSES_PER_DEG, ANGLE_OFFSET, E0 = 100_000, 10, 9000
+
+
+def test_split_sweeps():
+    rng = np.random.default_rng(0)
+    position = 100_000 * np.sin(np.linspace(0, 7 * np.pi, 5000))
+    # jitter of a few counts, also at the turns
+    encoder = (position + rng.integers(-3, 4, len(position))).astype(np.int64)
+    for min_amplitude in (50, 20_000):
+        np.testing.assert_array_equal(sweeps.split_sweeps(encoder, min_amplitude), sweep_bounds(encoder, min_amplitude))
+    assert len(sweeps.split_sweeps(encoder, 20_000)) == 8
+
+
+@pytest.mark.parametrize('value, expected', [
+    (1, True), (1.0, True), (np.int64(1), True), (True, True), ('Oscillatory', True), (' oscillatory\n', True),
+    ('True', True), ('1', True), ('1.0', True),
+    (0, False), (0.0, False), (False, False), (None, False), ('Standard', False), ('False', False), ('0', False),
+    ('', False),
+])
+def test_is_oscillatory(value, expected):
+    assert sweeps.is_oscillatory({'oscillatory': value}) is expected
+    assert sweeps.is_oscillatory({}) is False
+
+
+class Registry:
+    def __init__(self, resources):
+        self.resources = resources
+
+    def resource_given_datum_id(self, datum_id):
+        return self.resources[datum_id]
+
+
+class Broker:
+    def __init__(self, resources):
+        self.reg = Registry(resources)
+
+
+class Header:
+    stream_names = ['apb_stream', 'pb1_enc1']
+
+    def __init__(self, start):
+        self.start = start
+
+    def table(self, stream_name, fill=False):
+        return pd.DataFrame({stream_name: [f'{stream_name}/0']})
+
+
+@pytest.fixture
+def oscillatory_scan(tmp_path):
+    pytest.importorskip('databroker')
+    import qas_handlers
+
+    # 2 s of encoder at 10 kHz with 5 sweeps and of APB at 50 kHz
+    write_pizzabox_enc(str(tmp_path / 'enc.txt'), 20_000)
+    write_apb(str(tmp_path / 'apb.bin'), 100_000, fa_rate=50_000)
+    db = Broker({'apb_stream/0': {'spec': 'APB', 'root': str(tmp_path), 'resource_path': 'apb.bin',
+                                  'resource_kwargs': {}},
+                 'pb1_enc1/0': {'spec': 'PIZZABOX_ENC_FILE_TXT', 'root': str(tmp_path), 'resource_path': 'enc.txt',
+                                'resource_kwargs': {'chunk_size': 1024}}})
+    hdr = Header({'uid': 'run', 'e0': E0, 'pulses_per_degree': PULSES_PER_DEG, 'angle_offset': ANGLE_OFFSET,
+                  'trajectory_name': 'osc.txt', 'lut_number': 1, 'oscillatory': 'True'})
+    yield db, hdr
+    qas_handlers.file_handle_pool.clear()
+
+
+def test_bin_oscillatory_scan(oscillatory_scan):
+    db, hdr = oscillatory_scan
+    spectra, table = sweeps.bin_oscillatory_scan(db, hdr, max_workers=1, plan_cache=None)
+    assert len(spectra) == len(table) == 5
+    assert list(table['direction']) == [1, -1, 1, -1, 1]
+
+    apb, settings, encoder_df = sweeps.read_fly_streams(db, hdr)
+    encoder_timestamps, encoder = encoder_df['timestamp'].to_numpy(), encoder_df['encoder'].to_numpy()
+    timestamps = apb['timestamp']
+    energy_grid = spectra[0]['energy'].to_numpy()
+    middles = (energy_grid[1:] + energy_grid[:-1]) / 2
+    edges = np.concatenate([[2 * energy_grid[0] - middles[0]], middles, [2 * energy_grid[-1] - middles[-1]]])
+
+    def to_energy(position):
+        return binning.encoder_to_energy(position, PULSES_PER_DEG, ANGLE_OFFSET)
+
+    for spectrum, (start, stop) in zip(spectra, sweep_bounds(encoder, (encoder.max() - encoder.min()) / 10)):
+        np.testing.assert_array_equal(spectrum['energy'], energy_grid)
+        in_sweep = (timestamps >= encoder_timestamps[start]) & (timestamps <= encoder_timestamps[stop - 1])
+        counts, means = bin_samples(timestamps[in_sweep], {'i0': apb.records['i0'][in_sweep]},
+                                    encoder_timestamps[start:stop], encoder[start:stop], edges, to_energy=to_energy)
+        np.testing.assert_array_equal(spectrum['counts'], counts)
+        # i0 is in volts
+        np.testing.assert_allclose(spectrum['i0'], (means['i0'] - settings.offsets[0]) / settings.gains[0],
+                                   equal_nan=True)
+
+    # the same spectra from the spawned workers
+    parallel, _ = sweeps.bin_oscillatory_scan(db, hdr, max_workers=2, plan_cache=None)
+    for spectrum, expected in zip(parallel, spectra):
+        pd.testing.assert_frame_equal(spectrum, expected)
@@ -0,0 +1,16 @@
+from qas_processing import sweeps
+from qas_processing.workers import make_process_pool
+
+
+def _worker_state():
+    return dict(sweeps._worker)
+
+
+def test_spawned_workers():
+    sweeps._worker['parent'] = True
+    try:
+        with make_process_pool(1) as executor:
+            # a forked worker would see the state of this process
+            assert executor.submit(_worker_state).result(timeout=60) == {}
+    finally:
+        sweeps._worker.pop('parent')
@@ -0,0 +1,117 @@
+import subprocess
+import sys
+import textwrap
+import tracemalloc
+
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip('databroker')
+import qas_handlers
+from synthetic_data import XS3_DATA_KEY, XS3_ROI_KEY, write_xspress3
+
+
+@pytest.fixture
+def xs_file(tmp_path):
+    fpath = str(tmp_path / 'xs.h5')
+    write_xspress3(fpath, 250, num_bins=1024)
+    with h5py.File(fpath, 'r') as f:
+        spectra = f[XS3_DATA_KEY][()]
+        rois = {name: dataset[()] for name, dataset in f[XS3_ROI_KEY].items()}
+    yield fpath, spectra, rois
+    qas_handlers.file_handle_pool.clear()
+
+
+def test_frames(xs_file):
+    fpath, spectra, rois = xs_file
+    handler = qas_handlers.QASXspress3HDF5Handler(fpath)
+    handler.frames_per_block = 100
+    assert handler.num_frames == len(spectra)
+    for frame in (0, 99, 100, 101, 249, -1):
+        data = handler(frame=frame)
+        for i in range(6):
+            np.testing.assert_array_equal(data[f'ch_{i + 1}'], spectra[frame, i])
+        assert data['CHAN3ROI2'] == rois['CHAN3ROI2'][frame]
+    data = handler.read_frames(20, 180)
+    np.testing.assert_array_equal(data['ch_4'], spectra[20:180, 3])
+    np.testing.assert_array_equal(data['CHAN6ROI4'], rois['CHAN6ROI4'][20:180])
+
+    data = qas_handlers.QASXspress3HDF5Handler(fpath, dtype='float32').read_frames(columns='spectra')
+    assert data['ch_1'].dtype == np.float32
+    np.testing.assert_array_equal(data['ch_1'], spectra[:, 0])
+    # the fractional ROIs are not truncated to an integer dtype of the spectra
+    handler = qas_handlers.QASXspress3HDF5Handler(fpath, dtype='uint32')
+    data = handler.read_frames()
+    assert data['ch_2'].dtype == np.uint32 and handler(frame=3)['ch_2'].dtype == np.uint32
+    assert not np.all(rois['CHAN1ROI1'] == np.floor(rois['CHAN1ROI1']))
+    for name in rois:
+        np.testing.assert_array_equal(data[name], rois[name])
+    assert handler(frame=3)['CHAN2ROI3'] == rois['CHAN2ROI3'][3]
+    light = qas_handlers.QASXspress3HDF5Handler_light(fpath)
+    assert light.dataset is None
+    assert set(light(frame=7)) == set(rois)
+
+
+def test_frames_memory(xs_file):
+    # the frames are read block by block, the whole dataset is never in memory
+    fpath, spectra, _ = xs_file
+    handler = qas_handlers.QASXspress3HDF5Handler(fpath)
+    handler.block_bytes = 25 * 6 * 1024 * 4
+    tracemalloc.start()
+    try:
+        total = sum(int(handler(frame=frame)['ch_1'].sum()) for frame in range(handler.num_frames))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert total == spectra[:, 0].sum()
+    assert peak < spectra.nbytes / 4
+
+
+writer = textwrap.dedent('''
+    import sys
+    import h5py
+    import numpy as np
+    with h5py.File(sys.argv[1], 'w', libver='latest') as f:
+        spectra = f.create_dataset({data_key!r}, shape=(0, 6, 64), maxshape=(None, 6, 64), dtype='<u4',
+                                   chunks=(1, 6, 64))
+        rois = [f.create_dataset(f'{roi_key}/CHAN{{c}}ROI{{r}}', shape=(0,), maxshape=(None,), dtype='<f8',
+                                 chunks=(64,)) for c in range(1, 7) for r in range(1, 5)]
+        f.swmr_mode = True
+        for line in sys.stdin:
+            num_frames = spectra.shape[0] + int(line)
+            for dataset in [spectra] + rois:
+                dataset.resize(num_frames, axis=0)
+            spectra[-int(line):] = np.arange(num_frames - int(line), num_frames)[:, None, None]
+            for dataset in rois:
+                dataset[-int(line):] = np.arange(num_frames - int(line), num_frames)
+            for dataset in [spectra] + rois:
+                dataset.flush()
+            print(num_frames, flush=True)
+''').format(data_key=XS3_DATA_KEY, roi_key=XS3_ROI_KEY)
+
+
+def test_swmr(tmp_path):
+    fpath = str(tmp_path / 'xs_swmr.h5')
+    process = subprocess.Popen([sys.executable, '-c', writer, fpath], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, text=True)
+
+    def write(num_frames):
+        process.stdin.write(f'{num_frames}\n')
+        process.stdin.flush()
+        return int(process.stdout.readline())
+
+    try:
+        write(10)
+        handler = qas_handlers.QASXspress3HDF5Handler(fpath, swmr=True)
+        assert handler.num_frames == 10
+        assert handler(frame=9)['ch_1'][0] == 9
+        write(15)
+        # the frames written after the file was opened are found
+        data = handler(frame=20)
+        assert data['ch_6'][0] == 20 and data['CHAN1ROI1'] == 20
+        assert handler.read_frames()['ch_2'].shape == (25, 64)
+    finally:
+        process.stdin.close()
+        process.wait(10)
+        qas_handlers.file_handle_pool.clear()